@@ -13,15 +13,24 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
+import mmap
 import os
 import random
 import string
+import threading
 import urlparse
 
 import dtest
+import eventlet
+from eventlet import queue
 from glance import client as glanceclient
 import novaclient
 
+import cleanup
+import profiler
+import tracing
+import utils
 
 FLAGS = None
 
@@ -56,6 +65,10 @@ def add_opts(opts):
                     action="store", type="string", dest="project_id",
                     default=os.environ.get('NOVA_PROJECT_ID', 'openstack'),
                     help="The project ID for the client [default %default].")
+    opts.add_option("--no-client-pool",
+                    action="store_false", dest="client_pool", default=True,
+                    help="Authenticate a new client for every test instead "
+                    "of reusing authenticated clients from a pool.")
     opts.add_option("--second-project",
                     action="store", type="string", dest="second_project",
                     help="Secondary project ID for certain tests.  If not "
@@ -101,6 +114,115 @@ def add_opts(opts):
                     default="bad_test_image.img",
                     help="Image to use for broken image tests "
                     "[default %default].")
+    opts.add_option("--server-pool-size",
+                    action="store", type="int", dest="server_pool_size",
+                    default=2,
+                    help="Number of instances to boot at the start of the "
+                    "run for the tests to share; 0 makes the tests boot "
+                    "their own [default %default].")
+    opts.add_option("--no-image-cache",
+                    action="store_false", dest="image_cache", default=True,
+                    help="Always upload a new Glance image, instead of "
+                    "reusing an identical image registered earlier.")
+    opts.add_option("--catalog-ttl",
+                    action="store", type="float", dest="catalog_ttl",
+                    default=300.0,
+                    help="Seconds for which the cached flavor and image "
+                    "catalogs are used before being revalidated "
+                    "[default %default].")
+    opts.add_option("--history",
+                    action="store", type="string", dest="history",
+                    default=".backfire-history.json",
+                    help="File in which to keep how long each test took "
+                    "in recent runs, to run the longest chains of "
+                    "dependent tests first [default %default].")
+    opts.add_option("--no-history",
+                    action="store_const", const=None, dest="history",
+                    help="Neither use nor record the test history.")
+    opts.add_option("--critical-path",
+                    action="store", type="string", dest="critical_path",
+                    help="After running tests, a GraphViz graph of the "
+                    "predicted and actual critical paths through the "
+                    "dependency graph is placed in the indicated file.")
+    opts.add_option("--trace-file",
+                    action="store", type="string", dest="trace_file",
+                    help="Trace the phases of every HTTP request made by "
+                    "the Nova and Glance clients, and write the trace to "
+                    "the indicated file in the Chrome trace event "
+                    "format.")
+    opts.add_option("--name-prefix",
+                    action="store", type="string", dest="name_prefix",
+                    default="backfire-",
+                    help="Prefix of the names of all resources created by "
+                    "the tests [default %default].")
+    opts.add_option("--cleanup-only",
+                    action="store_true", dest="cleanup_only",
+                    help="Instead of running the tests, delete all resources "
+                    "whose names begin with --name-prefix.")
+    opts.add_option("--cleanup-workers",
+                    action="store", type="int", dest="cleanup_workers",
+                    default=10,
+                    help="Maximum number of resources to delete at once when "
+                    "cleaning up [default %default].")
+    opts.add_option("--cleanup-retries",
+                    action="store", type="int", dest="cleanup_retries",
+                    default=3,
+                    help="Number of times to retry a failed delete when "
+                    "cleaning up [default %default].")
+    opts.add_option("--fake-cloud",
+                    action="store_true", dest="fake_cloud",
+                    help="Run the tests against an in-process stand-in for "
+                    "Nova and Glance, instead of --nova-url and "
+                    "--glance-host.")
+    opts.add_option("--fake-port",
+                    action="store", type="int", dest="fake_port",
+                    default=0,
+                    help="Port for --fake-cloud to listen on; by default, "
+                    "an unused port is chosen.")
+    opts.add_option("--fake-latency",
+                    action="store", type="string", dest="fake_latency",
+                    default="0",
+                    help="Distribution of the time, in seconds, "
+                    "--fake-cloud takes to answer a request "
+                    "[default %default].")
+    opts.add_option("--fake-build-time",
+                    action="store", type="string", dest="fake_build_time",
+                    default="2",
+                    help="Distribution of the time, in seconds, "
+                    "--fake-cloud takes to build an instance or image "
+                    "[default %default].")
+    opts.add_option("--fake-resize-time",
+                    action="store", type="string", dest="fake_resize_time",
+                    default="2",
+                    help="Distribution of the time, in seconds, "
+                    "--fake-cloud takes to resize an instance "
+                    "[default %default].")
+    opts.add_option("--fake-reboot-time",
+                    action="store", type="string", dest="fake_reboot_time",
+                    default="1",
+                    help="Distribution of the time, in seconds, "
+                    "--fake-cloud takes to reboot an instance "
+                    "[default %default].")
+    opts.add_option("--fake-error-rate",
+                    action="store", type="float", dest="fake_error_rate",
+                    default=0.0,
+                    help="Fraction of requests --fake-cloud fails with an "
+                    "internal server error [default %default].")
+    opts.add_option("--fake-fault-rate",
+                    action="store", type="float", dest="fake_fault_rate",
+                    default=0.0,
+                    help="Fraction of instance builds --fake-cloud fails "
+                    "[default %default].")
+    opts.add_option("--fake-seed",
+                    action="store", type="int", dest="fake_seed",
+                    default=None,
+                    help="Seed for the random choices made by "
+                    "--fake-cloud, for reproducible runs.")
+    opts.add_option("--results-db",
+                    action="store", type="string", dest="results_db",
+                    help="SQLite database in which to record the samples "
+                    "and summary statistics of stress runs; see "
+                    "tools/stress_results.py.")
     opts.add_option("--stress",
                     action="store_true", dest="stress",
                     help="Whether to execute the stress tests or "
@@ -115,16 +237,172 @@ def add_opts(opts):
                     default=500,
                     help="Desired number of instance creates per minute for "
                     "stress testing [default %default].")
+    opts.add_option("--rate-tolerance",
+                    action="store", type="float", dest="rate_tolerance",
+                    default=5.0,
+                    help="Percentage by which the request and create rates "
+                    "may fall short of their targets and still pass "
+                    "[default %default].")
+    opts.add_option("--max-in-flight",
+                    action="store", type="int", dest="max_in_flight",
+                    default=None,
+                    help="Maximum number of outstanding requests or creates "
+                    "during stress testing; by default, the number issued "
+                    "per minute.")
+    opts.add_option("--workers",
+                    action="store", type="int", dest="workers",
+                    default=0,
+                    help="Split the stress test rates among this many local "
+                    "worker processes, merging their statistics.")
+    opts.add_option("--remote-workers",
+                    action="store", type="int", dest="remote_workers",
+                    default=0,
+                    help="Also split the stress test rates among this many "
+                    "workers on other hosts, started with --coordinator.")
+    opts.add_option("--coordinator-host",
+                    action="store", type="string", dest="coordinator_host",
+                    default=None,
+                    help="Address on which to listen for stress workers; by "
+                    "default, all addresses if --remote-workers is given, "
+                    "or the loopback address otherwise.")
+    opts.add_option("--coordinator-port",
+                    action="store", type="int", dest="coordinator_port",
+                    default=0,
+                    help="Port on which to listen for stress workers; by "
+                    "default, any free port.")
+    opts.add_option("--checkin-timeout",
+                    action="store", type="int", dest="checkin_timeout",
+                    default=300,
+                    help="Seconds to wait for all the stress workers to "
+                    "connect before giving up [default %default].")
+    opts.add_option("--coordinator",
+                    action="store", type="string", dest="coordinator",
+                    default=None, metavar="HOST:PORT",
+                    help="Run the stress tests as a worker of the given "
+                    "coordinator.")
     opts.add_option("--request-time",
                     action="store", type="int", dest="request_time",
                     default=200,
                     help="Desired average request time in milliseconds for "
                     "stress testing [default %default].")
+    opts.add_option("--request-p99",
+                    action="store", type="float", dest="request_p99",
+                    default=None,
+                    help="Desired 99th percentile request time in "
+                    "milliseconds for stress testing, counting failed "
+                    "and timed out requests.")
+    opts.add_option("--omission-correction",
+                    action="store", type="choice",
+                    dest="omission_correction", default="schedule",
+                    choices=("schedule", "backfill", "none"),
+                    help="How to correct stress request times for requests "
+                    "held back by earlier ones: \"schedule\" measures from "
+                    "when each was scheduled, \"backfill\" adds the "
+                    "samples a slow request held back, and \"none\" "
+                    "measures from when each was sent [default %default].")
     opts.add_option("--create-time",
                     action="store", type="int", dest="create_time",
                     default=None,
                     help="Desired average instance creation time in "
                     "milliseconds for stress testing.")
+    opts.add_option("--image-uploads",
+                    action="store", type="int", dest="image_uploads",
+                    default=0,
+                    help="Number of Glance image uploads in each sample of "
+                    "the image upload stress tests; 0 skips them "
+                    "[default %default].")
+    opts.add_option("--image-sizes",
+                    action="store", type="string", dest="image_sizes",
+                    default="1,16", metavar="MB[,MB...]",
+                    help="Comma-separated sizes, in megabytes, of the "
+                    "images uploaded by the image upload stress tests, "
+                    "which take turns [default %default].")
+    opts.add_option("--image-data",
+                    action="store", type="choice", dest="image_data",
+                    default="sparse", choices=("sparse", "random"),
+                    help="Contents of the generated images uploaded by the "
+                    "image upload stress tests: \"sparse\" files of zeros, "
+                    "or \"random\" data, which defeats compression and "
+                    "deduplication [default %default].")
+    opts.add_option("--image-concurrency",
+                    action="store", type="int", dest="image_concurrency",
+                    default=4,
+                    help="Number of image uploads kept in progress at once "
+                    "by the image upload stress tests [default %default].")
+    opts.add_option("--image-upload-rate",
+                    action="store", type="float", dest="image_upload_rate",
+                    default=None,
+                    help="Desired average throughput, in megabytes per "
+                    "second, of each image upload for stress testing.")
+    opts.add_option("--image-available-time",
+                    action="store", type="int", dest="image_available_time",
+                    default=None,
+                    help="Desired average time in milliseconds from the "
+                    "start of an image upload until Nova lists the image "
+                    "as active, for stress testing.")
+    opts.add_option("--image-delete-time",
+                    action="store", type="int", dest="image_delete_time",
+                    default=None,
+                    help="Desired average image delete time in "
+                    "milliseconds for stress testing.")
+    opts.add_option("--soak-duration",
+                    action="store", type="float", dest="soak_duration",
+                    default=0,
+                    help="With --stress, instead of the burst tests, keep "
+                    "up the request and create rates for this many "
+                    "minutes, reporting on each --soak-window.")
+    opts.add_option("--soak-window",
+                    action="store", type="int", dest="soak_window",
+                    default=60,
+                    help="Length, in seconds, of the windows reported on "
+                    "during a soak test [default %default].")
+    opts.add_option("--soak-max-error-rate",
+                    action="store", type="float", dest="soak_max_error_rate",
+                    default=None,
+                    help="Abort a soak test if the fraction of requests or "
+                    "creates which fail in a window exceeds this.")
+    opts.add_option("--scenario",
+                    action="store", type="string", dest="scenario",
+                    default=None, metavar="FILE",
+                    help="With --stress, instead of the burst tests, run "
+                    "the mixed workload described by this JSON file.")
+    opts.add_option("--scenario-seed",
+                    action="store", type="int", dest="scenario_seed",
+                    default=None,
+                    help="Seed for the choices made by --scenario, in place "
+                    "of the seed given in the workload file.")
+    opts.add_option("--endpoint-slo",
+                    action="append", type="string", dest="endpoint_slos",
+                    default=[], metavar="ENDPOINT:STAT=MS",
+                    help="Maximum request time, in milliseconds, of a "
+                    "statistic of an API call during stress testing, e.g. "
+                    "\"servers.get:p99=500\"; STAT is \"average\" or a "
+                    "percentile above p0 and below p100.  May be given more "
+                    "than once.")
+    opts.add_option("--metrics-port",
+                    action="store", type="int", dest="metrics_port",
+                    default=None,
+                    help="Serve live stress test metrics in the Prometheus "
+                    "text format on this port of the loopback address; 0 "
+                    "picks a free port.")
+    opts.add_option("--dashboard",
+                    action="store_true", dest="dashboard",
+                    help="Print a line of live stress test progress every "
+                    "--dashboard-interval seconds.")
+    opts.add_option("--dashboard-interval",
+                    action="store", type="int", dest="dashboard_interval",
+                    default=10,
+                    help="Seconds between --dashboard lines "
+                    "[default %default].")
+    opts.add_option("--streaming-stats",
+                    action="store_true", dest="streaming_stats",
+                    help="Collect stress testing statistics in constant "
+                    "memory, with approximate percentiles.")
+    opts.add_option("--stats-error",
+                    action="store", type="float", dest="stats_error",
+                    default=0.01,
+                    help="Relative error bound for approximate percentiles "
+                    "when --streaming-stats is given [default %default].")
 
 
 def extract_opts(options):
@@ -144,6 +422,274 @@ def extract_opts(options):
     if FLAGS.second_project is None:
         FLAGS.second_project = FLAGS.project_id
 
+    # Soak tests run too long to keep every sample
+    if FLAGS.soak_duration:
+        FLAGS.streaming_stats = True
+
+    # Parse the endpoint SLOs
+    FLAGS.endpoint_slos = [parse_slo(slo) for slo in FLAGS.endpoint_slos]
+
+    # Parse the image sizes
+    try:
+        FLAGS.image_sizes = [float(size) for size in
+                             FLAGS.image_sizes.split(',')]
+        if min(FLAGS.image_sizes) <= 0:
+            raise ValueError()
+    except ValueError:
+        raise ValueError("Invalid image sizes %r; expected a "
+                         "comma-separated list of positive megabytes" %
+                         FLAGS.image_sizes)
+
+
+def parse_slo(slo):
+    """Parse an --endpoint-slo option.
+
+    Returns a tuple of the manager, the method, the percentile (as a
+    float between 0 and 1, or None for the average), and the maximum
+    time in milliseconds.  Raises ValueError if the option is invalid.
+    """
+
+    try:
+        endpoint, spec = slo.split(':', 1)
+        manager, method = endpoint.split('.', 1)
+        stat, limit = spec.split('=', 1)
+        if stat == 'average':
+            percent = None
+        elif stat.startswith('p'):
+            percent = float(stat[1:]) / 100.0
+            if not 0.0 < percent < 1.0:
+                raise ValueError()
+        else:
+            raise ValueError()
+
+        return manager, method, percent, float(limit)
+    except ValueError:
+        raise ValueError("Invalid endpoint SLO %r; expected "
+                         "\"<manager>.<method>:<average|pNN>=<ms>\", "
+                         "with NN between 0 and 100" % slo)
+
+
+class ClientPool(object):
+    """Process-wide pool of authenticated OpenStack clients.
+
+    Clients are keyed by the username, project ID, and authentication
+    URL they were created with.  A client obtained with get() is for
+    the exclusive use of the caller until it is handed back with
+    put(), so that its keep-alive HTTP connections are never shared
+    between threads.  When no idle client is available for a key, a
+    new one is built using the most recent authentication token for
+    that key, so only the first client for a key actually calls the
+    authentication endpoint.  Expired tokens are refreshed by the
+    client itself: novaclient re-authenticates and retries a request
+    that is rejected as unauthorized.
+    """
+
+    def __init__(self):
+        """Initialize a ClientPool."""
+
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._tokens = {}
+
+    def get(self, username, api_key, project_id, auth_url):
+        """Obtain an authenticated client for exclusive use."""
+
+        key = (username, project_id, auth_url)
+
+        # Grab an idle client or the current token for the key
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+            token = self._tokens.get(key)
+
+        # Set up a new client
+        os = novaclient.OpenStack(username, api_key, project_id, auth_url)
+        os.client.request = tracing.client_call(
+            'nova', profiler.api_call(os.client.request))
+        os._pool_key = key
+
+        if token is None:
+            # Do the authenticate now, so we fail early
+            os.authenticate()
+        else:
+            # Reuse the authentication of an existing client
+            os.client.auth_token, os.client.management_url = token
+
+        with self._lock:
+            self._tokens[key] = (os.client.auth_token,
+                                 os.client.management_url)
+
+        return os
+
+    def put(self, os):
+        """Return a client obtained from get() to the pool.
+
+        Clients that did not come from the pool are ignored.
+        """
+
+        key = getattr(os, '_pool_key', None)
+        if key is None:
+            return
+
+        with self._lock:
+            # The client may have re-authenticated; share its token
+            self._tokens[key] = (os.client.auth_token,
+                                 os.client.management_url)
+            self._idle.setdefault(key, []).append(os)
+
+
+# The process-wide client pool
+client_pool = ClientPool()
+
+
+class MappedImage(object):
+    """File-like view of a memory-mapped image file.
+
+    Glance reads the image data in chunks through the read() method;
+    mapping the file lets those chunks come straight from the page
+    cache, without going through a file object's buffering.
+    """
+
+    def __init__(self, file_name):
+        """Map the named file."""
+
+        with open(file_name, 'rb') as f:
+            self.size = os.fstat(f.fileno()).st_size
+            if self.size > 0:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._map = None
+        self._pos = 0
+
+    def read(self, size=-1):
+        """Read up to size bytes, or everything that is left."""
+
+        if self._map is None:
+            return ''
+
+        if size < 0:
+            size = self.size - self._pos
+        data = self._map[self._pos:self._pos + size]
+        self._pos += len(data)
+
+        return data
+
+    def __len__(self):
+        """Return the size of the image."""
+
+        return self.size
+
+    def close(self):
+        """Unmap the file."""
+
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+class ImageCache(object):
+    """Content-addressed cache of images registered with Glance.
+
+    Images are keyed by the MD5 digest of their contents, along with
+    their type and visibility.  Images registered through the cache
+    carry the digest and type in the 'backfire_digest' property, so
+    an identical image can be found again in Glance, even if it was
+    uploaded by an earlier run.  Cached images are meant to be shared,
+    and so must not be deleted by the tests that use them.
+    """
+
+    # The image property holding the content digest
+    digest_property = 'backfire_digest'
+
+    # Size of the chunks the file is digested in
+    chunk_size = 1024 * 1024
+
+    def __init__(self):
+        """Initialize an ImageCache."""
+
+        self._lock = threading.Lock()
+        self._digests = {}
+        self._images = {}
+        self._key_locks = {}
+
+    def digest(self, file_name):
+        """Return the MD5 digest of the named file.
+
+        Digests are remembered for as long as the file's size and
+        modification time stay the same.
+        """
+
+        st = os.stat(file_name)
+        stamp = (os.path.abspath(file_name), st.st_size, st.st_mtime)
+
+        with self._lock:
+            if stamp in self._digests:
+                return self._digests[stamp]
+
+        md5 = hashlib.md5()
+        img = MappedImage(file_name)
+        try:
+            for chunk in iter(lambda: img.read(self.chunk_size), ''):
+                md5.update(chunk)
+        finally:
+            img.close()
+
+        with self._lock:
+            self._digests[stamp] = md5.hexdigest()
+            return self._digests[stamp]
+
+    def upload(self, c, file_name, meta):
+        """Upload the named file to Glance; returns the new metadata."""
+
+        img = MappedImage(file_name)
+        try:
+            meta = dict(meta, size=len(img))
+            return c.add_image(meta, img)
+        finally:
+            img.close()
+
+    def get(self, c, file_name, meta):
+        """Return the metadata of an image matching the named file.
+
+        Returns the metadata of an identical image, if one has already
+        been registered, or uploads the file and returns the metadata
+        of the new image.
+        """
+
+        digest = '%s:%s' % (self.digest(file_name), meta['type'])
+        key = (digest, meta['is_public'])
+
+        # Only upload any given image once
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            if key not in self._images:
+                self._images[key] = (self._find(c, key) or
+                                     self.upload(c, file_name, dict(
+                                         meta, properties={
+                                             self.digest_property: digest})))
+
+            return self._images[key]
+
+    def _find(self, c, key):
+        """Find an image registered by an earlier run."""
+
+        digest, is_public = key
+        for img in c.get_images_detailed():
+            if (img.get('properties', {}).get(self.digest_property) ==
+                digest and img.get('is_public') == is_public and
+                img.get('status', '').lower() == 'active'):
+                return img
+
+        return None
+
+
+# The process-wide image cache and Glance connection
+image_cache = ImageCache()
+glance_connection = None
+
 
 class BaseIntegrationTest(dtest.DTestCase):
     """Base integration test.
@@ -151,57 +697,99 @@ class BaseIntegrationTest(dtest.DTestCase):
     This is a base integration test class, which ensures that an
     OpenStack client object is available.  A setUp() method is
     included which sets self.os to be an instance of
-    novaclient.OpenStack().
+    novaclient.OpenStack().  The instance comes from the client pool
+    and is returned to it by tearDown(); set the fresh_login class
+    attribute to True for tests which require a newly authenticated
+    client.
 
     """
 
+    fresh_login = False
+
+    # Whether the cloud honors multi-create requests; None until one
+    # has been tried
+    multi_create = None
+
     @staticmethod
-    def getOpenStack():
-        """Set up and return an OpenStack instance."""
+    def getOpenStack(fresh=False):
+        """Set up and return an OpenStack instance.
+
+        The instance is taken from the client pool, unless fresh is
+        True or the pool was disabled with --no-client-pool, in which
+        case a new instance is created and authenticated.
+        """
+
+        # Use the pool if we can
+        if FLAGS.client_pool and not fresh:
+            return client_pool.get(FLAGS.username,
+                                   FLAGS.api_key,
+                                   FLAGS.project_id,
+                                   FLAGS.nova_url)
 
         # Set up the OpenStack instance...
         os = novaclient.OpenStack(FLAGS.username,
                                   FLAGS.api_key,
                                   FLAGS.project_id,
                                   FLAGS.nova_url)
+        os.client.request = tracing.client_call(
+            'nova', profiler.api_call(os.client.request))
 
         # Do the authenticate now, so we fail early
         os.authenticate()
 
         return os
 
+    @staticmethod
+    def releaseOpenStack(os):
+        """Release an OpenStack instance obtained from getOpenStack()."""
+
+        client_pool.put(os)
+
     @staticmethod
     def get_glance_connection():
-        """Set up and return a Glance connection."""
+        """Set up and return the shared Glance connection."""
+
+        global glance_connection
 
         # Set up the Glance connection
-        return glanceclient.Client(FLAGS.glance_host,
-                                   FLAGS.glance_port)
+        if glance_connection is None:
+            glance_connection = glanceclient.Client(FLAGS.glance_host,
+                                                    FLAGS.glance_port)
+            glance_connection.do_request = tracing.client_call(
+                'glance', profiler.api_call(glance_connection.do_request))
+
+        return glance_connection
 
     @staticmethod
     def create_glance_image(file_name,
                           image_name,
                           image_type='machine',
-                          is_public=True):
+                          is_public=True,
+                          fresh=True):
+        """Upload an image to Glance and return its metadata.
 
-        # Let's open the test image
-        with open(file_name, 'rb') as img:
+        Unless fresh is True, an identical image registered earlier
+        (possibly under a different name) may be returned instead; see
+        ImageCache.  Such images are shared, and must not be deleted.
+        """
 
-            # Set up metadata for the image
-            meta = {
-                'name': image_name,
-                'type': image_type,
-                'is_public': is_public
-                }
+        # Set up metadata for the image
+        meta = {
+            'name': image_name,
+            'type': image_type,
+            'is_public': is_public
+            }
 
-            # Get a glance connection
-            c = BaseIntegrationTest.get_glance_connection()
+        # Get a glance connection
+        c = BaseIntegrationTest.get_glance_connection()
 
-            # Upload the image
-            new_meta = c.add_image(meta, img)
+        # Reuse an identical image if we can
+        if not fresh and FLAGS.image_cache:
+            return image_cache.get(c, file_name, meta)
 
-            # Return the meta
-            return new_meta
+        # Upload the image, and make sure it gets cleaned up
+        return cleanup.janitor.track('glance',
+                                     image_cache.upload(c, file_name, meta))
 
     def create_server(self,
                      server_name=None,
@@ -218,22 +806,159 @@ class BaseIntegrationTest(dtest.DTestCase):
             server_flavor = FLAGS.flavor
 
         # Instantiate and return the server
-        return self.os.servers.create(name=server_name,
-                                      image=server_image,
-                                      flavor=server_flavor)
+        return cleanup.janitor.track('servers', self.os.servers.create(
+                name=server_name, image=server_image, flavor=server_flavor))
+
+    def create_servers(self, count, server_image=None, server_flavor=None,
+                       retries=2):
+        """Create servers concurrently, yielding them as they complete.
+
+        Where the cloud supports it, the servers are requested with a
+        single multi-create (with min_count and max_count); otherwise,
+        or for any the multi-create did not provide, they are created
+        by concurrent separate requests.  All of them are watched by
+        the shared StatusPoller for the servers.  Servers which fail
+        to be created or to become active are deleted and created
+        again, up to retries times.
+
+        Yields a (server, error) tuple for each of the count servers,
+        in the order they complete.  The error is None if the server
+        became active; otherwise, it is the exception or invalid
+        state which defeated the last attempt, and the server is that
+        of the last attempt (already deleted), or None if its create
+        request failed.  The servers are tracked for cleanup, like
+        those of create_server(); nothing is created until iteration
+        begins.
+        """
+
+        if not server_image:
+            server_image = FLAGS.image
+        if not server_flavor:
+            server_flavor = FLAGS.flavor
+
+        done = queue.Queue()
+        poller = utils.get_poller('servers')
+
+        # Propagate the status stream to our threads
+        output = dtest.status.output
+        test = dtest.status.test
+
+        def create(attempt):
+            dtest.status.setup(output, test)
+            os = self.getOpenStack()
+            try:
+                server = cleanup.janitor.track('servers', os.servers.create(
+                        name=self.randName(), image=server_image,
+                        flavor=server_flavor))
+            except Exception, e:
+                failed(None, attempt, e)
+                return
+            finally:
+                self.releaseOpenStack(os)
+
+            watch(server, attempt)
+
+        def watch(server, attempt):
+            def complete(w):
+                if w.exc_info is not None:
+                    failed(server, attempt, w.exc_info[1])
+                elif w.result is not True:
+                    failed(server, attempt, w.result)
+                else:
+                    done.put((server, None))
+
+            poller.watch(utils.StatusTracker('active', 'build', 'active'),
+                         server.id, complete)
+
+        def failed(server, attempt, error):
+            if server is not None:
+                os = self.getOpenStack()
+                try:
+                    os.servers.delete(server)
+                    cleanup.janitor.forget('servers', server)
+                except Exception:
+                    # Leave it to the janitor
+                    pass
+                finally:
+                    self.releaseOpenStack(os)
+
+            if attempt < retries:
+                eventlet.spawn_n(create, attempt + 1)
+            else:
+                done.put((server, error))
+
+        # Ask for as many as we can at once, and the rest one by one
+        servers = []
+        if count > 1 and BaseIntegrationTest.multi_create is not False:
+            servers = self._multi_create(count, server_image, server_flavor)
+        for server in servers:
+            watch(server, 0)
+        for i in xrange(count - len(servers)):
+            eventlet.spawn_n(create, 0)
+
+        for i in xrange(count):
+            yield done.get()
+
+    def _multi_create(self, count, server_image, server_flavor):
+        """Request count servers with a single multi-create.
+
+        Returns the servers created, which may be fewer than count (or
+        none at all), if the client or the cloud does not support
+        multi-create, or the request failed.
+        """
+
+        name = self.randName()
+        try:
+            first = self.os.servers.create(name=name, image=server_image,
+                                           flavor=server_flavor,
+                                           min_count=count,
+                                           max_count=count)
+        except TypeError:
+            # The client predates multi-create
+            BaseIntegrationTest.multi_create = False
+            return []
+        except novaclient.exceptions.BadRequest:
+            # The cloud rejects it
+            BaseIntegrationTest.multi_create = False
+            return []
+        except novaclient.OpenStackException:
+            return []
+        cleanup.janitor.track('servers', first)
+
+        # The response only describes the first server; find the rest
+        # by their shared name
+        servers = [server for server in self.os.servers.list()
+                   if server.name.startswith(name) and server.id != first.id]
+        servers = [cleanup.janitor.track('servers', server)
+                   for server in servers[:count - 1]]
+        BaseIntegrationTest.multi_create = bool(servers)
+
+        return [first] + servers
 
     def setUp(self):
         """For each test, set up OpenStack and Glance instance."""
 
         # Get an OpenStack instance
-        self.os = self.getOpenStack()
+        self.os = self.getOpenStack(fresh=self.fresh_login)
 
         # Get a Glance connection
         self.glance_connection = self.get_glance_connection()
 
-    @staticmethod
-    def randName(length=20, charset=string.lowercase, prefix=""):
-        """Generate a random name of the given length."""
+    def tearDown(self):
+        """For each test, release the OpenStack instance."""
+
+        self.releaseOpenStack(self.os)
 
-        return prefix + ''.join([charset[random.randrange(len(charset))]
-                        for i in xrange(length)])
+    @staticmethod
+    def randName(length=20, charset=string.lowercase, prefix="", rng=random):
+        """Generate a random name of the given length.
+
+        The name begins with the --name-prefix option, followed by
+        prefix, so that resources left behind by the tests can be
+        found; see the --cleanup-only option.  The random characters
+        are drawn from rng, which may be a seeded random.Random for
+        reproducible names.
+        """
+
+        return FLAGS.name_prefix + prefix + ''.join(
+            [charset[rng.randrange(len(charset))] for i in xrange(length)])
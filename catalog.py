@@ -0,0 +1,156 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Per-run caches of the flavor and image catalogs.
+
+Many tests need the details of a flavor or image they did not create,
+and which does not change during a run.  Rather than fetch it each
+time, or list a catalog of thousands of images and scan it for one
+entry, they look it up in a Catalog, which lists the collection once
+and indexes it by ID and by name.  Once the listing is --catalog-ttl
+seconds old, it is revalidated with a conditional request (using the
+ETag or Last-Modified headers of the previous response), so that an
+unchanged catalog costs an empty 304 response rather than a listing.
+"""
+
+import threading
+
+import novaclient
+
+import base
+import utils
+
+FLAGS = base.FLAGS
+
+
+def index(objs, attr='id'):
+    """Index a listing by an attribute.
+
+    Returns a dictionary mapping the value of the attribute of each
+    object, as a string, to the object; if several objects share a
+    value, the last one listed wins.
+    """
+
+    return dict((str(getattr(obj, attr)), obj) for obj in objs)
+
+
+class Catalog(object):
+    """Cached listing of a Nova collection, indexed by ID and name."""
+
+    def __init__(self, collection):
+        """Initialize a Catalog for a collection, such as "flavors"."""
+
+        self.collection = collection
+
+        # The indexes of the last listing
+        self.by_id = {}
+        self.by_name = {}
+
+        # The number of requests made for the listing
+        self.fetches = 0
+
+        self._fetched = None
+        self._etag = None
+        self._modified = None
+        self._lock = threading.Lock()
+
+    def _revalidate(self, force=False):
+        """Revalidate the listing if it is stale, or if force is True.
+
+        Returns True if a request was made.
+        """
+
+        with self._lock:
+            if (not force and self._fetched is not None and
+                utils.monotonic() - self._fetched < FLAGS.catalog_ttl):
+                return False
+
+            headers = {}
+            if self._etag:
+                headers['If-None-Match'] = self._etag
+            if self._modified:
+                headers['If-Modified-Since'] = self._modified
+
+            os = base.BaseIntegrationTest.getOpenStack()
+            try:
+                manager = getattr(os, self.collection)
+                resp, body = os.client.get('/%s/detail' % self.collection,
+                                           headers=headers)
+            finally:
+                base.BaseIntegrationTest.releaseOpenStack(os)
+
+            self.fetches += 1
+            self._fetched = utils.monotonic()
+
+            # Nothing changed
+            if resp.status == 304:
+                return True
+
+            objs = [manager.resource_class(manager, info)
+                    for info in body[self.collection]]
+            self.by_id = index(objs)
+            self.by_name = index(objs, 'name')
+            self._etag = resp.get('etag')
+            self._modified = resp.get('last-modified')
+
+            return True
+
+    def _lookup(self, idx, key, what):
+        """Look an object up in one of the indexes.
+
+        A miss revalidates the listing once, in case the object is
+        new.  Raises novaclient.exceptions.NotFound if there is no
+        such object, as the API would.
+        """
+
+        fetched = self._revalidate()
+        obj = getattr(self, idx).get(str(key))
+        if obj is None and not fetched:
+            self._revalidate(force=True)
+            obj = getattr(self, idx).get(str(key))
+
+        if obj is None:
+            raise novaclient.exceptions.NotFound(
+                404, "No %s with %s %r" % (self.collection, what, key))
+
+        return obj
+
+    def get(self, obj_id):
+        """Retrieve an object by ID."""
+
+        return self._lookup('by_id', obj_id, 'ID')
+
+    def find(self, name):
+        """Retrieve an object by name."""
+
+        return self._lookup('by_name', name, 'name')
+
+    def list(self):
+        """Retrieve all the objects."""
+
+        self._revalidate()
+
+        return self.by_id.values()
+
+    def refresh(self):
+        """Revalidate the listing now, whatever its age."""
+
+        self._revalidate(force=True)
+
+
+# The shared catalogs
+flavors = Catalog('flavors')
+images = Catalog('images')
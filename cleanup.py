@@ -0,0 +1,314 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import sys
+import threading
+import time
+
+import eventlet
+import glance.common.exception
+import novaclient
+
+import base
+import utils
+
+
+class NovaCollection(object):
+    """Deletes and lists the objects of a Nova collection.
+
+    The collection is named by the attribute of the OpenStack client
+    holding its manager ('servers', 'images', or 'ipgroups').  Each
+    call is made with a client of its own from the client pool.
+    """
+
+    def __init__(self, name):
+        """Initialize a NovaCollection."""
+
+        self.name = name
+
+    def __str__(self):
+        """Name the collection in messages."""
+
+        return self.name
+
+    def delete(self, obj_id):
+        """Delete an object.
+
+        Returns False if the object does not exist.
+        """
+
+        os = base.BaseIntegrationTest.getOpenStack()
+        try:
+            getattr(os, self.name).delete(obj_id)
+        except novaclient.exceptions.NotFound:
+            return False
+        finally:
+            base.BaseIntegrationTest.releaseOpenStack(os)
+
+        return True
+
+    def list(self):
+        """List the objects in the collection.
+
+        Returns a dictionary mapping the ID of each object to its
+        name.  Servers which are listed as deleted are left out.  A
+        collection the cloud does not implement (such as IP groups,
+        which Nova answers with a 501) is listed as empty.
+        """
+
+        os = base.BaseIntegrationTest.getOpenStack()
+        try:
+            manager = getattr(os, self.name)
+            if self.name == 'ipgroups':
+                objs = manager.list()
+            else:
+                objs = manager.list(detailed=True)
+        except novaclient.exceptions.HTTPNotImplemented:
+            return {}
+        finally:
+            base.BaseIntegrationTest.releaseOpenStack(os)
+
+        return dict((obj.id, obj.name) for obj in objs
+                    if getattr(obj, 'status', '').lower() != 'deleted')
+
+
+class GlanceCollection(object):
+    """Deletes and lists the images registered with Glance.
+
+    Images in the image cache (see base.ImageCache) are shared between
+    runs, and so are never listed.
+    """
+
+    def __str__(self):
+        """Name the collection in messages."""
+
+        return 'glance'
+
+    def delete(self, obj_id):
+        """Delete an image.
+
+        Returns False if the image does not exist.
+        """
+
+        c = base.BaseIntegrationTest.get_glance_connection()
+        try:
+            c.delete_image(obj_id)
+        except glance.common.exception.NotFound:
+            return False
+
+        return True
+
+    def list(self):
+        """List the images.
+
+        Returns a dictionary mapping the ID of each image to its name.
+        """
+
+        c = base.BaseIntegrationTest.get_glance_connection()
+
+        return dict((img['id'], img['name'])
+                    for img in c.get_images_detailed()
+                    if not self._shared(img))
+
+    def shared(self):
+        """Return the IDs of the images in the image cache."""
+
+        c = base.BaseIntegrationTest.get_glance_connection()
+
+        return set(img['id'] for img in c.get_images_detailed()
+                   if self._shared(img))
+
+    @staticmethod
+    def _shared(img):
+        """Test whether an image belongs to the image cache."""
+
+        return base.ImageCache.digest_property in img.get('properties', {})
+
+
+# The collections the Janitor knows how to clean up, in the order
+# they are cleaned up; server images go before the servers they were
+# taken from
+glance_images = GlanceCollection()
+collections = [
+    NovaCollection('images'),
+    glance_images,
+    NovaCollection('servers'),
+    NovaCollection('ipgroups'),
+    ]
+
+
+def _obj_id(obj):
+    """Return the ID of an object, image metadata dictionary, or ID."""
+
+    if isinstance(obj, dict):
+        return obj['id']
+
+    return getattr(obj, 'id', obj)
+
+
+class Janitor(object):
+    """Track and delete the resources created by the suite.
+
+    Resources are registered with track(), by collection name ('servers',
+    'images', 'ipgroups', or 'glance') and object or ID.  The sweep()
+    method deletes everything registered in parallel, on a bounded
+    pool of green threads, retrying failed deletes with backoff; it
+    then waits until a listing of each collection shows the resources
+    to be gone.  Resources the tests delete themselves need not be
+    untracked, since deleting a resource that no longer exists is not
+    an error.  Use reap() to clean up specific resources at once, and
+    sweep_prefix() to clean up resources left by an earlier run.
+    """
+
+    def __init__(self):
+        """Initialize a Janitor."""
+
+        self._lock = threading.Lock()
+        self._tracked = {}
+
+    def track(self, collection, obj):
+        """Register a resource for deletion; returns obj.
+
+        The obj argument may be an object, a Glance image metadata
+        dictionary, or an ID.
+        """
+
+        with self._lock:
+            self._tracked.setdefault(collection, set()).add(_obj_id(obj))
+
+        return obj
+
+    def forget(self, collection, obj):
+        """Stop tracking a resource, such as one meant to outlive the run."""
+
+        with self._lock:
+            self._tracked.get(collection, set()).discard(_obj_id(obj))
+
+    def sweep(self):
+        """Delete all the tracked resources.
+
+        Returns a dictionary mapping collection names to the IDs of
+        the resources which could not be confirmed as deleted.
+        """
+
+        with self._lock:
+            pending = self._tracked
+            self._tracked = {}
+
+        return self._delete(pending)
+
+    def reap(self, collection, objs):
+        """Delete the given resources of a collection now.
+
+        Returns the same as sweep().
+        """
+
+        objs = list(objs)
+        for obj in objs:
+            self.forget(collection, obj)
+
+        return self._delete({collection: set(_obj_id(obj) for obj in objs)})
+
+    def sweep_prefix(self, prefix):
+        """Delete every resource whose name starts with prefix.
+
+        Intended for cleaning up after runs which did not get to clean
+        up after themselves; see the --cleanup-only option.  Images in
+        the image cache are left alone.  Returns the same as sweep().
+        """
+
+        # Nova lists the cached images too, without their properties
+        try:
+            shared = glance_images.shared()
+        except Exception, e:
+            print >>sys.stderr, "Exception listing glance: %s" % e
+            return {}
+
+        pending = {}
+        for coll in collections:
+            try:
+                objs = coll.list()
+            except Exception, e:
+                print >>sys.stderr, "Exception listing %s: %s" % (coll, e)
+                continue
+
+            pending[str(coll)] = set(obj_id for obj_id, name in objs.items()
+                                     if name and name.startswith(prefix) and
+                                     obj_id not in shared)
+
+        return self._delete(pending)
+
+    def _delete(self, pending):
+        """Delete resources and wait for them to be gone."""
+
+        pool = eventlet.GreenPool(base.FLAGS.cleanup_workers)
+        deadline = time.time() + base.FLAGS.timeout * 60
+        leaked = {}
+
+        for coll in collections:
+            ids = pending.get(str(coll))
+            if not ids:
+                continue
+
+            for obj_id in ids:
+                pool.spawn_n(self._delete_one, coll, obj_id)
+            pool.waitall()
+
+            remaining = self._confirm(coll, ids, deadline)
+            if remaining:
+                print >>sys.stderr, "Failed to delete %s: %s" % (
+                    coll, ', '.join(str(obj_id) for obj_id in remaining))
+                leaked[str(coll)] = remaining
+
+        return leaked
+
+    def _delete_one(self, coll, obj_id):
+        """Delete a resource, retrying with backoff."""
+
+        backoff = utils.Backoff()
+        for attempt in range(base.FLAGS.cleanup_retries + 1):
+            try:
+                coll.delete(obj_id)
+                return
+            except Exception, e:
+                if attempt == base.FLAGS.cleanup_retries:
+                    print >>sys.stderr, "Exception deleting %s %s: %s" % (
+                        coll, obj_id, e)
+                    return
+
+            eventlet.sleep(backoff.next())
+
+    def _confirm(self, coll, ids, deadline):
+        """Wait for resources to disappear from their listing.
+
+        Returns the set of IDs still listed at the deadline.
+        """
+
+        remaining = set(ids)
+        backoff = utils.Backoff()
+        while True:
+            try:
+                remaining &= set(coll.list())
+            except Exception, e:
+                print >>sys.stderr, "Exception listing %s: %s" % (coll, e)
+
+            if not remaining or time.time() >= deadline:
+                return remaining
+
+            eventlet.sleep(backoff.next())
+
+
+# The process-wide janitor
+janitor = Janitor()
@@ -0,0 +1,665 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import httplib
+import json
+import os
+import random
+import re
+import time
+
+import eventlet
+from eventlet import wsgi
+
+import base
+import utils
+
+
+class FakeError(Exception):
+    """An error response from the FakeCloud.
+
+    The fault is the name of the key of the Nova error body; Glance
+    errors carry only the status and message.
+    """
+
+    def __init__(self, status, fault, message):
+        """Initialize a FakeError."""
+
+        super(FakeError, self).__init__(message)
+        self.status = status
+        self.fault = fault
+        self.message = message
+
+
+def not_found(what, obj_id):
+    """Return a FakeError for a missing object."""
+
+    return FakeError(404, 'itemNotFound', "%s %s could not be found" %
+                     (what, obj_id))
+
+
+def not_implemented(*args):
+    """Handler for requests Nova does not implement."""
+
+    raise FakeError(501, 'notImplemented', "Not implemented")
+
+
+# Signatures of file formats which are not disk images; like a real
+# hypervisor, the FakeCloud fails to boot images which start with one
+not_disk_images = ('\x89PNG\r\n\x1a\n', '\xff\xd8\xff', 'GIF87a', 'GIF89a',
+                   '%PDF-')
+
+
+def bootable(image):
+    """Determine whether an image's data could be booted."""
+
+    return not image['_data'].startswith(not_disk_images)
+
+
+# The flavors offered by the FakeCloud
+flavors = {
+    1: dict(id=1, name='256 slice', ram=256, disk=10),
+    2: dict(id=2, name='512 slice', ram=512, disk=20),
+    3: dict(id=3, name='1GB slice', ram=1024, disk=40),
+    4: dict(id=4, name='2GB slice', ram=2048, disk=80),
+    5: dict(id=5, name='4GB slice', ram=4096, disk=160),
+    }
+
+
+class FakeCloud(object):
+    """In-process stand-in for the Nova and Glance APIs.
+
+    Serves the parts of version 1.0 of the OpenStack API and of the
+    Glance API which the tests use, from a single WSGI application
+    running in a green thread; the Nova API is rooted at /v1.0/ and
+    the Glance API at /images.  Any credentials are accepted.  Every
+    request is delayed by a sample from the latency distribution, and
+    a fraction of them (other than authentication) fail with an
+    internal server error.  Servers and server images move to their
+    next state once a sample from the corresponding transition time
+    distribution has elapsed, and a fraction of builds end in the
+    ERROR state, as do all builds of images which are evidently not
+    disk images, such as pictures.  As in Nova, shared IP groups, IP
+    sharing, and backup schedules are not implemented.
+
+    The state is only touched between the latency sleep and the
+    response, without yielding to other green threads, so no locking
+    is needed.
+    """
+
+    def __init__(self, latency='0', build_time='2', resize_time='2',
+                 reboot_time='1', error_rate=0.0, fault_rate=0.0,
+                 seed=None):
+        """Initialize a FakeCloud.
+
+        The latency, build_time, resize_time, and reboot_time
+        arguments are utils.Distribution specifications.  The
+        error_rate is the fraction of requests to fail, and the
+        fault_rate the fraction of builds to fail; seed seeds the
+        random number generator, for reproducible runs.
+        """
+
+        self.rand = random.Random(seed)
+        self.latency = utils.Distribution(latency, self.rand)
+        self.build_time = utils.Distribution(build_time, self.rand)
+        self.resize_time = utils.Distribution(resize_time, self.rand)
+        self.reboot_time = utils.Distribution(reboot_time, self.rand)
+        self.error_rate = error_rate
+        self.fault_rate = fault_rate
+
+        self.host = None
+        self.port = None
+
+        self._tokens = set()
+        self._servers = {}
+        self._images = {}
+        self._next_id = 1
+
+        # Prime Glance with a few machine images
+        for i in range(3):
+            self._add_image(dict(name='fake-image-%d' % (i + 1),
+                                 type='machine', is_public=True),
+                            status='active')
+
+        # The routes, as (method, pattern, handler) tuples; patterns
+        # are matched against the whole path
+        nova = r'/v1\.0/[^/]+'
+        self._routes = [(method, re.compile('^%s$' % pattern), handler)
+                        for method, pattern, handler in [
+            ('GET', r'/v1\.0/?', self._authenticate),
+            ('GET', nova + r'/servers', self._list_servers),
+            ('GET', nova + r'/servers/(detail)', self._list_servers),
+            ('POST', nova + r'/servers', self._create_server),
+            ('GET', nova + r'/servers/(\d+)', self._show_server),
+            ('PUT', nova + r'/servers/(\d+)', self._update_server),
+            ('DELETE', nova + r'/servers/(\d+)', self._delete_server),
+            ('POST', nova + r'/servers/(\d+)/action', self._server_action),
+            ('GET', nova + r'/servers/(\d+)/ips', self._server_ips),
+            ('GET', nova + r'/servers/(\d+)/ips/(public|private)',
+             self._server_ips),
+            (None, nova + r'/servers/\d+/ips/public/[^/]+',
+             not_implemented),
+            (None, nova + r'/servers/\d+/backup_schedule', not_implemented),
+            ('GET', nova + r'/flavors', self._list_flavors),
+            ('GET', nova + r'/flavors/(detail)', self._list_flavors),
+            ('GET', nova + r'/flavors/(\d+)', self._show_flavor),
+            ('GET', nova + r'/images', self._list_images),
+            ('GET', nova + r'/images/(detail)', self._list_images),
+            ('POST', nova + r'/images', self._create_server_image),
+            ('GET', nova + r'/images/(\d+)', self._show_image),
+            ('DELETE', nova + r'/images/(\d+)', self._delete_image),
+            (None, nova + r'/shared_ip_groups(?:/.*)?', not_implemented),
+            ('GET', r'(?:/v1)?/images', self._glance_list),
+            ('GET', r'(?:/v1)?/images/(detail)', self._glance_list),
+            ('POST', r'(?:/v1)?/images', self._glance_add),
+            ('HEAD', r'(?:/v1)?/images/(\d+)', self._glance_show),
+            ('GET', r'(?:/v1)?/images/(\d+)', self._glance_show),
+            ('DELETE', r'(?:/v1)?/images/(\d+)', self._glance_delete),
+            ]]
+
+    def start(self, host='127.0.0.1', port=0):
+        """Start serving requests in a green thread.
+
+        If port is 0, an unused port is chosen.  Returns the host and
+        port the FakeCloud is listening on.
+        """
+
+        sock = eventlet.listen((host, port))
+        self.host, self.port = sock.getsockname()[:2]
+
+        eventlet.spawn_n(wsgi.server, sock, self,
+                         log=open(os.devnull, 'w'))
+
+        return self.host, self.port
+
+    def __call__(self, environ, start_response):
+        """Handle a request."""
+
+        method = environ['REQUEST_METHOD']
+        path = environ.get('PATH_INFO', '')
+        glance = not path.startswith('/v1.0')
+
+        # Simulate the network and processing time
+        eventlet.sleep(self.latency.sample())
+
+        try:
+            for route_method, pattern, handler in self._routes:
+                match = pattern.match(path)
+                if match and route_method in (None, method):
+                    break
+            else:
+                raise FakeError(404, 'itemNotFound',
+                                "No such resource %s" % path)
+
+            if handler != self._authenticate:
+                self._check_auth(environ, glance)
+
+                # Inject errors
+                if self.rand.random() < self.error_rate:
+                    raise FakeError(500, 'cloudServersFault',
+                                    "Injected error")
+
+            status, headers, body = handler(environ, *match.groups())
+        except FakeError, e:
+            status, headers = e.status, []
+            if glance:
+                body = e.message
+            else:
+                body = {e.fault: {'code': e.status, 'message': e.message}}
+
+        # Serialize the body
+        if body is None or method == 'HEAD':
+            body = ''
+        elif not isinstance(body, str):
+            body = json.dumps(body)
+            headers.append(('Content-Type', 'application/json'))
+
+        # Let Nova listings be revalidated
+        if not glance and method == 'GET' and status == 200:
+            etag = '"%s"' % hashlib.md5(body).hexdigest()
+            headers.append(('ETag', etag))
+            if environ.get('HTTP_IF_NONE_MATCH') == etag:
+                status, body = 304, ''
+        headers.append(('Content-Length', str(len(body))))
+
+        start_response('%d %s' % (status, httplib.responses[status]),
+                       headers)
+
+        return [body]
+
+    def _check_auth(self, environ, glance):
+        """Ensure that a Nova request carries a valid token."""
+
+        if glance:
+            return
+
+        if environ.get('HTTP_X_AUTH_TOKEN') not in self._tokens:
+            raise FakeError(401, 'unauthorized', "Unauthorized")
+
+    def _read_json(self, environ):
+        """Read the JSON body of a request."""
+
+        try:
+            return json.loads(environ['wsgi.input'].read())
+        except ValueError:
+            raise FakeError(400, 'badRequest', "Malformed request body")
+
+    def _authenticate(self, environ):
+        """Issue a token for any credentials."""
+
+        user = environ.get('HTTP_X_AUTH_USER')
+        if not user:
+            raise FakeError(401, 'unauthorized', "Unauthorized")
+        project = environ.get('HTTP_X_AUTH_PROJECT_ID', user)
+
+        token = '%032x' % self.rand.getrandbits(128)
+        self._tokens.add(token)
+
+        url = 'http://%s/v1.0/%s' % (environ['HTTP_HOST'], project)
+        return 204, [
+            ('X-Auth-Token', token),
+            ('X-Server-Management-Url', url),
+            ('X-Storage-Url', url),
+            ('X-CDN-Management-Url', url),
+            ], None
+
+    def _allocate_id(self):
+        """Allocate an ID for a server or image."""
+
+        obj_id = self._next_id
+        self._next_id += 1
+
+        return obj_id
+
+    def _schedule(self, obj, delay, **updates):
+        """Apply updates to an object after delay seconds."""
+
+        obj['_transitions'].append((time.time() + delay, updates))
+
+    def _advance(self, obj):
+        """Apply the scheduled updates which are due."""
+
+        now = time.time()
+        while obj['_transitions'] and obj['_transitions'][0][0] <= now:
+            obj.update(obj['_transitions'].pop(0)[1])
+
+        return obj
+
+    def _get_server(self, server_id):
+        """Look up a server."""
+
+        server = self._servers.get(int(server_id))
+        if server is None:
+            raise not_found('Server', server_id)
+
+        return self._advance(server)
+
+    def _server_view(self, server, detail=True):
+        """Render a server for Nova."""
+
+        if not detail:
+            return dict(id=server['id'], name=server['name'])
+
+        return dict((key, value) for key, value in server.items()
+                    if not key.startswith('_'))
+
+    def _list_servers(self, environ, detail=None):
+        """List the servers."""
+
+        return 200, [], {'servers': [
+                self._server_view(self._advance(server), detail)
+                for server in self._servers.values()]}
+
+    def _create_server(self, environ):
+        """Start building a server."""
+
+        body = self._read_json(environ).get('server', {})
+
+        try:
+            image = self._get_image(body.get('imageId'))
+            flavor_id = int(body.get('flavorId'))
+        except (FakeError, TypeError, ValueError):
+            raise FakeError(400, 'badRequest', "Invalid image")
+        if image['status'] != 'active':
+            raise FakeError(400, 'badRequest', "Invalid image")
+        if flavor_id not in flavors:
+            raise FakeError(400, 'badRequest', "Invalid flavor")
+
+        # Multi-create builds max_count servers of the same name, and
+        # describes the first
+        try:
+            count = int(body.get('max_count') or 1)
+        except (TypeError, ValueError):
+            raise FakeError(400, 'badRequest', "Invalid max_count")
+        servers = [self._new_server(body, image, flavor_id)
+                   for i in range(max(count, 1))]
+
+        view = self._server_view(servers[0])
+        view['adminPass'] = '%016x' % self.rand.getrandbits(64)
+        return 202, [], {'server': view}
+
+    def _new_server(self, body, image, flavor_id):
+        """Create a server and start building it."""
+
+        server_id = self._allocate_id()
+        server = dict(
+            id=server_id,
+            name=body.get('name', 'server%d' % server_id),
+            imageId=image['id'],
+            flavorId=flavor_id,
+            status='BUILD',
+            progress=0,
+            hostId='%032x' % self.rand.getrandbits(128),
+            metadata=body.get('metadata') or {},
+            addresses=dict(
+                public=['10.%d.%d.%d' % ((server_id >> 16) & 0xff,
+                                         (server_id >> 8) & 0xff,
+                                         server_id & 0xff)],
+                private=['192.168.%d.%d' % ((server_id >> 8) & 0xff,
+                                            server_id & 0xff)]),
+            _transitions=[])
+        self._build(server)
+        self._servers[server_id] = server
+
+        return server
+
+    def _build(self, server):
+        """Schedule the end of a build or rebuild."""
+
+        image = self._images.get(server['imageId'])
+        if self.rand.random() < self.fault_rate:
+            status = 'ERROR'
+        elif image is not None and not bootable(image):
+            status = 'ERROR'
+        else:
+            status = 'ACTIVE'
+
+        server.update(status='BUILD', progress=0)
+        self._schedule(server, self.build_time.sample(),
+                       status=status, progress=100)
+
+    def _show_server(self, environ, server_id):
+        """Show a server."""
+
+        return 200, [], {'server': self._server_view(
+                self._get_server(server_id))}
+
+    def _update_server(self, environ, server_id):
+        """Rename a server."""
+
+        server = self._get_server(server_id)
+        body = self._read_json(environ).get('server', {})
+        if 'name' in body:
+            server['name'] = body['name']
+
+        return 204, [], None
+
+    def _delete_server(self, environ, server_id):
+        """Delete a server."""
+
+        self._get_server(server_id)
+        del self._servers[int(server_id)]
+
+        return 202, [], None
+
+    def _server_action(self, environ, server_id):
+        """Perform an action on a server."""
+
+        server = self._get_server(server_id)
+        body = self._read_json(environ)
+        if len(body) != 1:
+            raise FakeError(400, 'badRequest', "Invalid action")
+        action, params = body.items()[0]
+        params = params or {}
+
+        # Resizes must be confirmed or reverted...
+        if action in ('confirmResize', 'revertResize'):
+            if server['status'] != 'RESIZE-CONFIRM':
+                raise FakeError(409, 'conflictingRequest',
+                                "Server is not being resized")
+            if action == 'revertResize':
+                server['flavorId'] = server['_old_flavor']
+            server['status'] = 'ACTIVE'
+            return 202, [], None
+
+        # ...and everything else needs an active server
+        if server['status'] != 'ACTIVE' or server['_transitions']:
+            raise FakeError(409, 'conflictingRequest',
+                            "Server is in state %s" % server['status'])
+
+        if action == 'reboot':
+            if params.get('type', 'SOFT').upper() == 'HARD':
+                server['status'] = 'HARD_REBOOT'
+            else:
+                server['status'] = 'REBOOT'
+            self._schedule(server, self.reboot_time.sample(),
+                           status='ACTIVE')
+        elif action == 'rebuild':
+            image = self._get_image(params.get('imageId'))
+            server['imageId'] = image['id']
+            self._build(server)
+        elif action == 'resize':
+            flavor_id = int(params.get('flavorId'))
+            if flavor_id not in flavors:
+                raise FakeError(400, 'badRequest', "Invalid flavor")
+            server['_old_flavor'] = server['flavorId']
+            self._schedule(server, self.resize_time.sample(),
+                           status='RESIZE-CONFIRM', flavorId=flavor_id)
+        else:
+            raise FakeError(400, 'badRequest', "Invalid action")
+
+        return 202, [], None
+
+    def _server_ips(self, environ, server_id, network=None):
+        """Show the addresses of a server."""
+
+        addresses = self._get_server(server_id)['addresses']
+        if network is None:
+            return 200, [], {'addresses': addresses}
+
+        return 200, [], {network: addresses[network]}
+
+    def _list_flavors(self, environ, detail=None):
+        """List the flavors."""
+
+        return 200, [], {'flavors': [
+                flavor if detail else dict(id=flavor['id'],
+                                           name=flavor['name'])
+                for flavor in flavors.values()]}
+
+    def _show_flavor(self, environ, flavor_id):
+        """Show a flavor."""
+
+        flavor = flavors.get(int(flavor_id))
+        if flavor is None:
+            raise not_found('Flavor', flavor_id)
+
+        return 200, [], {'flavor': flavor}
+
+    def _add_image(self, meta, status, data=''):
+        """Register an image."""
+
+        now = time.strftime('%Y-%m-%dT%H:%M:%S')
+        image = dict(
+            id=self._allocate_id(),
+            name=meta.get('name'),
+            type=meta.get('type', 'machine'),
+            is_public=meta.get('is_public', True),
+            status=status,
+            size=len(data),
+            properties=meta.get('properties', {}),
+            created_at=now,
+            updated_at=now,
+            deleted=False,
+            _data=data,
+            _transitions=[])
+        self._images[image['id']] = image
+
+        return image
+
+    def _get_image(self, image_id):
+        """Look up an image."""
+
+        try:
+            image = self._images.get(int(image_id))
+        except (TypeError, ValueError):
+            image = None
+        if image is None:
+            raise not_found('Image', image_id)
+
+        return self._advance(image)
+
+    def _image_view(self, image, detail=True):
+        """Render an image for Nova."""
+
+        view = dict(id=image['id'], name=image['name'])
+        if detail:
+            view.update(status=image['status'].upper(),
+                        created=image['created_at'],
+                        updated=image['updated_at'])
+            if 'serverId' in image['properties']:
+                view['serverId'] = image['properties']['serverId']
+
+        return view
+
+    def _list_images(self, environ, detail=None):
+        """List the images, for Nova."""
+
+        return 200, [], {'images': [
+                self._image_view(self._advance(image), detail)
+                for image in self._images.values()]}
+
+    def _show_image(self, environ, image_id):
+        """Show an image, for Nova."""
+
+        return 200, [], {'image': self._image_view(
+                self._get_image(image_id))}
+
+    def _create_server_image(self, environ):
+        """Start taking an image of a server."""
+
+        body = self._read_json(environ).get('image', {})
+        server = self._get_server(body.get('serverId'))
+
+        image = self._add_image(dict(name=body.get('name'),
+                                     type='machine', is_public=False,
+                                     properties={'serverId': server['id']}),
+                                status='saving')
+        self._schedule(image, self.build_time.sample(), status='active')
+
+        return 202, [], {'image': self._image_view(image)}
+
+    def _delete_image(self, environ, image_id):
+        """Delete an image, for Nova."""
+
+        self._get_image(image_id)
+        del self._images[int(image_id)]
+
+        return 204, [], None
+
+    def _glance_meta(self, image):
+        """Render an image for Glance."""
+
+        return dict((key, value) for key, value in image.items()
+                    if not key.startswith('_'))
+
+    def _glance_headers(self, image):
+        """Render an image as Glance metadata headers."""
+
+        headers = []
+        for key, value in self._glance_meta(image).items():
+            if key == 'properties':
+                headers.extend(('x-image-meta-property-%s' % k, str(v))
+                               for k, v in value.items())
+            else:
+                headers.append(('x-image-meta-%s' % key, str(value)))
+
+        return headers
+
+    def _glance_list(self, environ, detail=None):
+        """List the public images, for Glance."""
+
+        images = [self._glance_meta(self._advance(image))
+                  for image in self._images.values() if image['is_public']]
+        if not detail:
+            images = [dict((key, image[key]) for key in
+                           ('id', 'name', 'size')) for image in images]
+
+        return 200, [], {'images': images}
+
+    def _glance_add(self, environ):
+        """Register and upload an image, for Glance."""
+
+        meta = {'properties': {}}
+        for key, value in environ.items():
+            if key.startswith('HTTP_X_IMAGE_META_PROPERTY_'):
+                name = key[len('HTTP_X_IMAGE_META_PROPERTY_'):]
+                meta['properties'][name.lower()] = value
+            elif key.startswith('HTTP_X_IMAGE_META_'):
+                meta[key[len('HTTP_X_IMAGE_META_'):].lower()] = value
+        meta['is_public'] = (meta.get('is_public', '').lower() in
+                             ('true', '1', 'on'))
+
+        image = self._add_image(meta, status='active',
+                                data=environ['wsgi.input'].read())
+
+        return 201, [], {'image': self._glance_meta(image)}
+
+    def _glance_show(self, environ, image_id):
+        """Show an image and its data, for Glance."""
+
+        try:
+            image = self._get_image(image_id)
+        except FakeError:
+            raise FakeError(404, None, "Image %s not found" % image_id)
+
+        return 200, self._glance_headers(image), image['_data']
+
+    def _glance_delete(self, environ, image_id):
+        """Delete an image, for Glance."""
+
+        try:
+            self._get_image(image_id)
+        except FakeError:
+            raise FakeError(404, None, "Image %s not found" % image_id)
+        del self._images[int(image_id)]
+
+        return 200, [], None
+
+
+def start():
+    """Start a FakeCloud configured from the options.
+
+    The --nova-url, --glance-host, and --glance-port options are
+    changed to point at it.  Returns the FakeCloud.
+    """
+
+    flags = base.FLAGS
+
+    cloud = FakeCloud(latency=flags.fake_latency,
+                      build_time=flags.fake_build_time,
+                      resize_time=flags.fake_resize_time,
+                      reboot_time=flags.fake_reboot_time,
+                      error_rate=flags.fake_error_rate,
+                      fault_rate=flags.fake_fault_rate,
+                      seed=flags.fake_seed)
+    host, port = cloud.start(port=flags.fake_port)
+
+    flags.nova_url = 'http://%s:%d/v1.0/' % (host, port)
+    flags.glance_host = host
+    flags.glance_port = port
+
+    return cloud
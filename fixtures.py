@@ -0,0 +1,224 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import sys
+
+import dtest
+import eventlet
+from eventlet import queue
+from eventlet import semaphore
+
+import base
+import cleanup
+import utils
+
+
+class Lease(object):
+    """A server leased from a ServerPool.
+
+    The attributes are as follows:
+
+    - server
+        A handle for the leased instance.
+
+    - meta_key
+        The randomly-generated key of arbitrary metadata associated
+        with the instance.
+
+    - meta_data
+        The randomly-generated data of the metadata associated with
+        the instance.
+
+    - destructive
+        True if the lease holder may modify the instance, in which
+        case it is deleted and replaced once the lease is released.
+
+    """
+
+    def __init__(self, server, meta_key, meta_data, destructive):
+        """Initialize a Lease."""
+
+        self.server = server
+        self.meta_key = meta_key
+        self.meta_data = meta_data
+        self.destructive = destructive
+
+
+class ServerPool(object):
+    """Pool of pre-booted servers for the tests to lease.
+
+    Once started, the pool boots its servers in parallel, and hands
+    them out as they become active.  A destructive lease gives the
+    holder exclusive use of a server, which is deleted when the lease
+    is released while a replacement boots in the background.  A
+    shared lease gives the holder a server which must not be
+    modified, and which is shared with the other holders of shared
+    leases; the first shared lease takes a server out of the pool for
+    good, and a replacement is booted for it.  All remaining servers
+    are deleted by drain().
+    """
+
+    def __init__(self):
+        """Initialize a ServerPool."""
+
+        self.size = 0
+        self._output = dtest.DTestOutput()
+        self._ready = queue.Queue()
+        self._shared = None
+        self._shared_lock = semaphore.Semaphore()
+        self._leased = set()
+        self._draining = False
+        self._pool = eventlet.GreenPool()
+
+    def __str__(self):
+        """Name the pool in status messages."""
+
+        return 'server_pool'
+
+    @property
+    def enabled(self):
+        """True if the pool has been started."""
+
+        return self.size > 0
+
+    def start(self, size):
+        """Start booting size servers."""
+
+        self.size = size
+        for i in range(size):
+            self._pool.spawn_n(self._boot)
+
+    def _boot(self):
+        """Boot a server and make it available for leasing."""
+
+        # Status messages from waiting are attributed to the pool
+        dtest.status.setup(self._output, self)
+
+        os = base.BaseIntegrationTest.getOpenStack()
+        try:
+            meta_key = base.BaseIntegrationTest.randName(length=10)
+            meta_data = base.BaseIntegrationTest.randName(length=50)
+            server = cleanup.janitor.track('servers', os.servers.create(
+                    name=base.BaseIntegrationTest.randName(),
+                    image=base.FLAGS.image, flavor=base.FLAGS.flavor,
+                    meta={meta_key: meta_data}))
+
+            states = utils.StatusTracker('active', 'build', 'active')
+            state = states.waitForPolledState('servers', server)
+            if state is not True:
+                server.delete()
+                raise AssertionError("Pooled server entered state %r" %
+                                     state)
+
+            self._ready.put((True, (server, meta_key, meta_data)))
+        except Exception:
+            # Hand the failure to whoever is waiting for a server
+            self._ready.put((False, sys.exc_info()))
+        finally:
+            base.BaseIntegrationTest.releaseOpenStack(os)
+
+    def _get(self, timeout):
+        """Wait up to timeout seconds for a booted server."""
+
+        try:
+            booted, item = self._ready.get(timeout=timeout)
+        except queue.Empty:
+            raise AssertionError("No pooled server became available "
+                                 "within %g seconds" % timeout)
+        if not booted:
+            raise item[0], item[1], item[2]
+
+        return item
+
+    def lease(self, destructive=True, timeout=None):
+        """Lease a server, waiting for one to be booted if need be.
+
+        Waits at most timeout seconds, by default the --timeout, and
+        raises AssertionError if no server became available by then.
+        """
+
+        if timeout is None:
+            timeout = base.FLAGS.timeout * 60
+
+        if not destructive:
+            # Only one server is ever shared, however many ask at once
+            with self._shared_lock:
+                if self._shared is None:
+                    self._shared = Lease(*self._get(timeout),
+                                         destructive=False)
+                    if not self._draining:
+                        self._pool.spawn_n(self._boot)
+            return self._shared
+
+        lease = Lease(*self._get(timeout), destructive=True)
+        self._leased.add(lease)
+
+        return lease
+
+    def release(self, lease):
+        """Release a lease.
+
+        For destructive leases, the server is deleted, and a
+        replacement is booted in the background.
+        """
+
+        if not lease.destructive:
+            return
+
+        self._leased.discard(lease)
+        self._delete(lease.server)
+        if not self._draining:
+            self._pool.spawn_n(self._boot)
+
+    def _delete(self, server):
+        """Delete a server, ignoring failures."""
+
+        os = base.BaseIntegrationTest.getOpenStack()
+        try:
+            os.servers.delete(server.id)
+        except Exception, e:
+            print >>sys.stderr, "Exception deleting server %s: %s" % (
+                server.id, e)
+        finally:
+            base.BaseIntegrationTest.releaseOpenStack(os)
+
+    def drain(self):
+        """Delete all the servers in the pool.
+
+        Waits for any servers still booting, then deletes all the
+        remaining servers, including any which were never released,
+        in parallel.
+        """
+
+        self._draining = True
+        self._pool.waitall()
+
+        servers = [lease.server for lease in self._leased]
+        self._leased.clear()
+        if self._shared is not None:
+            servers.append(self._shared.server)
+            self._shared = None
+        while not self._ready.empty():
+            booted, item = self._ready.get()
+            if booted:
+                servers.append(item[0])
+
+        for server in servers:
+            self._pool.spawn_n(self._delete, server)
+        self._pool.waitall()
+
+
+# The pool of servers shared by the tests
+server_pool = ServerPool()
@@ -0,0 +1,87 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import os
+import sys
+import time
+
+import stats
+
+
+class History(object):
+    """Record of how long the tests took in recent runs.
+
+    The history is kept in a JSON file holding an object with a "runs"
+    key, listing the most recent runs, oldest first.  Each run is an
+    object giving the wall-clock time at which it was recorded
+    ("started") and the tests which ran ("tests"), mapping the name of
+    each test or fixture to an object giving its "duration" in
+    seconds and final "state", and the fields of its profiler.Profile
+    if it made API calls or waited.
+    """
+
+    def __init__(self, path, keep=20):
+        """Initialize a History, loading the file at path if it exists.
+
+        Only the last keep runs are kept.
+        """
+
+        self.path = path
+        self.keep = keep
+        self.runs = []
+
+        try:
+            with open(path) as f:
+                self.runs = list(json.load(f)['runs'])
+        except IOError:
+            # No history yet
+            pass
+        except (ValueError, KeyError, TypeError), e:
+            print >>sys.stderr, ("Ignoring unreadable test history %s: %s" %
+                                 (path, e))
+
+    def durations(self, name):
+        """Retrieve the recorded durations of a test, oldest first."""
+
+        return [run['tests'][name]['duration'] for run in self.runs
+                if name in run['tests']]
+
+    def estimate(self, name):
+        """Estimate the duration of a test.
+
+        Returns the median of its recorded durations, or None if it
+        has never run.
+        """
+
+        durations = stats.Statistics()
+        for duration in self.durations(name):
+            durations.append(duration)
+
+        return durations.median if len(durations) else None
+
+    def add_run(self, tests):
+        """Record a run, given its tests as described above."""
+
+        self.runs.append(dict(started=time.time(), tests=tests))
+        del self.runs[:-self.keep]
+
+    def save(self):
+        """Write the history back to its file."""
+
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(dict(runs=self.runs), f, indent=1, sort_keys=True)
+        os.rename(tmp, self.path)
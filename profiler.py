@@ -0,0 +1,149 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Account for where the time of each test goes.
+
+Time is charged to the test or fixture running in the current thread,
+as given by the dtest status stream; threads a test spawns are charged
+to it as long as they set up the status stream, as they must anyway.
+Work done outside any test, such as by the shared status pollers, is
+not charged to anyone.  The profiles are recorded in the test history
+by the scheduler; see tools/test_history.py.
+"""
+
+import contextlib
+import functools
+import threading
+import time
+
+import dtest
+
+import utils
+
+
+class Profile(object):
+    """Where the time of one test or fixture went.
+
+    The attributes are as follows:
+
+    - api_calls
+        The number of Nova and Glance API calls made.
+
+    - network
+        The time, in seconds, spent waiting on those calls.
+
+    - sleep
+        The time spent sleeping, including between polls.
+
+    - poll
+        The time spent waiting for objects to change state, including
+        the sleeps and API calls made meanwhile.
+
+    - waits
+        A list of the state waits, each a dictionary giving the final
+        "state" waited for and the "duration" of the wait.
+
+    """
+
+    def __init__(self):
+        """Initialize a Profile."""
+
+        self.api_calls = 0
+        self.network = 0.0
+        self.sleep = 0.0
+        self.poll = 0.0
+        self.waits = []
+
+    def dump(self):
+        """Return the profile as a JSON-serializable dictionary."""
+
+        return dict(api_calls=self.api_calls, network=self.network,
+                    sleep=self.sleep, poll=self.poll, waits=self.waits)
+
+
+# The profiles, by test name
+_profiles = {}
+_lock = threading.Lock()
+
+
+def current():
+    """Retrieve the Profile of the test in this thread, or None."""
+
+    try:
+        test = dtest.status.test
+    except AttributeError:
+        # Not in a test
+        return None
+
+    with _lock:
+        return _profiles.setdefault(str(test), Profile())
+
+
+def collect():
+    """Retrieve and forget the profiles, keyed by test name."""
+
+    global _profiles
+
+    with _lock:
+        profiles, _profiles = _profiles, {}
+
+    return profiles
+
+
+def api_call(func):
+    """Wrap a client's request method to count and time its calls."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = current()
+        if profile is None:
+            return func(*args, **kwargs)
+
+        start = utils.monotonic()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.api_calls += 1
+            profile.network += utils.monotonic() - start
+
+    return wrapper
+
+
+def sleep(seconds):
+    """Sleep, charging the time to the current test."""
+
+    profile = current()
+    start = utils.monotonic()
+    try:
+        time.sleep(seconds)
+    finally:
+        if profile is not None:
+            profile.sleep += utils.monotonic() - start
+
+
+@contextlib.contextmanager
+def waiting(state):
+    """Charge the time spent in the block to waiting for a state."""
+
+    profile = current()
+    start = utils.monotonic()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            duration = utils.monotonic() - start
+            profile.poll += duration
+            profile.waits.append(dict(state=state, duration=duration))
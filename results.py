@@ -0,0 +1,344 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import os
+import sqlite3
+import subprocess
+import time
+
+import stats
+
+
+# The percentiles kept in run summaries
+PERCENTILES = (.1, .5, .9, .99)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL NOT NULL,
+    finished REAL,
+    revision TEXT,
+    target TEXT,
+    flags TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    metric TEXT NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_run_metric ON samples (run_id, metric);
+CREATE TABLE IF NOT EXISTS summaries (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    metric TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    average REAL,
+    stddev REAL,
+    p10 REAL,
+    p50 REAL,
+    p90 REAL,
+    p99 REAL,
+    PRIMARY KEY (run_id, metric)
+);
+"""
+
+
+def git_revision():
+    """Return the git revision of the suite, or None if unknown."""
+
+    try:
+        proc = subprocess.Popen(['git', 'rev-parse', 'HEAD'],
+                                cwd=os.path.dirname(
+                                    os.path.abspath(__file__)),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        out = proc.communicate()[0]
+    except OSError:
+        return None
+
+    if proc.returncode != 0:
+        return None
+
+    return out.strip()
+
+
+class ResultsStore(object):
+    """SQLite store of the samples and summaries of stress runs.
+
+    Each run is a row of the runs table, tagged with its start time,
+    the git revision of the suite, the Nova URL tested, and the
+    command-line options.  Samples are buffered and inserted in
+    batches, so that recording one costs no more than appending it to
+    a list.  Call finish() at the end of the run to record the
+    summaries and flush the remaining samples.
+    """
+
+    def __init__(self, path, batch_size=1000):
+        """Open the store at path, creating it if need be."""
+
+        self.path = path
+        self.batch_size = batch_size
+
+        self._db = sqlite3.connect(path)
+        self._db.executescript(SCHEMA)
+
+        self.run_id = None
+        self._pending = []
+        self._metrics = {}
+
+    def start_run(self, target, flags, revision=None):
+        """Start recording a new run; returns the run ID.
+
+        The flags argument is a dictionary of the command-line
+        options; values which cannot be stored as JSON are stored as
+        strings.
+        """
+
+        flags = json.dumps(flags, sort_keys=True, default=str)
+        cur = self._db.execute(
+            "INSERT INTO runs (started, revision, target, flags) "
+            "VALUES (?, ?, ?, ?)",
+            (time.time(), revision, target, flags))
+        self._db.commit()
+
+        self.run_id = cur.lastrowid
+        return self.run_id
+
+    def record(self, metric, value):
+        """Record a sample of the named metric."""
+
+        self._pending.append((self.run_id, metric, value))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write out the buffered samples."""
+
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, []
+        self._db.executemany(
+            "INSERT INTO samples (run_id, metric, value) VALUES (?, ?, ?)",
+            pending)
+        self._db.commit()
+
+    def track(self, metric, tracker):
+        """Record the samples appended to a statistics tracker.
+
+        Returns a RecordedStatistics wrapping the tracker; its summary
+        is written by finish().
+        """
+
+        recorded = RecordedStatistics(self, metric, tracker)
+        self._metrics[metric] = recorded
+
+        return recorded
+
+    def finish(self):
+        """Record the run summaries and end the run."""
+
+        self.flush()
+
+        for metric, tracker in sorted(self._metrics.items()):
+            self._db.execute(
+                "INSERT OR REPLACE INTO summaries VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.run_id, metric, len(tracker), tracker.average,
+                 tracker.stddev) +
+                tuple(tracker.percentile(pct) for pct in PERCENTILES))
+
+        self._db.execute("UPDATE runs SET finished = ? WHERE id = ?",
+                         (time.time(), self.run_id))
+        self._db.commit()
+
+    def runs(self):
+        """Return the runs, most recent last, as dictionaries."""
+
+        cur = self._db.execute(
+            "SELECT id, started, finished, revision, target, flags "
+            "FROM runs ORDER BY id")
+
+        return [dict(id=row[0], started=row[1], finished=row[2],
+                     revision=row[3], target=row[4],
+                     flags=json.loads(row[5] or '{}'))
+                for row in cur]
+
+    def metrics(self, run_id):
+        """Return the names of the metrics sampled in a run."""
+
+        cur = self._db.execute(
+            "SELECT DISTINCT metric FROM samples WHERE run_id = ? "
+            "UNION SELECT metric FROM summaries WHERE run_id = ?",
+            (run_id, run_id))
+
+        return sorted(row[0] for row in cur)
+
+    def statistics(self, run_id, metric):
+        """Return the statistics of a metric in a run.
+
+        Returns the Summary written by finish(), which covers samples
+        merged from trackers that did not keep them, such as those of
+        distributed workers with --streaming-stats; or, if the run did
+        not finish, a Statistics holding the recorded samples.
+        """
+
+        row = self._db.execute(
+            "SELECT count, average, stddev, p10, p50, p90, p99 "
+            "FROM summaries WHERE run_id = ? AND metric = ?",
+            (run_id, metric)).fetchone()
+        if row is not None:
+            return Summary(row[0], row[1], row[2],
+                           dict(zip(PERCENTILES, row[3:])))
+
+        result = stats.Statistics()
+        cur = self._db.execute(
+            "SELECT value FROM samples WHERE run_id = ? AND metric = ?",
+            (run_id, metric))
+        for row in cur:
+            result.append(row[0])
+
+        return result
+
+    def close(self):
+        """Flush the buffered samples and close the store."""
+
+        self.flush()
+        self._db.close()
+
+
+class Summary(object):
+    """The summary of a metric, as written by ResultsStore.finish().
+
+    Provides len(), the average and stddev attributes, and the
+    percentile() method, for the PERCENTILES only.
+    """
+
+    def __init__(self, count, average, stddev, percentiles):
+        """Initialize a Summary.
+
+        The percentiles argument maps each of the PERCENTILES to its
+        value.
+        """
+
+        self.count = count
+        self.average = average or 0.0
+        self.stddev = stddev or 0.0
+        self._percentiles = percentiles
+
+    def __len__(self):
+        """Return the number of samples."""
+
+        return self.count
+
+    def percentile(self, percent):
+        """Retrieve the value of one of the PERCENTILES."""
+
+        return self._percentiles[percent] or 0.0
+
+
+class RecordedStatistics(object):
+    """Statistics tracker which also records its samples in a store.
+
+    Provides the same interface as the tracker it wraps.
+    """
+
+    def __init__(self, store, metric, tracker):
+        """Initialize a RecordedStatistics."""
+
+        self._store = store
+        self._metric = metric
+        self._tracker = tracker
+
+    def append(self, sample):
+        """Add a sample to the tracker and the store."""
+
+        self._tracker.append(sample)
+        self._store.record(self._metric, sample)
+
+    def merge(self, other):
+        """Merge another tracker into the tracker and the store.
+
+        Individual samples are only recorded if the other tracker
+        keeps them; the summary written by finish() covers them all
+        either way.
+        """
+
+        self._tracker.merge(other)
+        if isinstance(other, stats.Statistics):
+            for sample in other:
+                self._store.record(self._metric, sample)
+
+    def __len__(self):
+        """Return the number of samples."""
+
+        return len(self._tracker)
+
+    def __getattr__(self, name):
+        """Delegate everything else to the tracker."""
+
+        return getattr(self._tracker, name)
+
+
+# The store for the current run, if --results-db was given
+store = None
+
+# Options which are not recorded with the run
+secret_flags = ('api_key',)
+
+
+def open_store(flags):
+    """Open the store named by --results-db and start a run.
+
+    Does nothing if --results-db was not given.
+    """
+
+    global store
+
+    if not flags.results_db:
+        return None
+
+    recorded = dict((key, value) for key, value in vars(flags).items()
+                    if key not in secret_flags)
+
+    store = ResultsStore(flags.results_db)
+    store.start_run(flags.nova_url, recorded, git_revision())
+
+    return store
+
+
+def track(metric, tracker):
+    """Record the samples of a tracker, if a store is open.
+
+    Returns the tracker to use in place of the one given.
+    """
+
+    if store is None:
+        return tracker
+
+    return store.track(metric, tracker)
+
+
+def close_store():
+    """Record the run summaries and close the store, if one is open."""
+
+    global store
+
+    if store is None:
+        return
+
+    store.finish()
+    store.close()
+    store = None
@@ -21,8 +21,16 @@ import os
 import sys
 
 import dtest
+import eventlet
 
 import base
+import cleanup
+import fakecloud
+import fixtures
+import history
+import results
+import scheduler
+import tracing
 
 
 if __name__ == '__main__':
@@ -37,7 +45,21 @@ if __name__ == '__main__':
 
     # Extract the backfire-specific options into storage everything
     # can get to; also handles some defaults
-    base.extract_opts(options)
+    try:
+        base.extract_opts(options)
+    except ValueError, e:
+        opts.error(str(e))
+
+    # Stand in for Nova and Glance if asked to
+    if options.fake_cloud:
+        eventlet.monkey_patch()
+        fakecloud.start()
+
+    # With --cleanup-only, just delete what earlier runs left behind
+    if options.cleanup_only:
+        eventlet.monkey_patch()
+        leaked = cleanup.janitor.sweep_prefix(options.name_prefix)
+        sys.exit(bool(leaked))
 
     # Obtain the arguments for dtest.main()
     kwargs = dtest.opts_to_args(options)
@@ -46,5 +68,129 @@ if __name__ == '__main__':
     if options.stress:
         kwargs['skip'] = lambda dt: not getattr(dt, 'stress', False)
 
-    # Run the tests
-    sys.exit(not dtest.main(**kwargs))
+        # With --soak-duration, only run the soak tests
+        if options.soak_duration:
+            kwargs['skip'] = lambda dt: not getattr(dt, 'soak', False)
+
+        # With --scenario, only run the mixed workload
+        if options.scenario:
+            kwargs['skip'] = lambda dt: not getattr(dt, 'scenario', False)
+
+        # The coordinator of distributed workers only runs the checks
+        # on the merged statistics, and the workers everything else
+        workers = options.workers + options.remote_workers
+        if workers:
+            if options.soak_duration or options.scenario:
+                opts.error("--workers cannot be combined with "
+                           "--soak-duration or --scenario")
+            if min(options.req_per_min, options.creates_per_min) < workers:
+                opts.error("Rates are too low to split among %d workers" %
+                           workers)
+            kwargs['skip'] = lambda dt: not getattr(dt, 'aggregate', False)
+        elif options.coordinator:
+            kwargs['skip'] = lambda dt: (not getattr(dt, 'stress', False) or
+                                         getattr(dt, 'checks', False))
+
+        # The image upload tests only run if asked to
+        if not options.image_uploads:
+            stress_skip = kwargs['skip']
+            kwargs['skip'] = lambda dt: (stress_skip(dt) or
+                                         getattr(dt, 'images', False))
+
+        # Record the results of the run, if asked to; workers leave
+        # that to the coordinator
+        if not options.dryrun and not options.coordinator:
+            results.open_store(options)
+
+        # Load the workload; the stress package must not be imported
+        # before the results store is open, or its statistics would
+        # not be recorded
+        if options.scenario:
+            from stress import scenario
+            try:
+                scenario.load_workload(options.scenario)
+            except scenario.ScenarioError, e:
+                opts.error(str(e))
+
+    # Run the distributed workers, or join the coordinator
+    coordinator = worker = None
+    if options.stress and not options.dryrun:
+        if options.workers or options.remote_workers:
+            eventlet.monkey_patch()
+            from stress import distributed
+            host = options.coordinator_host
+            if host is None:
+                host = '' if options.remote_workers else '127.0.0.1'
+            coordinator = distributed.Coordinator(options.workers,
+                                                  options.remote_workers,
+                                                  host,
+                                                  options.coordinator_port,
+                                                  options.checkin_timeout)
+            coordinator.spawn(opts, sys.argv)
+            try:
+                coordinator.run()
+            except distributed.DistributedError, e:
+                opts.error(str(e))
+        elif options.coordinator:
+            from stress import distributed
+            try:
+                worker = distributed.Worker(options.coordinator)
+                worker.join()
+            except distributed.DistributedError, e:
+                opts.error(str(e))
+
+    # Show the progress of the stress tests as they go; with workers,
+    # each shows its own
+    if options.stress and not options.dryrun and not coordinator:
+        eventlet.monkey_patch()
+        from stress import monitor
+        monitor.start_monitor(options,
+                              worker and 'worker %d' % worker.index)
+
+    # Start booting the shared instances while the tests get going
+    if (not options.stress and not options.dryrun and
+        options.server_pool_size > 0):
+        eventlet.monkey_patch()
+        fixtures.server_pool.start(options.server_pool_size)
+
+    # Trace the HTTP requests, if asked to; each worker writes a trace
+    # of its own
+    trace_file = options.trace_file
+    if trace_file and not options.dryrun:
+        if options.coordinator:
+            trace_file = '%s.%d' % (trace_file, os.getpid())
+        tracing.install()
+
+    # Run the tests, longest chain first; workers leave the history
+    # to runs of their own
+    if options.history and not options.coordinator:
+        kwargs['history'] = history.History(options.history)
+    kwargs['critpath'] = options.critical_path
+    result = scheduler.main(**kwargs)
+
+    # Report to the coordinator, or on the workers
+    if worker:
+        worker.report(result)
+    elif coordinator and coordinator.failed:
+        print >>sys.stderr, ("Stress workers failed: %s" %
+                             '; '.join(coordinator.failed))
+        result = False
+
+    # Write out the trace
+    if trace_file and not options.dryrun:
+        tracing.finish(trace_file)
+
+    # Save the summaries of the run
+    if options.stress and not options.dryrun and not coordinator:
+        monitor.stop_monitor()
+    results.close_store()
+
+    # Clean up the shared instances
+    if fixtures.server_pool.enabled:
+        fixtures.server_pool.drain()
+
+    # Delete anything else the tests left behind
+    if not options.dryrun:
+        cleanup.janitor.sweep()
+
+    sys.exit(not result)
@@ -0,0 +1,370 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Run the tests longest critical path first.
+
+DTest starts every test whose dependencies are done, and with
+--max-threads, the tests then wait on a semaphore in no particular
+order; a server boot gating half the dependency graph may well wait
+behind a dozen flavor listings.  The CriticalPathQueue instead hands
+free threads to the waiting test with the most work depending on it:
+each test is ranked by its estimated duration, taken from the runs
+recorded in a history.History, plus the largest rank among the tests
+depending on it.  Fast, independent tests then fill in the gaps while
+the long chains run.
+"""
+
+import heapq
+import itertools
+
+import dtest
+from dtest import constants
+import eventlet
+from eventlet import corolocal
+from eventlet import event
+
+import profiler
+import utils
+
+
+class PrioritySemaphore(object):
+    """Semaphore which wakes its waiters in order of priority.
+
+    The key function is called, in the acquiring thread, by each
+    acquire() which must wait; waiters with the lowest key are woken
+    first, and those with equal keys in the order they arrived.
+    Before handing the semaphore to a waiter, release() lets the
+    threads which were just spawned get in line, so that a test's
+    dependents compete for the thread it frees.
+    """
+
+    def __init__(self, count, key):
+        """Initialize a PrioritySemaphore."""
+
+        self.count = count
+        self.key = key
+        self._waiters = []
+        self._arrivals = itertools.count()
+
+    def acquire(self):
+        """Acquire the semaphore, waiting for it if need be."""
+
+        if self.count > 0 and not self._waiters:
+            self.count -= 1
+            return True
+
+        waiter = event.Event()
+        heapq.heappush(self._waiters,
+                       (self.key(), next(self._arrivals), waiter))
+        waiter.wait()
+
+        return True
+
+    def release(self):
+        """Release the semaphore to the first waiter, if any."""
+
+        # dtest spawns the dependents of a test just before releasing
+        # the semaphore; without letting them queue up first, the
+        # semaphore would go to whichever test was already waiting
+        if self._waiters:
+            eventlet.sleep(0)
+
+        if self._waiters:
+            heapq.heappop(self._waiters)[2].send()
+        else:
+            self.count += 1
+
+
+class _TimedOutput(object):
+    """Output proxy telling the queue when tests start and finish."""
+
+    def __init__(self, output, queue):
+        """Initialize a _TimedOutput."""
+
+        self._output = output
+        self._queue = queue
+
+    def notify(self, test, state):
+        """Note the transition, then pass it on."""
+
+        self._queue._notify(test, state)
+        self._output.notify(test, state)
+
+    def __getattr__(self, name):
+        """Delegate everything else to the output."""
+
+        return getattr(self._output, name)
+
+
+class CriticalPathQueue(dtest.DTestQueue):
+    """DTestQueue which runs the longest critical path first.
+
+    Estimated durations come from history, a history.History; tests
+    which have not run before are estimated at the median of the
+    others.  The queue measures how long each test actually took,
+    and records it in history at the end of the run, along with its
+    profiler.Profile.
+    """
+
+    def __init__(self, maxth=None, skip=lambda dt: dt.skip,
+                 output=dtest.DTestOutput(), history=None):
+        """Initialize a CriticalPathQueue."""
+
+        super(CriticalPathQueue, self).__init__(maxth, skip,
+                                                _TimedOutput(output, self))
+
+        # Replace the semaphore with one that respects the ranks
+        if maxth is not None:
+            self.sem = PrioritySemaphore(maxth, self._priority)
+
+        self.history = history
+
+        # The estimated duration and rank of each test, and when the
+        # tests which ran started and finished
+        self.estimates = {}
+        self.rank = {}
+        self.started = {}
+        self.finished = {}
+
+        self._local = corolocal.local()
+
+    def _estimate(self):
+        """Estimate the durations of the tests and rank them."""
+
+        known = {}
+        if self.history is not None:
+            for dt in self.tests:
+                estimate = self.history.estimate(str(dt))
+                if estimate is not None:
+                    known[dt] = estimate
+        default = sorted(known.values())[len(known) // 2] if known else 1.0
+
+        for dt in self.tests:
+            if self.skip(dt):
+                self.estimates[dt] = 0.0
+            else:
+                self.estimates[dt] = known.get(dt, default)
+
+        # Rank everything, without recursing; a test in a dependency
+        # cycle is ranked as if the cycle were broken
+        self.rank = {}
+        for root in self.tests:
+            stack = [(root, False)]
+            visiting = set()
+            while stack:
+                dt, expanded = stack.pop()
+                if dt in self.rank:
+                    continue
+                elif expanded:
+                    visiting.discard(dt)
+                    self.rank[dt] = self.estimates[dt] + max(
+                        [self.rank.get(dep, 0.0) for dep in dt.dependents] or
+                        [0.0])
+                elif dt not in visiting:
+                    visiting.add(dt)
+                    stack.append((dt, True))
+                    stack.extend((dep, False) for dep in dt.dependents
+                                 if dep not in self.rank)
+
+    def _priority(self):
+        """Compute the priority of the test waiting in this thread."""
+
+        return -self.rank.get(getattr(self._local, 'dt', None), 0.0)
+
+    def _notify(self, dt, state):
+        """Note when tests start and finish."""
+
+        if state == constants.RUNNING:
+            self.started[dt] = utils.monotonic()
+        elif dt in self.started:
+            self.finished[dt] = utils.monotonic()
+
+    def run(self, debug=False):
+        """Run the tests, recording their durations in the history."""
+
+        self._estimate()
+        self.started = {}
+        self.finished = {}
+
+        profiler.collect()
+        result = super(CriticalPathQueue, self).run(debug=debug)
+        profiles = profiler.collect()
+
+        if self.history is not None:
+            tests = {}
+            for dt in self.finished:
+                tests[str(dt)] = dict(duration=self.duration(dt),
+                                      state=dt.state)
+                if str(dt) in profiles:
+                    tests[str(dt)].update(profiles[str(dt)].dump())
+            self.history.add_run(tests)
+
+        return result
+
+    def _spawn(self, tests):
+        """Spawn the ready tests, highest rank first.
+
+        The threads start in the order they are spawned, and those
+        which find the semaphore free take it without comparing
+        priorities, so the first tests spawned must be the most
+        important ones.
+        """
+
+        super(CriticalPathQueue, self)._spawn(
+            sorted(tests, key=lambda dt: -self.rank.get(dt, 0.0)))
+
+    def _run_test(self, dt):
+        """Execute dt, letting the semaphore know which test waits."""
+
+        self._local.dt = dt
+        super(CriticalPathQueue, self)._run_test(dt)
+
+    def duration(self, dt):
+        """Retrieve how long a test took, or None if it did not run."""
+
+        if dt not in self.finished:
+            return None
+
+        return self.finished[dt] - self.started[dt]
+
+    def predicted_path(self):
+        """Retrieve the predicted critical path, as a list of tests."""
+
+        ranked = [dt for dt in self.rank if self.estimates[dt] > 0.0]
+        if not ranked:
+            return []
+
+        # The highest rank is always at the start of a chain
+        path = [max(ranked, key=self.rank.get)]
+        while True:
+            dependents = [dep for dep in path[-1].dependents
+                          if self.estimates.get(dep)]
+            if not dependents:
+                return path
+            path.append(max(dependents, key=self.rank.get))
+
+    def actual_path(self):
+        """Retrieve the actual critical path, as a list of tests.
+
+        This is the chain which ended last, found by walking back from
+        the last test to finish through the dependency each test was
+        the last to wait on.
+        """
+
+        if not self.finished:
+            return []
+
+        path = [max(self.finished, key=self.finished.get)]
+        while True:
+            deps = [dep for dep in path[-1].dependencies
+                    if dep in self.finished]
+            if not deps:
+                break
+            path.append(max(deps, key=self.finished.get))
+        path.reverse()
+
+        return path
+
+    def makespan(self):
+        """Retrieve how long the run took."""
+
+        if not self.finished:
+            return 0.0
+
+        return max(self.finished.values()) - min(self.started.values())
+
+    def critical_path_dot(self, grname='critpath'):
+        """Construct a GraphViz graph of the critical paths.
+
+        The predicted critical path is drawn in blue, the actual one
+        in red; each test is labeled with its estimated and actual
+        durations.  Edges point from a test to its dependency, as in
+        the graph of dot().
+        """
+
+        predicted = self.predicted_path()
+        actual = self.actual_path()
+
+        nodes = []
+        for dt in sorted(set(predicted + actual), key=str):
+            duration = self.duration(dt)
+            label = r'%s\npredicted %.1fs\nactual %s' % (
+                dt, self.estimates.get(dt, 0.0),
+                'not run' if duration is None else '%.1fs' % duration)
+            if dt in predicted and dt in actual:
+                color = 'purple'
+            else:
+                color = 'blue' if dt in predicted else 'red'
+            nodes.append('"%s" [label="%s",color="%s"];' % (dt, label, color))
+
+        edges = []
+        for path, color in ((predicted, 'blue'), (actual, 'red')):
+            for dep, dt in zip(path, path[1:]):
+                edges.append('"%s" -> "%s" [color="%s"];' % (dt, dep, color))
+
+        return (('digraph "%s" {\n\t' % grname) +
+                '\n\t'.join(nodes) + '\n\n\t' + '\n\t'.join(edges) + '\n}')
+
+    def critical_path_summary(self):
+        """Summarize the predicted and actual critical paths."""
+
+        predicted = self.predicted_path()
+        actual = self.actual_path()
+
+        return ("Critical path: predicted %.1fs over %d tests, actual "
+                "%.1fs over %d tests; run took %.1fs" %
+                (sum(self.estimates[dt] for dt in predicted), len(predicted),
+                 sum(self.duration(dt) for dt in actual), len(actual),
+                 self.makespan()))
+
+
+def main(directory=None, maxth=None, skip=lambda dt: dt.skip,
+         output=dtest.DTestOutput(), dryrun=False, debug=False,
+         dotpath=None, history=None, critpath=None):
+    """Discover and run the tests with a CriticalPathQueue.
+
+    Takes the same arguments as dtest.main(), plus the history of
+    earlier runs, which is updated and saved unless dryrun is True,
+    and critpath, a file in which to place the GraphViz graph of the
+    predicted and actual critical paths.
+    """
+
+    queue = CriticalPathQueue(maxth, skip, output, history)
+    dtest.explore(directory, queue)
+
+    if not dryrun:
+        result = queue.run(debug=debug)
+        print queue.critical_path_summary()
+        if history is not None:
+            history.save()
+    else:
+        result = True
+
+        # Print out the names of the tests
+        print "Discovered tests:\n"
+        for dt in queue.tests:
+            if dt.istest():
+                print str(dt)
+
+    if dotpath is not None:
+        with open(dotpath, 'w') as f:
+            print >>f, queue.dot()
+
+    if critpath is not None and not dryrun:
+        with open(critpath, 'w') as f:
+            print >>f, queue.critical_path_dot()
+
+    return result
@@ -0,0 +1,631 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import bisect
+import math
+import threading
+import time
+
+# Identify operating system threads, even when eventlet has patched the
+# thread module to identify green threads instead
+try:
+    from eventlet import patcher
+    _get_ident = patcher.original('thread').get_ident
+except ImportError:
+    from thread import get_ident as _get_ident
+
+
+class Statistics(object):
+    """Class to simplify collection of statistics."""
+
+    def __init__(self):
+        """Initialize statistics."""
+
+        self._samples = []
+        self._reset()
+
+    def append(self, sample):
+        """Add a sample to the statistics object."""
+
+        self._samples.append(sample)
+        self._reset()
+
+    def merge(self, other):
+        """Add all the samples from another statistics object."""
+
+        self._samples.extend(other._samples)
+        self._reset()
+
+    def dump(self):
+        """Return the samples as a JSON-serializable dictionary.
+
+        See load().
+        """
+
+        return dict(samples=list(self._samples))
+
+    def _reset(self):
+        """Reset internal memoization fields."""
+
+        self._avg = None
+        self._stddev = None
+        self._sorted = None
+
+    def __len__(self):
+        """Return the number of samples."""
+
+        return len(self._samples)
+
+    def __getitem__(self, key):
+        """Retrieve a given sample."""
+
+        return self._samples[key]
+
+    @property
+    def average(self):
+        """Retrieve the average of the samples, with memoization."""
+
+        if self._avg is None:
+            if len(self._samples) > 0:
+                self._avg = sum(self._samples) / len(self._samples)
+            else:
+                self._avg = 0.0
+
+        return self._avg
+
+    @property
+    def stddev(self):
+        """Retrieve the standard deviation, with memoization."""
+
+        if self._stddev is None:
+            if len(self._samples) > 1:
+                tmp = [(p - self.average) ** 2 for p in self._samples]
+                self._stddev = math.sqrt(sum(tmp) / (len(tmp) - 1))
+            else:
+                self._stddev = 0.0
+
+        return self._stddev
+
+    def percentile(self, percent):
+        """Retrieve the item representing the percentile.
+
+        The percentile is defined such that the given percentage of
+        samples are less than that value.  The percentage should be
+        given as a float between 0 and 1.
+        """
+
+        if self._sorted is None:
+            if len(self._samples) > 0:
+                self._sorted = sorted(self._samples)
+            else:
+                return 0.0
+
+        return self._sorted[int(len(self._sorted) * percent)]
+
+    def rank(self, value):
+        """Retrieve the number of samples less than or equal to value."""
+
+        if not self._samples:
+            return 0
+
+        if self._sorted is None:
+            self._sorted = sorted(self._samples)
+
+        return bisect.bisect_right(self._sorted, value)
+
+    @property
+    def median(self):
+        """Retrieve the median item, with memoization.
+
+        The median is defined as the item at index
+        round(num_samples * .5).
+        """
+
+        return self.percentile(.5)
+
+
+class Histogram(object):
+    """Mergeable quantile sketch with a bounded relative error.
+
+    Samples are counted in logarithmically-sized buckets, so that any
+    quantile returned is within a relative error of the true sample
+    at that rank.  The memory used depends only on the range of the
+    samples, not on their number.  Samples less than or equal to zero
+    cannot be placed in a logarithmic bucket and are counted as zero.
+    """
+
+    def __init__(self, error=0.01):
+        """Initialize a Histogram.
+
+        The error argument is the relative error bound, as a float
+        between 0 and 1; it defaults to 1%.
+        """
+
+        if not 0.0 < error < 1.0:
+            raise ValueError("error bound must be between 0 and 1")
+
+        self.error = error
+        self._gamma = (1.0 + error) / (1.0 - error)
+        self._lgamma = math.log(self._gamma)
+
+        self._buckets = {}
+        self._keys = None
+        self._zero = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value, count=1):
+        """Count a sample, optionally several times."""
+
+        if value > 0:
+            idx = int(math.ceil(math.log(value) / self._lgamma))
+            if idx in self._buckets:
+                self._buckets[idx] += count
+            else:
+                self._buckets[idx] = count
+                self._keys = None
+        else:
+            self._zero += count
+
+        self.count += count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Add all the counts from another Histogram.
+
+        Both histograms must have been created with the same error
+        bound.
+        """
+
+        if other.error != self.error:
+            raise ValueError("cannot merge histograms with different "
+                             "error bounds")
+
+        for idx, count in other._buckets.items():
+            if idx in self._buckets:
+                self._buckets[idx] += count
+            else:
+                self._buckets[idx] = count
+                self._keys = None
+
+        self._zero += other._zero
+        self.count += other.count
+        if other.min is not None and (self.min is None or
+                                      other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or
+                                      other.max > self.max):
+            self.max = other.max
+
+    def dump(self):
+        """Return the counts as a JSON-serializable dictionary."""
+
+        return dict(error=self.error, buckets=self._buckets.items(),
+                    zero=self._zero, count=self.count, min=self.min,
+                    max=self.max)
+
+    @classmethod
+    def load(cls, state):
+        """Recreate a Histogram from the output of dump()."""
+
+        hist = cls(state['error'])
+        hist._buckets = dict((int(idx), count)
+                             for idx, count in state['buckets'])
+        hist._zero = state['zero']
+        hist.count = state['count']
+        hist.min = state['min']
+        hist.max = state['max']
+
+        return hist
+
+    def quantile(self, percent):
+        """Retrieve the approximate value at the given percentile.
+
+        Uses the same rank definition as Statistics.percentile(), so
+        that the two may be compared directly.
+        """
+
+        if self.count == 0:
+            return 0.0
+
+        rank = min(int(self.count * percent), self.count - 1)
+
+        # Samples at or below zero sort first
+        seen = self._zero
+        if rank < seen:
+            return min(self.min, 0.0)
+
+        if self._keys is None:
+            self._keys = sorted(self._buckets)
+
+        for idx in self._keys:
+            seen += self._buckets[idx]
+            if rank < seen:
+                # Use the midpoint of the bucket, which is what
+                # bounds the relative error
+                value = 2.0 * self._gamma ** idx / (self._gamma + 1.0)
+                return max(self.min, min(self.max, value))
+
+        return self.max
+
+    def rank(self, value):
+        """Retrieve the approximate number of samples up to value.
+
+        Counts the samples in the buckets whose upper bounds are less
+        than or equal to value.
+        """
+
+        if value < 0:
+            return 0
+
+        if self._keys is None:
+            self._keys = sorted(self._buckets)
+
+        result = self._zero
+        for idx in self._keys:
+            if self._gamma ** idx > value:
+                break
+            result += self._buckets[idx]
+
+        return result
+
+    def __len__(self):
+        """Return the number of samples counted."""
+
+        return self.count
+
+
+class StreamingStatistics(object):
+    """Constant-memory replacement for Statistics.
+
+    Keeps a running mean and variance and a Histogram sketch for the
+    percentiles, instead of keeping every sample.  Provides the same
+    average, stddev, median, and percentile() interface as
+    Statistics; individual samples cannot be retrieved.
+    """
+
+    def __init__(self, error=0.01):
+        """Initialize streaming statistics.
+
+        The error argument is the relative error bound for the
+        percentiles; see Histogram.
+        """
+
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._hist = Histogram(error)
+
+    def append(self, sample):
+        """Add a sample to the statistics object."""
+
+        # Welford's algorithm, which avoids the cancellation problems
+        # of keeping a sum of squares
+        self._count += 1
+        delta = sample - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (sample - self._mean)
+
+        self._hist.add(sample)
+
+    def merge(self, other):
+        """Add all the samples from another StreamingStatistics."""
+
+        if other._count == 0:
+            return
+
+        count = self._count + other._count
+        delta = other._mean - self._mean
+        self._mean += delta * other._count / count
+        self._m2 += (other._m2 +
+                     delta * delta * self._count * other._count / count)
+        self._count = count
+
+        self._hist.merge(other._hist)
+
+    def dump(self):
+        """Return the summary as a JSON-serializable dictionary.
+
+        See load().
+        """
+
+        return dict(count=self._count, mean=self._mean, m2=self._m2,
+                    histogram=self._hist.dump())
+
+    def __len__(self):
+        """Return the number of samples."""
+
+        return self._count
+
+    @property
+    def average(self):
+        """Retrieve the average of the samples."""
+
+        return float(self._mean)
+
+    @property
+    def stddev(self):
+        """Retrieve the standard deviation."""
+
+        if self._count > 1:
+            return math.sqrt(self._m2 / (self._count - 1))
+
+        return 0.0
+
+    def percentile(self, percent):
+        """Retrieve the approximate item representing the percentile.
+
+        The percentile is defined as for Statistics.percentile(), but
+        the value returned is only accurate to within the error bound
+        the object was created with.
+        """
+
+        return self._hist.quantile(percent)
+
+    def rank(self, value):
+        """Retrieve the approximate number of samples up to value."""
+
+        return self._hist.rank(value)
+
+    @property
+    def median(self):
+        """Retrieve the approximate median item."""
+
+        return self.percentile(.5)
+
+
+class ConcurrentStatistics(object):
+    """Statistics tracker which many threads may append to at once.
+
+    Wraps a Statistics or StreamingStatistics, providing the same
+    interface.  Each thread appends its samples to a buffer of its
+    own, which no other thread appends to, so recording a sample takes
+    no lock.  Before anything is read from the tracker, the buffers
+    are drained into the wrapped tracker under a lock which only
+    readers take.  The buffers are per operating system thread, not
+    per green thread, so running each request in its own green thread
+    costs no extra buffers.
+    """
+
+    def __init__(self, tracker):
+        """Initialize a ConcurrentStatistics wrapping tracker."""
+
+        self._tracker = tracker
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def append(self, sample):
+        """Add a sample to the calling thread's buffer."""
+
+        ident = _get_ident()
+        buf = self._buffers.get(ident)
+        if buf is None:
+            buf = self._buffers.setdefault(ident, [])
+
+        buf.append(sample)
+
+    def _drain(self):
+        """Move the buffered samples into the wrapped tracker."""
+
+        with self._lock:
+            for buf in self._buffers.values():
+                # Appends only ever go on the end, so the samples up
+                # to the current length can be taken safely
+                count = len(buf)
+                if count:
+                    samples = buf[:count]
+                    del buf[:count]
+                    for sample in samples:
+                        self._tracker.append(sample)
+
+    def __len__(self):
+        """Return the number of samples."""
+
+        self._drain()
+        return len(self._tracker)
+
+    def __getitem__(self, key):
+        """Retrieve a given sample, if the wrapped tracker keeps them."""
+
+        self._drain()
+        return self._tracker[key]
+
+    def __getattr__(self, name):
+        """Delegate everything else to the wrapped tracker."""
+
+        # Don't recurse if we're not yet initialized
+        if name in ('_tracker', '_buffers', '_lock'):
+            raise AttributeError(name)
+
+        self._drain()
+        return getattr(self._tracker, name)
+
+
+class Counter(object):
+    """Counter which many threads may increment at once.
+
+    Like ConcurrentStatistics, each thread only updates a count of
+    its own, so incrementing takes no lock; the value is the sum of
+    the counts.
+    """
+
+    def __init__(self):
+        """Initialize a Counter at zero."""
+
+        self._counts = {}
+
+    def add(self, count=1):
+        """Add to the counter."""
+
+        ident = _get_ident()
+        self._counts[ident] = self._counts.get(ident, 0) + count
+
+    @property
+    def value(self):
+        """Retrieve the value of the counter."""
+
+        return sum(self._counts.values())
+
+
+def corrected(sample, interval):
+    """Return a sample along with the samples a stall kept from being taken.
+
+    Implements the coordinated omission correction of HdrHistogram's
+    recordValueWithExpectedInterval(): if calls were meant to be made
+    every interval, and one took sample to complete, then the calls
+    due while it was outstanding were held up behind it, so samples
+    of sample - interval, sample - 2 * interval, and so on down to
+    interval, are added.  Returns the list of samples to record.
+    """
+
+    result = [sample]
+    if interval > 0:
+        missing = sample - interval
+        while missing >= interval:
+            result.append(missing)
+            missing -= interval
+
+    return result
+
+
+def load(state):
+    """Recreate a statistics tracker from the output of its dump().
+
+    Returns a Statistics or a StreamingStatistics, depending on which
+    was dumped.  Used to ship trackers between processes.
+    """
+
+    if 'samples' in state:
+        result = Statistics()
+        result._samples = list(state['samples'])
+        return result
+
+    result = StreamingStatistics(state['histogram']['error'])
+    result._count = state['count']
+    result._mean = state['mean']
+    result._m2 = state['m2']
+    result._hist = Histogram.load(state['histogram'])
+
+    return result
+
+
+class Window(object):
+    """Statistics for the samples falling in one window of time.
+
+    The attributes are as follows:
+
+    - start
+        The time the window started.
+
+    - end
+        The time the window ended, or None if it is still open.
+
+    - stats
+        A StreamingStatistics holding the samples.
+
+    - errors
+        The number of errors counted.
+
+    """
+
+    def __init__(self, start, error=0.01):
+        """Initialize a Window starting at the given time."""
+
+        self.start = start
+        self.end = None
+        self.stats = StreamingStatistics(error)
+        self.errors = 0
+
+    @property
+    def total(self):
+        """Retrieve the number of samples and errors."""
+
+        return len(self.stats) + self.errors
+
+    @property
+    def throughput(self):
+        """Retrieve the number of samples and errors per minute."""
+
+        if self.end is None or self.end <= self.start:
+            return 0.0
+
+        return self.total * 60.0 / (self.end - self.start)
+
+    @property
+    def error_rate(self):
+        """Retrieve the fraction of the total which were errors."""
+
+        if self.total == 0:
+            return 0.0
+
+        return float(self.errors) / self.total
+
+
+class RollingWindow(object):
+    """Statistics over consecutive fixed-width windows of time.
+
+    Samples and errors are counted in the current window; roll()
+    closes it once it is width seconds old and opens the next.  Only
+    the most recent closed windows are kept, so the memory used does
+    not grow with the length of the run.
+    """
+
+    def __init__(self, width=60.0, keep=60, error=0.01, now=None):
+        """Initialize a RollingWindow.
+
+        The width is in seconds; keep is the number of closed windows
+        to keep, and error the relative error bound for the
+        percentiles of each window.
+        """
+
+        self.width = width
+        self.keep = keep
+        self.error = error
+        self.windows = []
+        self.current = Window(now or time.time(), error)
+
+    def append(self, sample):
+        """Add a sample to the current window."""
+
+        self.current.stats.append(sample)
+
+    def add_error(self):
+        """Count an error in the current window."""
+
+        self.current.errors += 1
+
+    def roll(self, now=None):
+        """Close the current window if it is over.
+
+        Returns the closed window, or None if the current window is
+        not yet width seconds old.
+        """
+
+        now = now or time.time()
+        if now - self.current.start < self.width:
+            return None
+
+        closed = self.current
+        closed.end = now
+        self.current = Window(now, self.error)
+
+        self.windows.append(closed)
+        del self.windows[:-self.keep]
+
+        return closed
@@ -15,119 +15,214 @@
 
 import dtest
 from dtest import util as dtutil
-import math
-import time
+import eventlet
+from eventlet import corolocal
+import inspect
+import socket
 
 import base
+import cleanup
+import results
+import tracing
+from stats import ConcurrentStatistics, Counter, Statistics, \
+    StreamingStatistics, corrected
 import utils
 
 FLAGS = base.FLAGS
 
 
 @dtest.skip
-@dtest.attr(stress=True)
+@dtest.attr(stress=True, soak=True, scenario=True, aggregate=True)
 def setUp():
     """Sets up attribute and skip information for stress tests."""
 
     pass
 
 
-@dtest.attr(stress=True)
+@dtest.attr(stress=True, soak=True, scenario=True, aggregate=True)
 def tearDown():
     """A convenient hook point for tests on collected statistics."""
 
     pass
 
 
-class Statistics(object):
-    """Class to simplify collection of statistics."""
+def mk_statistics(name=None, exact=False):
+    """Allocate a statistics tracker.
 
-    def __init__(self):
-        """Initialize statistics."""
+    Returns a StreamingStatistics object if --streaming-stats was
+    given, or a list-backed Statistics object otherwise; trackers
+    allocated with exact=True, which should only be used for trackers
+    of a few samples, are always list-backed.  Either way, the tracker
+    is wrapped in a ConcurrentStatistics, so that the many threads of
+    a stress test may append to it at once.  If --results-db was
+    given and the tracker is named, the samples are also recorded
+    there under the given name.
+    """
 
-        self._samples = []
-        self._reset()
+    if FLAGS.streaming_stats and not exact:
+        tracker = StreamingStatistics(FLAGS.stats_error)
+    else:
+        tracker = Statistics()
+    tracker = ConcurrentStatistics(tracker)
 
-    def append(self, sample):
-        """Add a sample to the statistics object."""
+    if name is None:
+        return tracker
 
-        self._samples.append(sample)
-        self._reset()
+    return results.track(name, tracker)
 
-    def _reset(self):
-        """Reset internal memoization fields."""
 
-        self._avg = None
-        self._stddev = None
-        self._sorted = None
+# Allocate our necessary statistics-tracking items
+# The rates are kept exactly, so that the rates sampled by distributed
+# workers can be summed sample by sample
+creates_per_min = mk_statistics('creates_per_min', exact=True)
+create_time = mk_statistics('create_time')
+requests_per_min = mk_statistics('requests_per_min', exact=True)
+request_time = mk_statistics('request_time')
 
-    def __len__(self):
-        """Return the number of samples."""
+# The phases of instance creation: the time for the API to accept the
+# create; from then until the instance is first seen building; and
+# from then until it is first seen active.  The latter two can only be
+# observed when the state is polled, so they are paired with trackers
+# of the maximum polling error of each sample.
+create_accept_time = mk_statistics('create_accept_time')
+create_queue_time = mk_statistics('create_queue_time')
+create_queue_error = mk_statistics('create_queue_error')
+create_build_time = mk_statistics('create_build_time')
+create_build_error = mk_statistics('create_build_error')
 
-        return len(self._samples)
+# Glance image uploads: the throughput of each upload, in megabytes
+# per second; the time it took; the time from its start until Nova
+# lists the image as active; and the time taken to delete the image
+image_upload_rate = mk_statistics('image_upload_rate')
+image_upload_time = mk_statistics('image_upload_time')
+image_available_time = mk_statistics('image_available_time')
+image_delete_time = mk_statistics('image_delete_time')
 
-    def __getitem__(self, key):
-        """Retrieve a given sample."""
+# Live progress counters, read by stress.monitor
+progress = dict((name, Counter()) for name in
+                ('requests_in_flight', 'requests_completed',
+                 'requests_failed', 'builds_outstanding',
+                 'creates_completed', 'creates_failed'))
 
-        return self._samples[key]
+# The times of failed requests, keyed by status: the HTTP status code
+# of the response, 'timeout' if the request timed out, or 'error' if
+# there was no response
+request_failure_time = {}
 
-    @property
-    def average(self):
-        """Retrieve the average of the samples, with memoization."""
 
-        if self._avg is None:
-            if len(self._samples) > 0:
-                self._avg = sum(self._samples) / len(self._samples)
-            else:
-                self._avg = 0.0
+def failure_statistics(status):
+    """Retrieve the statistics tracker for failures with a status."""
 
-        return self._avg
+    if status not in request_failure_time:
+        request_failure_time[status] = mk_statistics(
+            'request_failure_time:%s' % status)
 
-    @property
-    def stddev(self):
-        """Retrieve the standard deviation, with memoization."""
+    return request_failure_time[status]
 
-        if self._stddev is None:
-            if len(self._samples) > 1:
-                tmp = [(p - self.average) ** 2 for p in self._samples]
-                self._stddev = math.sqrt(sum(tmp) / (len(tmp) - 1))
-            else:
-                self._stddev = 0.0
 
-        return self._stddev
+# Request times broken down by endpoint, keyed by (manager, method,
+# status); the status is the HTTP status code of the response, or
+# 'error' if there was none
+endpoint_time = {}
 
-    def percentile(self, percent):
-        """Retrieve the item representing the percentile.
 
-        The percentile is defined such that the given percentage of
-        samples are less than that value.  The percentage should be
-        given as a float between 0 and 1.
-        """
+def endpoint_statistics(manager, method, status):
+    """Retrieve the statistics tracker for an endpoint and status."""
 
-        if self._sorted is None:
-            if len(self._samples) > 0:
-                self._sorted = sorted(self._samples)
-            else:
-                return 0.0
+    key = (manager, method, status)
+    if key not in endpoint_time:
+        endpoint_time[key] = mk_statistics('request_time:%s.%s:%s' % key)
 
-        return self._sorted[int(len(self._sorted) * percent)]
+    return endpoint_time[key]
 
-    @property
-    def median(self):
-        """Retrieve the median item, with memoization.
 
-        The median is defined as the item at index
-        round(num_samples * .5).
-        """
+# With --trace-file, the time successful requests spent in each phase
+# of their HTTP exchanges, keyed by (manager, method, phase); see
+# tracing.phases()
+phase_time = {}
 
-        return self.percentile(.5)
 
+def phase_statistics(manager, method, phase):
+    """Retrieve the statistics tracker for an endpoint and phase."""
+
+    key = (manager, method, phase)
+    if key not in phase_time:
+        phase_time[key] = mk_statistics('phase_time:%s.%s:%s' % key)
+
+    return phase_time[key]
+
+
+def endpoints():
+    """Retrieve the request times of each endpoint, for all statuses.
+
+    Returns a dictionary mapping (manager, method) keys to
+    dictionaries mapping statuses to statistics trackers.
+    """
+
+    result = {}
+    for (manager, method, status), tracker in endpoint_time.items():
+        result.setdefault((manager, method), {})[status] = tracker
+
+    return result
 
-# Allocate our necessary statistics-tracking items
-creates_per_min = Statistics()
-create_time = Statistics()
-requests_per_min = Statistics()
-request_time = Statistics()
+
+# Per-thread request context; the load generator sets 'intended' to
+# the time at which the next request was scheduled to be sent, and
+# 'interval' to the interval, in seconds, between the requests it
+# sends; start_time() sets 'late' to how late, in seconds, the current
+# request was sent, or None if it was not scheduled
+context = corolocal.local()
+
+
+def start_time(consume=True):
+    """Retrieve the start time of the current request.
+
+    This is the time the request was scheduled to be sent, if one was
+    set in the request context and --omission-correction is
+    "schedule", or the current time otherwise.  Unless consume is
+    False, the scheduled time is cleared, so that it only applies to
+    one request.  Times are given by utils.monotonic().
+    """
+
+    now = utils.monotonic()
+
+    intended = getattr(context, 'intended', None)
+    if intended is None:
+        context.late = None
+        return now
+
+    context.late = now - intended
+    if consume:
+        context.intended = None
+
+    if FLAGS.omission_correction != 'schedule':
+        return now
+
+    return min(intended, now)
+
+
+def record_request(tracker, sample):
+    """Record a request time in a tracker.
+
+    With --omission-correction=backfill, if the load generator
+    stalled, the requests which would have been sent while the
+    request was outstanding, had the generator been free to send
+    them, are also recorded; see stats.corrected().  The generator
+    is open-loop, so it only stalls when --max-in-flight requests are
+    outstanding, which shows as the request being sent at least an
+    interval late; otherwise the requests after it were sent on
+    schedule, and their own samples already count.
+    """
+
+    interval = getattr(context, 'interval', None)
+    late = getattr(context, 'late', None)
+    if (FLAGS.omission_correction != 'backfill' or not interval or
+        late is None or late < interval):
+        tracker.append(sample)
+        return
+
+    for value in corrected(sample, interval * 1000.0):
+        tracker.append(value)
 
 
 # Wrap requests to collect response time information
@@ -135,30 +230,79 @@ def wrap_request(call, *args, **kwargs):
     """Wraps call to record start and end times.
 
     The total time taken to perform the request is stored in the
-    request_time statistics tracker.
+    request_time statistics tracker.  The time is measured from when
+    the request was scheduled to be sent, if the load generator
+    scheduled it; see start_time().
     """
 
-    # Get the start time of the request
-    start = time.time()
+    return wrap_endpoint_request(None, call, *args, **kwargs)
+
+
+def wrap_endpoint_request(endpoint, call, *args, **kwargs):
+    """Wraps call to record start and end times, by endpoint.
+
+    Like wrap_request(), but unless endpoint is None, it must be a
+    (manager, method) tuple, and the time taken is also stored in the
+    endpoint_time statistics tracker for the endpoint and the HTTP
+    status of the response.  Failed requests, including those which
+    time out, are recorded in request_failure_time instead of
+    request_time.  With --trace-file, the time successful requests
+    spent in each phase of their HTTP exchanges is also recorded, in
+    phase_time.  With --debug, the call and its outcome are printed,
+    outside the time measured.
+    """
 
-    # Make the call
     if FLAGS.debug:
         print "%r(%r, %r)" % (call, args, kwargs)
+
+    # Get the start time of the request
+    start = start_time()
+    context.status = None
+
+    # Make the call
+    progress['requests_in_flight'].add()
+    tracing.begin()
     try:
         response = call(*args, **kwargs)
-        if FLAGS.debug:
-            print "-> %r" % response
-    except Exception, e:
+    except (Exception, eventlet.Timeout), e:
+        end = utils.monotonic()
+        progress['requests_in_flight'].add(-1)
+        progress['requests_failed'].add()
+
+        if isinstance(e, (eventlet.Timeout, socket.timeout)):
+            status = 'timeout'
+        else:
+            status = getattr(e, 'code', None) or 'error'
+        tracing.phases()
+        record_request(failure_statistics(status), (end - start) * 1000.0)
+        if endpoint is not None:
+            record_request(endpoint_statistics(endpoint[0], endpoint[1],
+                                               status),
+                           (end - start) * 1000.0)
+
         if FLAGS.debug:
             print "-> Threw %r" % e
 
         raise
 
     # Get the end time of the request
-    end = time.time()
+    end = utils.monotonic()
+    phases = tracing.phases()
+    progress['requests_in_flight'].add(-1)
+    progress['requests_completed'].add()
 
     # Store this data in our request_time statistics container
-    request_time.append((end - start) * 1000.0)
+    record_request(request_time, (end - start) * 1000.0)
+    if endpoint is not None:
+        record_request(endpoint_statistics(endpoint[0], endpoint[1],
+                                           context.status or 'error'),
+                       (end - start) * 1000.0)
+        for phase, seconds in (phases or {}).items():
+            phase_statistics(endpoint[0], endpoint[1],
+                             phase).append(seconds * 1000.0)
+
+    if FLAGS.debug:
+        print "-> %r" % response
 
     # Return the response
     return response
@@ -171,56 +315,139 @@ class WrapperProxy(object):
         """Initialize WrapperProxy."""
 
         self._wrapped = wrapped
-        self._cache = {}
-        self._nocache = set()
 
     def __getattr__(self, name):
         """Retrieve an attribute.
 
-        If a value for the given name has been cached, returns it;
-        otherwise, calls _wrap() with the raw value of the attribute;
+        Only called for attributes not found on the proxy itself.
+        Calls _wrap() with the name and raw value of the attribute;
         _wrap() must return a tuple consisting of the value to return
         to the caller and True or False depending on whether that
-        value should be cached.
+        value should be cached.  Cached values are stored on the
+        proxy, so later lookups find them without calling
+        __getattr__() again.
         """
 
-        # If name is in the cache, return it
-        if name in self._cache:
-            return self._cache[name]
-        elif name in self._nocache:
-            return getattr(self._wrapped, name)
-
         # OK, call our helper with the real value of the attribute
-        value, cache = self._wrap(getattr(self._wrapped, name))
+        value, cache = self._wrap(name, getattr(self._wrapped, name))
 
         # Do we cache it?
         if cache is True:
-            self._cache[name] = value
-        else:
-            self._nocache.add(name)
+            setattr(self, name, value)
 
         # Return the value
         return value
 
 
+def _endpoint_method(endpoint, func):
+    """Build a proxy method calling func with wrap_endpoint_request()."""
+
+    def method(self, *args, **kwargs):
+        return wrap_endpoint_request(endpoint, func, self._wrapped,
+                                     *args, **kwargs)
+
+    method.__name__ = func.__name__
+    method.__doc__ = func.__doc__
+
+    return method
+
+
 class OpenStackProxy(WrapperProxy):
-    """Proxy for the internal classes of the OpenStack class."""
+    """Proxy for the internal classes of the OpenStack class.
+
+    Use OpenStackProxy.proxy() to create one: it builds, once for
+    each class and manager name, a subclass whose methods call those
+    of the class through wrap_endpoint_request(), so calling a method
+    through the proxy costs no attribute lookups or closures.
+    """
+
+    # The proxy classes, by wrapped class and manager name
+    _classes = {}
+
+    def __init__(self, wrapped, manager):
+        """Initialize OpenStackProxy for the named manager."""
 
-    def _wrap(self, value):
-        """Wrap callables with wrap_request()."""
+        super(OpenStackProxy, self).__init__(wrapped)
+        self._manager = manager
 
-        # If value is a callable, use wrap_request
+    @classmethod
+    def proxy(cls, wrapped, manager):
+        """Create the proxy for an object, under a manager name."""
+
+        key = (type(wrapped), manager)
+        proxy_cls = cls._classes.get(key)
+        if proxy_cls is None:
+            methods = {}
+            for name, value in inspect.getmembers(type(wrapped),
+                                                  inspect.ismethod):
+                # Leave out private methods and class methods
+                if name.startswith('_') or value.im_self is not None:
+                    continue
+                methods[name] = _endpoint_method((manager, name),
+                                                 value.im_func)
+
+            proxy_cls = type('%sProxy' % type(wrapped).__name__, (cls,),
+                             methods)
+            cls._classes[key] = proxy_cls
+
+        result = proxy_cls(wrapped, manager)
+
+        # Methods replaced on the object itself take precedence
+        for name, value in vars(wrapped).items():
+            if not name.startswith('_') and callable(value):
+                setattr(result, name, result._wrap(name, value)[0])
+
+        return result
+
+    def _wrap(self, name, value):
+        """Wrap other callables with wrap_endpoint_request()."""
+
+        # If value is a callable, use wrap_endpoint_request
         if callable(value):
-            return (lambda *a, **kw: wrap_request(value, *a, **kw)), True
+            endpoint = (self._manager, name)
+            return (lambda *a, **kw: wrap_endpoint_request(endpoint, value,
+                                                           *a, **kw)), True
 
         # Don't cache regular value
         return value, False
 
 
 class OpenStackWrapped(WrapperProxy):
-    """Proxy for the OpenStack class."""
+    """Proxy for the OpenStack class.
+
+    Use OpenStackWrapped.wrap() to obtain one; the proxy for each
+    OpenStack instance is built once, along with the proxies for its
+    managers, and reused for as long as the instance lives.
+    """
 
-    def _wrap(self, value):
+    def __init__(self, wrapped):
+        """Initialize OpenStackWrapped.
+
+        Also arranges for the HTTP status of each response received
+        by the wrapped instance to be saved in the request context,
+        for wrap_endpoint_request().
+        """
+
+        super(OpenStackWrapped, self).__init__(wrapped)
+
+        client = wrapped.client
+        if not getattr(client, '_saves_status', False):
+            request = client.request
+
+            def save_status(*args, **kwargs):
+                resp, body = request(*args, **kwargs)
+                context.status = resp.status
+                return resp, body
+
+            client.request = save_status
+            client._saves_status = True
+
+        # Build the manager proxies now, rather than on first use
+        for name, value in vars(wrapped).items():
+            if not name.startswith('_') and not callable(value):
+                getattr(self, name)
+
+    def _wrap(self, name, value):
         """Wrap non-callable instances with OpenStackProxy."""
 
         # Ignore callables...
@@ -228,13 +455,36 @@ class OpenStackWrapped(WrapperProxy):
             return value, False
 
         # Create OpenStackProxy objects for everything else
-        return OpenStackProxy(value), True
+        return OpenStackProxy.proxy(value, name), True
+
+    @classmethod
+    def wrap(cls, os):
+        """Retrieve the proxy for an OpenStack instance.
+
+        Creates it the first time; if os is already a proxy, returns
+        it.
+        """
+
+        if isinstance(os, cls):
+            return os
+
+        wrapper = getattr(os, '_stress_wrapper', None)
+        if wrapper is None:
+            wrapper = cls(os)
+            os._stress_wrapper = wrapper
+
+        return wrapper
 
     @classmethod
     def getOpenStack(cls):
         """Get and return a wrapped OpenStack instance."""
 
-        return cls(base.BaseIntegrationTest.getOpenStack())
+        return cls.wrap(base.BaseIntegrationTest.getOpenStack())
+
+    def release(self):
+        """Release the wrapped OpenStack instance to the client pool."""
+
+        base.BaseIntegrationTest.releaseOpenStack(self._wrapped)
 
 
 # Helper for creating a server--waits for the instance to finish being
@@ -247,19 +497,57 @@ def mk_instance(os, *args, **kwargs):
     is not wrapped by OpenStackWrapped, it will be so wrapped, to
     provide statistics information.  The required creation arguments,
     if not present, will default to appropriate values.  The creation
-    time required is tracked in the create_time statistics tracker.
+    time required is tracked in the create_time statistics tracker,
+    and the time taken by each phase of the creation in the
+    create_accept_time, create_queue_time, and create_build_time
+    trackers.
 
     Returns the created instance, or raises an exception (possibly
     AssertionError) if creation is unsuccessful.
     """
 
     # Make sure we have an openstack handle
+    release = False
     if not os:
         os = OpenStackWrapped.getOpenStack()
+        release = True
+
+    try:
+        # Now, kick off the create...
+        new_server, states, start, accepted = submit_instance(os, *args,
+                                                              **kwargs)
+
+        # And wait for it to finish
+        try:
+            dtutil.assert_true(states.waitForPolledState('servers',
+                                                         new_server))
+        except Exception:
+            finish_instance(False)
+            raise
+        end = utils.monotonic()
+    finally:
+        if release:
+            os.release()
+
+    record_instance(states, start, accepted, end)
+
+    # Return the new server
+    return new_server
+
+
+def submit_instance(os, *args, **kwargs):
+    """Submit an instance create, without waiting for it to finish.
+
+    The arguments are as for mk_instance(), except that os may not be
+    None.  Returns a tuple of the new instance; the StatusTracker to
+    follow it to the active state with; the start time of the create;
+    and the time the API accepted it.  Once the instance is active,
+    pass the latter three and the time it became active to
+    record_instance().
+    """
 
     # Make sure it's wrapped
-    if not isinstance(os, OpenStackWrapped):
-        os = OpenStackWrapped(os)
+    os = OpenStackWrapped.wrap(os)
 
     # Also ensure the instance has a name...
     if len(args) < 1 and 'name' not in kwargs:
@@ -277,18 +565,54 @@ def mk_instance(os, *args, **kwargs):
     # follow it through the required states
     states = utils.StatusTracker('active', 'build', 'active')
 
-    # Now, kick off the create...
-    start = time.time()
-    new_server = os.servers.create(*args, **kwargs)
+    start = start_time(consume=False)
+    try:
+        new_server = cleanup.janitor.track(
+            'servers', os.servers.create(*args, **kwargs))
+    except Exception:
+        progress['creates_failed'].add()
+        raise
+    accepted = utils.monotonic()
+    progress['builds_outstanding'].add()
+
+    return new_server, states, start, accepted
+
+
+def finish_instance(success):
+    """Count a build submitted by submit_instance() as finished.
+
+    Successful builds are counted by record_instance(); this is only
+    needed for failed ones.
+    """
+
+    progress['builds_outstanding'].add(-1)
+    if success:
+        progress['creates_completed'].add()
+    else:
+        progress['creates_failed'].add()
+
 
-    # And wait for it to finish
-    dtutil.assert_true(states.waitForState(os.servers.get, 'status',
-                                           new_server))
-    end = time.time()
+def record_instance(states, start, accepted, end):
+    """Record the time taken by a successful instance create."""
+
+    finish_instance(True)
 
     # Store the create time data in our create_time statistics
     # container
     create_time.append((end - start) * 1000.0)
 
-    # Return the new server
-    return new_server
+    # Now break it down into phases; if the build was over before we
+    # got to see it, it's only known to have started before the
+    # instance was seen active
+    active_seen, active_since = states.observed('active')
+    build_seen, build_since = states.observed('build') or (active_seen,
+                                                           active_since)
+    build_since = max(build_since, accepted)
+    active_since = max(active_since, build_since)
+
+    create_accept_time.append((accepted - start) * 1000.0)
+    create_queue_time.append((build_seen - accepted) * 1000.0)
+    create_queue_error.append((build_seen - build_since) * 1000.0)
+    create_build_time.append((active_seen - build_seen) * 1000.0)
+    create_build_error.append(((active_seen - active_since) +
+                               (build_seen - build_since)) * 1000.0)
@@ -0,0 +1,344 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Distribute the stress tests over several worker processes.
+
+A single process cannot issue requests fast enough to stress a real
+Nova, so the coordinator (run_tests.py --stress --workers=N) splits
+the request and create rates among worker processes, each running the
+stress tests with its share of the rates.  Local workers are started
+as subprocesses; workers on other hosts are started by hand with
+--coordinator=HOST:PORT, and counted by --remote-workers.
+
+The protocol is newline-delimited JSON over a plain TCP connection.
+A worker connects, and once all the workers have, the coordinator
+sends each one its index and the number of workers, which starts the
+load on all of them together.  When its tests are done, a worker
+sends a message for each statistics tracker, holding the output of
+its dump(), and then a final message with the outcome of its tests.
+The coordinator merges the trackers into its own, which the checks in
+test_stress then run against.
+"""
+
+import itertools
+import json
+import socket
+import subprocess
+import sys
+
+import eventlet
+
+import base
+import stats
+import stress
+import utils
+
+
+FLAGS = base.FLAGS
+
+# Options which only concern the coordinator, and are not passed on
+# to local workers; --metrics-port is replaced by a port for each
+coordinator_opts = ('--workers', '--remote-workers', '--coordinator-host',
+                    '--coordinator-port', '--checkin-timeout',
+                    '--results-db', '--fake-cloud', '--metrics-port')
+
+
+class DistributedError(Exception):
+    """Raised when the workers cannot be coordinated."""
+
+    pass
+
+
+def trackers():
+    """Retrieve the stress statistics trackers to ship.
+
+    Returns a dictionary mapping a key for each tracker to the
+    tracker; the keys are the names of the module-level trackers,
+    (manager, method, status) tuples for the endpoint trackers,
+    ('failed', status) tuples for the failed request trackers, or
+    ('phase', manager, method, phase) tuples for the phase trackers.
+    """
+
+    result = dict((name, getattr(stress, name)) for name in
+                  ('creates_per_min', 'create_time', 'requests_per_min',
+                   'request_time', 'create_accept_time',
+                   'create_queue_time', 'create_queue_error',
+                   'create_build_time', 'create_build_error',
+                   'image_upload_rate', 'image_upload_time',
+                   'image_available_time', 'image_delete_time'))
+    result.update(stress.endpoint_time)
+    result.update((('failed', status), tracker) for status, tracker
+                  in stress.request_failure_time.items())
+    result.update((('phase',) + key, tracker) for key, tracker
+                  in stress.phase_time.items())
+
+    return result
+
+
+def share(total, index, workers):
+    """Compute one worker's share of a total rate."""
+
+    return total // workers + (1 if index < total % workers else 0)
+
+
+def worker_argv(opts, argv, coordinator):
+    """Compute the command line for a local worker.
+
+    Strips the coordinator's own options from argv, using the option
+    parser opts to tell which options take values, and points the
+    worker at the coordinator; also points it at the Nova and Glance
+    given by FLAGS, so that workers use the coordinator's fake cloud.
+    """
+
+    result = [sys.executable, argv[0]]
+
+    args = iter(argv[1:])
+    for arg in args:
+        name = arg.split('=', 1)[0]
+        if name not in coordinator_opts:
+            result.append(arg)
+        elif '=' not in arg and opts.get_option(name).takes_value():
+            # Skip the option's value too
+            next(args, None)
+
+    result.extend(['--coordinator=%s:%d' % coordinator,
+                   '--nova-url=%s' % FLAGS.nova_url,
+                   '--glance-host=%s' % FLAGS.glance_host,
+                   '--glance-port=%d' % FLAGS.glance_port])
+
+    return result
+
+
+class Coordinator(object):
+    """Start and gather the results of the stress workers."""
+
+    def __init__(self, local, remote=0, host='127.0.0.1', port=0,
+                 timeout=300):
+        """Initialize a Coordinator.
+
+        Listens for local workers, and remote ones if any, on the
+        given host and port; a port of 0 picks any free port.  The
+        workers must all connect within timeout seconds.
+        """
+
+        self.local = local
+        self.remote = remote
+        self.workers = local + remote
+        self.timeout = timeout
+
+        self.server = eventlet.listen((host, port))
+        self.address = self.server.getsockname()
+
+        self.procs = []
+        self.failed = []
+
+    def spawn(self, opts, argv):
+        """Start the local workers.
+
+        With --metrics-port, each local worker serves its own metrics,
+        on consecutive ports starting from the one given (or on free
+        ports, if it is 0).
+        """
+
+        argv = worker_argv(opts, argv, ('127.0.0.1', self.address[1]))
+        for i in range(self.local):
+            port = []
+            if FLAGS.metrics_port is not None:
+                port = ['--metrics-port=%d' %
+                        (FLAGS.metrics_port and FLAGS.metrics_port + i)]
+            self.procs.append(subprocess.Popen(argv + port))
+
+    def run(self):
+        """Run the workers, merging their statistics into ours.
+
+        Returns once all the workers are done.  Workers whose tests
+        failed, or which went away before reporting, are listed in
+        the failed attribute.  Raises DistributedError, after killing
+        the local workers, if a local worker exits or not all the
+        workers connect in time.
+        """
+
+        if self.remote:
+            print >>sys.stderr, ("Waiting for %d remote workers on %s:%d" %
+                                 ((self.remote,) + self.address))
+
+        # Wait for everyone to check in
+        conns = []
+        try:
+            self._checkin(conns)
+        except DistributedError:
+            for sock, f, addr in conns:
+                f.close()
+                sock.close()
+            for proc in self.procs:
+                if proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+            raise
+        finally:
+            self.server.close()
+
+        # Start them all off together
+        for i, (sock, f, addr) in enumerate(conns):
+            sock.sendall(json.dumps(dict(index=i,
+                                         workers=self.workers)) + '\n')
+
+        pool = eventlet.GreenPool(self.workers)
+        reports = list(pool.imap(self._gather, conns))
+
+        for proc in self.procs:
+            proc.wait()
+
+        # Sum the rates each worker sampled, sample by sample, and
+        # merge everything else
+        for name in ('creates_per_min', 'requests_per_min'):
+            samples = [report.pop(name, []) for report in reports]
+            for rates in itertools.izip_longest(*samples, fillvalue=0.0):
+                getattr(stress, name).append(sum(rates))
+
+        for report in reports:
+            for key, tracker in report.items():
+                if isinstance(key, tuple) and key[0] == 'failed':
+                    stress.failure_statistics(key[1]).merge(tracker)
+                elif isinstance(key, tuple) and key[0] == 'phase':
+                    stress.phase_statistics(*key[1:]).merge(tracker)
+                elif isinstance(key, tuple):
+                    stress.endpoint_statistics(*key).merge(tracker)
+                else:
+                    getattr(stress, key).merge(tracker)
+
+    def _checkin(self, conns):
+        """Accept the workers' connections into conns.
+
+        Local workers only exit once the run is over, so one which
+        exits now never will check in.
+        """
+
+        deadline = utils.monotonic() + self.timeout
+        while len(conns) < self.workers:
+            for i, proc in enumerate(self.procs):
+                if proc.poll() is not None:
+                    raise DistributedError("Local worker %d exited with "
+                                           "status %d before the run "
+                                           "started" % (i, proc.returncode))
+
+            remaining = deadline - utils.monotonic()
+            if remaining <= 0:
+                raise DistributedError("Only %d of %d workers connected "
+                                       "within %d seconds" %
+                                       (len(conns), self.workers,
+                                        self.timeout))
+
+            # Wake up now and then to check on the local workers
+            accepted = None
+            with eventlet.Timeout(min(remaining, 1.0), False):
+                accepted = self.server.accept()
+            if accepted is not None:
+                sock, addr = accepted
+                conns.append((sock, sock.makefile('r'), addr))
+
+    def _gather(self, conn):
+        """Gather the trackers reported by one worker."""
+
+        sock, f, addr = conn
+
+        report = {}
+        try:
+            for line in f:
+                msg = json.loads(line)
+                if 'done' in msg:
+                    if not msg['done']:
+                        self.failed.append('%s:%d: tests failed' % addr)
+                    return report
+
+                key = msg['key']
+                if isinstance(key, list):
+                    key = tuple(key)
+                tracker = stats.load(msg['stats'])
+                if key in ('creates_per_min', 'requests_per_min'):
+                    report[key] = list(tracker)
+                else:
+                    report[key] = tracker
+        finally:
+            f.close()
+            sock.close()
+
+        self.failed.append('%s:%d: went away' % addr)
+        return report
+
+
+class Worker(object):
+    """Run a share of the stress tests for a coordinator."""
+
+    def __init__(self, coordinator):
+        """Initialize a Worker.
+
+        The coordinator argument is a string of the form "HOST:PORT".
+        Raises DistributedError if it cannot be parsed.
+        """
+
+        host, sep, port = coordinator.rpartition(':')
+        if not sep or not port.isdigit():
+            raise DistributedError("Invalid coordinator %r" % coordinator)
+
+        self.address = (host or '127.0.0.1', int(port))
+        self.sock = None
+        self.index = None
+        self.workers = None
+
+    def join(self):
+        """Check in with the coordinator and take our share of the load.
+
+        Blocks until all the workers have checked in, then divides the
+        --requests-per-minute, --creates-per-minute, and
+        --max-in-flight options by the number of workers.
+        """
+
+        try:
+            self.sock = socket.create_connection(self.address)
+            msg = json.loads(self.sock.makefile('r').readline())
+        except (socket.error, ValueError), e:
+            raise DistributedError("Cannot join coordinator %s:%d: %s" %
+                                   (self.address + (e,)))
+
+        self.index = msg['index']
+        self.workers = msg['workers']
+
+        FLAGS.req_per_min = share(FLAGS.req_per_min, self.index,
+                                  self.workers)
+        FLAGS.creates_per_min = share(FLAGS.creates_per_min, self.index,
+                                      self.workers)
+        if FLAGS.max_in_flight:
+            FLAGS.max_in_flight = max(share(FLAGS.max_in_flight, self.index,
+                                            self.workers), 1)
+        if FLAGS.image_uploads:
+            FLAGS.image_uploads = max(share(FLAGS.image_uploads, self.index,
+                                            self.workers), 1)
+            FLAGS.image_concurrency = max(share(FLAGS.image_concurrency,
+                                                self.index, self.workers), 1)
+
+        if FLAGS.req_per_min < 1 or FLAGS.creates_per_min < 1:
+            raise DistributedError("Rates are too low to split among %d "
+                                   "workers" % self.workers)
+
+    def report(self, result):
+        """Send our statistics and test outcome to the coordinator."""
+
+        for key, tracker in sorted(trackers().items()):
+            self.sock.sendall(json.dumps(dict(key=key,
+                                              stats=tracker.dump())) + '\n')
+        self.sock.sendall(json.dumps(dict(done=bool(result))) + '\n')
+        self.sock.close()
@@ -0,0 +1,309 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import sys
+
+import dtest
+import eventlet
+from eventlet import event
+from eventlet import semaphore
+
+import stress
+import utils
+
+
+class LoadGenerator(object):
+    """Open-loop load generator.
+
+    Issues calls at a fixed arrival rate, independent of how long the
+    earlier calls take to complete; each call runs in its own green
+    thread.  The number of calls in flight is bounded; when the bound
+    is reached, further calls are delayed until a slot frees up, but
+    the time each call was scheduled to be sent is passed on to
+    stress.wrap_request() (and stress.mk_instance()) through the
+    request context, so that recorded latencies include the delay.
+    """
+
+    def __init__(self, rate, max_in_flight=None):
+        """Initialize a LoadGenerator.
+
+        The rate argument is the desired number of calls per minute.
+        The max_in_flight argument bounds the number of calls that may
+        be outstanding at once; if None, the bound is the same as the
+        number of calls per minute.
+        """
+
+        self.interval = 60.0 / rate
+        self.pool = eventlet.GreenPool(max_in_flight or rate)
+        self.stopped = False
+
+        # When the first and last calls of the last run() were sent
+        self.first = None
+        self.last = None
+
+    def stop(self):
+        """Stop issuing calls.
+
+        A run() in progress issues no further calls, and returns once
+        the calls already issued have completed.
+        """
+
+        self.stopped = True
+
+    def elapsed(self):
+        """Return the time taken to issue the calls of the last run().
+
+        This is the time from sending the first call to sending the
+        last, plus the interval the last call was due to occupy, so
+        that calls sent on schedule take exactly their count times the
+        interval.  Calls held back by the bound on calls in flight
+        stretch it out; the time the last calls take to complete does
+        not.  Returns 0 if no calls were sent.
+        """
+
+        if self.first is None:
+            return 0.0
+
+        return self.last - self.first + self.interval
+
+    def run(self, count, call, *args, **kwargs):
+        """Issue count calls at the target rate.
+
+        The argument 'call' is a callable that is passed the extra
+        positional and keyword arguments.  Returns once all the calls
+        have completed.  Exceptions raised by the calls are not
+        caught, so the callable should handle them itself.
+        """
+
+        # Propagate the status stream to our threads
+        output = dtest.status.output
+        test = dtest.status.test
+
+        def request(intended):
+            dtest.status.setup(output, test)
+            stress.context.intended = intended
+            stress.context.interval = self.interval
+            call(*args, **kwargs)
+
+        # Schedule the calls relative to a fixed start time, so a late
+        # call does not push back the ones after it
+        start = utils.monotonic()
+        self.first = self.last = None
+        for i in xrange(count):
+            if self.stopped:
+                break
+
+            intended = start + i * self.interval
+            delay = intended - utils.monotonic()
+            if delay > 0:
+                eventlet.sleep(delay)
+                if self.stopped:
+                    break
+
+            # Blocks while max_in_flight calls are outstanding
+            self.pool.spawn_n(request, intended)
+            self.last = utils.monotonic()
+            if self.first is None:
+                self.first = self.last
+
+        # Wait for the stragglers
+        self.pool.waitall()
+
+
+class TokenBucket(object):
+    """Token bucket rate limiter.
+
+    Tokens accrue at a fixed rate, up to the capacity of the bucket;
+    each take() consumes one, sleeping until one is available.  With
+    the default capacity of one token, calls are spaced evenly; a
+    larger capacity lets a caller that fell behind catch up in a
+    burst.
+    """
+
+    def __init__(self, rate, capacity=1):
+        """Initialize a TokenBucket.
+
+        The rate argument is the number of tokens per minute.  The
+        bucket starts full.
+        """
+
+        self.interval = 60.0 / rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = utils.monotonic()
+
+    def take(self):
+        """Take a token, sleeping until one is available.
+
+        Returns the time the token became available, which is when a
+        call waiting for it was due.
+        """
+
+        due = None
+        while True:
+            now = utils.monotonic()
+            self.tokens = min(self.capacity, self.tokens +
+                              (now - self.updated) / self.interval)
+            self.updated = now
+
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return min(due or now, now)
+
+            # Sleep until the next token is due
+            due = now + (1.0 - self.tokens) * self.interval
+            eventlet.sleep(due - now)
+
+
+class CreatePipeline(object):
+    """Rate-controlled instance creation.
+
+    Separates submitting creates from waiting for them to complete:
+    creates are submitted at the target rate, as limited by a
+    TokenBucket, and each new instance is handed to the shared
+    StatusPoller for the servers, which reports when it becomes
+    active.  No thread waits on an outstanding build, so the number
+    of instances building at once costs nothing on the client side.
+    The times are recorded as by stress.mk_instance(), measured from
+    when each create was due.
+    """
+
+    def __init__(self, rate, max_in_flight=None):
+        """Initialize a CreatePipeline.
+
+        The rate argument is the desired number of creates per
+        minute.  The max_in_flight argument bounds the number of
+        instances building at once; if None, the bound is the same as
+        the number of creates per minute.  Further creates wait for a
+        build to finish, but are still timed from when they were due.
+        """
+
+        self.bucket = TokenBucket(rate)
+        self.slots = semaphore.Semaphore(max_in_flight or rate)
+
+        # The created instances, and the number of failed creates
+        self.instances = []
+        self.errors = 0
+
+        # When the API accepted the first and last creates
+        self.first = None
+        self.last = None
+
+        self._outstanding = 0
+        self._submitting = False
+        self._done = None
+        self._poller = utils.get_poller('servers')
+
+    def elapsed(self):
+        """Return the time the API took to accept the creates.
+
+        This is the time from the first create being accepted to the
+        last, plus the interval the last create was due to occupy, so
+        that creates accepted on schedule take exactly their count
+        times the interval.  The time the builds take to complete is
+        not included.  Returns 0 if no create was accepted.
+        """
+
+        if self.first is None:
+            return 0.0
+
+        return self.last - self.first + self.bucket.interval
+
+    def run(self, count, *args, **kwargs):
+        """Create count instances at the target rate.
+
+        The extra positional and keyword arguments are passed on to
+        stress.submit_instance().  Returns once all the creates have
+        completed or failed.  The instances which became active are
+        in the instances attribute, and the number which did not in
+        the errors attribute.
+        """
+
+        # Propagate the status stream to our threads
+        output = dtest.status.output
+        test = dtest.status.test
+
+        def submit(intended):
+            dtest.status.setup(output, test)
+            stress.context.intended = intended
+            stress.context.interval = self.bucket.interval
+            self._submit(args, kwargs)
+
+        self._submitting = True
+        self._done = event.Event()
+        try:
+            for i in xrange(count):
+                intended = self.bucket.take()
+
+                # Blocks while max_in_flight builds are outstanding
+                self.slots.acquire()
+                self._outstanding += 1
+                eventlet.spawn_n(submit, intended)
+        finally:
+            self._submitting = False
+
+        # Wait for the stragglers
+        if self._outstanding:
+            self._done.wait()
+
+    def _submit(self, args, kwargs):
+        """Submit one create and hand it to the poller."""
+
+        try:
+            os = stress.OpenStackWrapped.getOpenStack()
+            try:
+                server, states, start, accepted = stress.submit_instance(
+                    os, *args, **kwargs)
+            finally:
+                os.release()
+        except Exception, e:
+            print >>sys.stderr, "Exception %s" % e
+            self._finish(None)
+            return
+
+        if self.first is None or accepted < self.first:
+            self.first = accepted
+        if self.last is None or accepted > self.last:
+            self.last = accepted
+
+        def complete(watch):
+            if watch.exc_info is not None:
+                print >>sys.stderr, "Exception %s" % watch.exc_info[1]
+                stress.finish_instance(False)
+                self._finish(None)
+            elif watch.result is not True:
+                print >>sys.stderr, ("Server %s entered state %r" %
+                                     (server.id, watch.result))
+                stress.finish_instance(False)
+                self._finish(None)
+            else:
+                stress.record_instance(states, start, accepted,
+                                       states.observed('active')[0])
+                self._finish(server)
+
+        self._poller.watch(states, server.id, complete)
+
+    def _finish(self, server):
+        """Account for a completed or failed create."""
+
+        if server is None:
+            self.errors += 1
+        else:
+            self.instances.append(server)
+
+        self.slots.release()
+        self._outstanding -= 1
+        if not self._outstanding and not self._submitting:
+            self._done.send()
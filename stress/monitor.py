@@ -0,0 +1,304 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import os
+import sys
+
+import eventlet
+from eventlet import wsgi
+
+import stress
+import utils
+
+
+# Upper bounds, in milliseconds, of the latency histogram buckets
+buckets = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000,
+           60000, 300000)
+
+# The quantiles reported for each latency tracker
+quantiles = (.5, .9, .99)
+
+
+def _escape(value):
+    """Escape a Prometheus label value."""
+
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _labels(labels):
+    """Format a dictionary of Prometheus labels."""
+
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                             for name, value in sorted(labels.items()))
+
+
+def _progress():
+    """Retrieve the current values of the progress counters."""
+
+    return dict((name, counter.value)
+                for name, counter in stress.progress.items())
+
+
+class Monitor(object):
+    """Live view of the progress of the stress tests.
+
+    Samples the stress.progress counters once a second, to compute
+    the current request and create rates over a sliding window, and
+    serves them along with the latency trackers of the stress package
+    in the Prometheus text format; it can also print a compact status
+    line at regular intervals.  Everything is read from the counters
+    and trackers the stress tests update anyway, in the monitor's own
+    threads, so the requests being measured take no extra locks.
+    """
+
+    def __init__(self, window=60, name=None):
+        """Initialize a Monitor.
+
+        The window is the number of seconds over which current rates
+        are computed.  If a name is given, such as that of a stress
+        worker, it prefixes the status line, and the line is never
+        overwritten in place, since other processes may be printing
+        theirs to the same terminal.
+        """
+
+        self.window = window
+        self.name = name
+        self.started = utils.monotonic()
+        self._snapshots = collections.deque(maxlen=window + 1)
+        self._running = False
+        self._tty = False
+
+    def start(self, port=None, dashboard=None):
+        """Start monitoring.
+
+        If port is given, serves the metrics over HTTP on that port of
+        the loopback address (0 picks a free port, which is returned).
+        If dashboard is given, prints a status line to standard error
+        every dashboard seconds.
+        """
+
+        self._running = True
+        eventlet.spawn_n(self._sample)
+
+        if dashboard:
+            eventlet.spawn_n(self._dashboard, dashboard)
+
+        if port is not None:
+            sock = eventlet.listen(('127.0.0.1', port))
+            port = sock.getsockname()[1]
+            eventlet.spawn_n(wsgi.server, sock, self,
+                             log=open(os.devnull, 'w'))
+
+        return port
+
+    def stop(self):
+        """Stop sampling and printing the status line."""
+
+        self._running = False
+
+        # Leave the status line be
+        if self._tty:
+            sys.stderr.write('\n')
+
+    def _sample(self):
+        """Take a snapshot of the counters every second."""
+
+        while self._running:
+            self._snapshots.append((utils.monotonic(), _progress()))
+            eventlet.sleep(1)
+
+    def rate(self, *keys):
+        """Retrieve the current per-minute rate of the summed counters."""
+
+        if len(self._snapshots) < 2:
+            return 0.0
+
+        (first, old), (last, new) = self._snapshots[0], self._snapshots[-1]
+        if last <= first:
+            return 0.0
+
+        return (sum(new[key] - old[key] for key in keys) * 60.0 /
+                (last - first))
+
+    def status(self):
+        """Format the compact status line."""
+
+        progress = _progress()
+        return ((self.name and '%s: ' % self.name or '') +
+                "%5ds  req %d/min, %d in flight, %d failed, "
+                "p50 %.0fms p99 %.0fms | create %d/min, %d building, "
+                "%d failed, p50 %.1fs" %
+                (utils.monotonic() - self.started,
+                 self.rate('requests_completed', 'requests_failed'),
+                 progress['requests_in_flight'], progress['requests_failed'],
+                 stress.request_time.percentile(.5),
+                 stress.request_time.percentile(.99),
+                 self.rate('creates_completed', 'creates_failed'),
+                 progress['builds_outstanding'], progress['creates_failed'],
+                 stress.create_time.percentile(.5) / 1000.0))
+
+    def _dashboard(self, ival):
+        """Print the status line every ival seconds."""
+
+        # Overwrite the line in place on a terminal, unless it is
+        # shared
+        self._tty = sys.stderr.isatty() and not self.name
+        while self._running:
+            eventlet.sleep(ival)
+            if not self._running:
+                break
+            elif self._tty:
+                sys.stderr.write('\r%s\033[K' % self.status())
+            else:
+                sys.stderr.write('%s\n' % self.status())
+            sys.stderr.flush()
+
+    def metrics(self):
+        """Format the metrics in the Prometheus text format."""
+
+        lines = []
+
+        def metric(name, kind, doc, samples):
+            lines.append('# HELP backfire_%s %s' % (name, doc))
+            lines.append('# TYPE backfire_%s %s' % (name, kind))
+            for suffix, labels, value in samples:
+                lines.append('backfire_%s%s%s %s' % (name, suffix,
+                                                      _labels(labels),
+                                                      repr(float(value))))
+
+        def latency(name, doc, trackers):
+            samples = []
+            for labels, tracker in trackers:
+                count = len(tracker)
+                for bound in buckets:
+                    samples.append(('_bucket', dict(labels, le=bound),
+                                    tracker.rank(bound)))
+                samples.append(('_bucket', dict(labels, le='+Inf'), count))
+                samples.append(('_sum', labels, tracker.average * count))
+                samples.append(('_count', labels, count))
+            metric(name, 'histogram', doc, samples)
+
+            samples = [('', dict(labels, quantile=pct),
+                        tracker.percentile(pct))
+                       for labels, tracker in trackers for pct in quantiles]
+            metric(name + '_quantile', 'gauge',
+                   doc + ' (quantiles)', samples)
+
+        progress = _progress()
+        metric('requests_in_flight', 'gauge',
+               'Requests awaiting a response.',
+               [('', {}, progress['requests_in_flight'])])
+        metric('requests_total', 'counter', 'Requests completed.',
+               [('', dict(outcome='success'),
+                 progress['requests_completed']),
+                ('', dict(outcome='error'), progress['requests_failed'])])
+        metric('requests_per_minute', 'gauge',
+               'Requests completed per minute over the last %d seconds.' %
+               self.window,
+               [('', {}, self.rate('requests_completed',
+                                   'requests_failed'))])
+        metric('builds_outstanding', 'gauge',
+               'Instances created but not yet active.',
+               [('', {}, progress['builds_outstanding'])])
+        metric('creates_total', 'counter', 'Instance creates completed.',
+               [('', dict(outcome='success'), progress['creates_completed']),
+                ('', dict(outcome='error'), progress['creates_failed'])])
+        metric('creates_per_minute', 'gauge',
+               'Instance creates completed per minute over the last %d '
+               'seconds.' % self.window,
+               [('', {}, self.rate('creates_completed', 'creates_failed'))])
+
+        latency('request_time_milliseconds', 'Time per request.',
+                [({}, stress.request_time)])
+        latency('endpoint_time_milliseconds',
+                'Time per request by endpoint and status.',
+                [(dict(endpoint='%s.%s' % (manager, method), status=status),
+                  tracker) for (manager, method, status), tracker
+                 in sorted(stress.endpoint_time.items())])
+        latency('phase_time_milliseconds',
+                'Time per successful request by endpoint and HTTP phase.',
+                [(dict(endpoint='%s.%s' % (manager, method), phase=phase),
+                  tracker) for (manager, method, phase), tracker
+                 in sorted(stress.phase_time.items())])
+        latency('request_failure_time_milliseconds',
+                'Time per failed request by status.',
+                [(dict(status=status), tracker) for status, tracker
+                 in sorted(stress.request_failure_time.items())])
+        latency('create_time_milliseconds', 'Time per instance creation.',
+                [({}, stress.create_time)])
+        latency('image_time_milliseconds',
+                'Time per image upload, until the image is available, '
+                'and per image delete.',
+                [(dict(phase='upload'), stress.image_upload_time),
+                 (dict(phase='available'), stress.image_available_time),
+                 (dict(phase='delete'), stress.image_delete_time)])
+
+        return '\n'.join(lines) + '\n'
+
+    def __call__(self, environ, start_response):
+        """Serve the metrics."""
+
+        if environ.get('PATH_INFO', '/') not in ('/', '/metrics'):
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return ['Not found\n']
+
+        body = self.metrics()
+        start_response('200 OK',
+                       [('Content-Type', 'text/plain; version=0.0.4'),
+                        ('Content-Length', str(len(body)))])
+        return [body]
+
+
+# The monitor, if --metrics-port or --dashboard was given
+monitor = None
+
+
+def start_monitor(flags, name=None):
+    """Start the monitor if --metrics-port or --dashboard was given.
+
+    The name, if any, prefixes the status line; see Monitor.
+    """
+
+    global monitor
+
+    if flags.metrics_port is None and not flags.dashboard:
+        return None
+
+    monitor = Monitor(name=name)
+    port = monitor.start(flags.metrics_port,
+                         flags.dashboard_interval if flags.dashboard
+                         else None)
+    if port is not None:
+        print >>sys.stderr, ("%sServing stress metrics at "
+                             "http://127.0.0.1:%d/metrics" %
+                             (name and '%s: ' % name or '', port))
+
+    return monitor
+
+
+def stop_monitor():
+    """Stop the monitor, if one is running."""
+
+    global monitor
+
+    if monitor is None:
+        return
+
+    monitor.stop()
+    monitor = None
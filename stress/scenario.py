@@ -0,0 +1,375 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import random
+import sys
+
+import dtest
+import eventlet
+
+import base
+import cleanup
+import stress
+import utils
+
+
+class ScenarioError(Exception):
+    """Raised when a workload file is invalid."""
+
+    pass
+
+
+class Skipped(Exception):
+    """Raised by an operation which the lifecycle rules rule out."""
+
+    pass
+
+
+class Scenario(object):
+    """Weighted mix of operations driven by simulated users.
+
+    A scenario is described by a JSON workload file, containing an
+    object with the following keys:
+
+    - operations
+        An object mapping operation names to objects giving the
+        relative "weight" of the operation, and any parameters it
+        takes.  The operations are list_servers, get_server,
+        create_server, delete_server, reboot_server (parameter "type",
+        "SOFT" or "HARD"), resize_server (parameters "flavor" and
+        "confirm", which reverts the resize if false), snapshot_server,
+        list_images, and list_flavors.
+
+    - users
+        The number of simulated users [default 1].  Each user
+        repeatedly picks an operation at random, by weight, performs
+        it, then waits for a think time.
+
+    - think_time
+        A utils.Distribution specification of the think time, in
+        seconds [default "1"].
+
+    - duration
+        How long to run, in minutes [default 1].
+
+    - seed
+        Seeds the choices of operations, servers, and names, which
+        are reproducible for a given seed [default 0].
+
+    - lifecycle
+        An object limiting the resources the scenario manages:
+        "min_servers" [default 1] are created before the users start,
+        and deletes are skipped when no more than that many remain;
+        creates are skipped when "max_servers" [default 10] exist; and
+        the oldest snapshot is deleted when there are more than
+        "max_images" [default 2].
+
+    Operations on an existing server only pick servers which no other
+    user is modifying; when there are none, or the lifecycle rules
+    rule an operation out, it is counted as skipped.  Everything the
+    scenario created is deleted once the users are done.
+    """
+
+    # Valid operations, and whether they modify the server they act on
+    operations = {
+        'list_servers': False,
+        'get_server': False,
+        'create_server': False,
+        'delete_server': True,
+        'reboot_server': True,
+        'resize_server': True,
+        'snapshot_server': True,
+        'list_images': False,
+        'list_flavors': False,
+        }
+
+    def __init__(self, spec):
+        """Initialize a Scenario from its parsed workload file.
+
+        Raises ScenarioError if the workload is invalid.
+        """
+
+        try:
+            self.ops = {}
+            for name, params in spec['operations'].items():
+                if name not in self.operations:
+                    raise ScenarioError("Unknown operation %r" % name)
+                params = dict(params)
+                weight = float(params.pop('weight', 1))
+                if weight > 0:
+                    self.ops[name] = (weight, params)
+            if not self.ops:
+                raise ScenarioError("No operations to perform")
+
+            self.users = int(spec.get('users', 1))
+            self.think_time = utils.Distribution(
+                str(spec.get('think_time', '1')))
+            self.duration = float(spec.get('duration', 1))
+            self.seed = spec.get('seed', 0)
+
+            lifecycle = spec.get('lifecycle', {})
+            self.min_servers = int(lifecycle.get('min_servers', 1))
+            self.max_servers = int(lifecycle.get('max_servers', 10))
+            self.max_images = int(lifecycle.get('max_images', 2))
+        except (KeyError, TypeError, ValueError), e:
+            raise ScenarioError("Invalid workload: %s" % e)
+
+        # Per-operation results
+        self.times = dict((name, stress.mk_statistics('scenario:%s' % name))
+                          for name in self.ops)
+        self.errors = dict((name, 0) for name in self.ops)
+        self.skips = dict((name, 0) for name in self.ops)
+
+        # The servers and images the scenario manages; servers are
+        # mapped to the number of users using them, or -1 if one user
+        # is modifying them; the count includes the servers being
+        # created and excludes those being deleted, so that concurrent
+        # users keep within the lifecycle bounds
+        self._servers = {}
+        self._count = 0
+        self._images = []
+
+    @classmethod
+    def load(cls, path):
+        """Load a Scenario from a workload file."""
+
+        try:
+            with open(path) as f:
+                spec = json.load(f)
+        except (IOError, ValueError), e:
+            raise ScenarioError("Cannot load %s: %s" % (path, e))
+
+        return cls(spec)
+
+    def run(self, seed=None, duration=None):
+        """Run the scenario.
+
+        The seed and duration default to those of the workload.
+        Returns once all the users are done and the resources the
+        scenario created are deleted.
+        """
+
+        if seed is None:
+            seed = self.seed
+        if duration is None:
+            duration = self.duration
+
+        # Each user gets its own generator, so that its choices do not
+        # depend on how the users interleave
+        master = random.Random(seed)
+        rngs = [random.Random(master.random()) for i in range(self.users)]
+
+        # Propagate the status stream to the users
+        output = dtest.status.output
+        test = dtest.status.test
+
+        try:
+            for i in range(self.min_servers):
+                self._create_server(master, {})
+
+            deadline = utils.monotonic() + duration * 60
+            pool = eventlet.GreenPool(self.users)
+            for rng in rngs:
+                pool.spawn_n(self._user, rng, deadline, output, test)
+            pool.waitall()
+        finally:
+            cleanup.janitor.reap('images', self._images)
+            cleanup.janitor.reap('servers', self._servers.keys())
+            self._images = []
+            self._servers = {}
+            self._count = 0
+
+    def _user(self, rng, deadline, output, test):
+        """Perform operations until the deadline."""
+
+        dtest.status.setup(output, test)
+
+        names = sorted(self.ops)
+        weights = [self.ops[name][0] for name in names]
+        total = sum(weights)
+
+        while utils.monotonic() < deadline:
+            # Pick an operation by weight
+            pick = rng.uniform(0, total)
+            for name, weight in zip(names, weights):
+                pick -= weight
+                if pick <= 0:
+                    break
+
+            self._perform(name, rng)
+
+            eventlet.sleep(self.think_time.sample())
+
+    def _perform(self, name, rng):
+        """Perform an operation, recording the outcome."""
+
+        params = self.ops[name][1]
+        modifies = self.operations[name]
+
+        start = utils.monotonic()
+        try:
+            if name in ('create_server', 'list_servers', 'list_images',
+                        'list_flavors'):
+                getattr(self, '_' + name)(rng, params)
+            else:
+                server_id = self._acquire(rng, modifies)
+                try:
+                    getattr(self, '_' + name)(rng, params, server_id)
+                finally:
+                    self._release(server_id, modifies)
+        except Skipped:
+            self.skips[name] += 1
+        except Exception, e:
+            print >>sys.stderr, "Exception in %s: %s" % (name, e)
+            self.errors[name] += 1
+        else:
+            self.times[name].append(
+                (utils.monotonic() - start) * 1000.0)
+
+    def _acquire(self, rng, exclusive):
+        """Pick a server to act on."""
+
+        if exclusive:
+            candidates = [s for s, users in self._servers.items()
+                          if users == 0]
+        else:
+            candidates = [s for s, users in self._servers.items()
+                          if users >= 0]
+        if not candidates:
+            raise Skipped()
+
+        server_id = rng.choice(sorted(candidates))
+        self._servers[server_id] = -1 if exclusive else (
+            self._servers[server_id] + 1)
+
+        return server_id
+
+    def _release(self, server_id, exclusive):
+        """Done acting on a server."""
+
+        if server_id not in self._servers:
+            return
+
+        if exclusive:
+            self._servers[server_id] = 0
+        else:
+            self._servers[server_id] -= 1
+
+    def _call(self, func, *args, **kwargs):
+        """Call func with a wrapped OpenStack instance as first argument."""
+
+        os = stress.OpenStackWrapped.getOpenStack()
+        try:
+            return func(os, *args, **kwargs)
+        finally:
+            os.release()
+
+    def _wait(self, collection, obj_id, *states):
+        """Wait for a server or image to go through states."""
+
+        tracker = utils.StatusTracker(*states)
+        result = tracker.waitForPolledState(collection, obj_id)
+        if result is not True:
+            raise AssertionError("%s %s entered state %r" %
+                                 (collection, obj_id, result))
+
+    def _list_servers(self, rng, params):
+        self._call(lambda os: os.servers.list())
+
+    def _list_images(self, rng, params):
+        self._call(lambda os: os.images.list())
+
+    def _list_flavors(self, rng, params):
+        self._call(lambda os: os.flavors.list())
+
+    def _get_server(self, rng, params, server_id):
+        self._call(lambda os: os.servers.get(server_id))
+
+    def _create_server(self, rng, params):
+        # Reserve the slot before the call, which lets other users run
+        if self._count >= self.max_servers:
+            raise Skipped()
+        self._count += 1
+
+        try:
+            name = base.BaseIntegrationTest.randName(rng=rng)
+            server = self._call(stress.mk_instance, name=name)
+        except Exception:
+            self._count -= 1
+            raise
+        self._servers[server.id] = 0
+
+    def _delete_server(self, rng, params, server_id):
+        if self._count <= self.min_servers:
+            raise Skipped()
+        self._count -= 1
+
+        try:
+            self._call(lambda os: os.servers.delete(server_id))
+        except Exception:
+            self._count += 1
+            raise
+        del self._servers[server_id]
+        cleanup.janitor.forget('servers', server_id)
+
+    def _reboot_server(self, rng, params, server_id):
+        reboot_type = params.get('type', 'SOFT').upper()
+        self._call(lambda os: os.servers.reboot(server_id, type=reboot_type))
+        self._wait('servers', server_id, 'active',
+                   'hard_reboot' if reboot_type == 'HARD' else 'reboot',
+                   'active')
+
+    def _resize_server(self, rng, params, server_id):
+        # Resize to the given flavor, or back from it
+        flavor = params.get('flavor', 2)
+        current = self._call(lambda os: os.servers.get(server_id).flavorId)
+        if current == flavor:
+            flavor = base.FLAGS.flavor
+
+        self._call(lambda os: os.servers.resize(server_id, flavor))
+        self._wait('servers', server_id, 'active', 'resize-confirm')
+        if params.get('confirm', True):
+            self._call(lambda os: os.servers.confirm_resize(server_id))
+        else:
+            self._call(lambda os: os.servers.revert_resize(server_id))
+
+    def _snapshot_server(self, rng, params, server_id):
+        name = base.BaseIntegrationTest.randName(prefix='snap', rng=rng)
+        image = cleanup.janitor.track('images', self._call(
+                lambda os: os.images.create(server_id, name)))
+        self._images.append(image.id)
+        self._wait('images', image.id, 'active', 'queued', 'preparing',
+                   'saving', 'active')
+
+        # Don't keep too many snapshots around
+        while len(self._images) > self.max_images:
+            old = self._images.pop(0)
+            self._call(lambda os: os.images.delete(old))
+            cleanup.janitor.forget('images', old)
+
+
+# The scenario given by --scenario, if any
+workload = None
+
+
+def load_workload(path):
+    """Load the scenario for the scenario test to run."""
+
+    global workload
+
+    workload = Scenario.load(path)
+
+    return workload
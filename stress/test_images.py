@@ -0,0 +1,192 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import itertools
+import os
+import sys
+import tempfile
+
+import dtest
+from dtest import util as dtutil
+import eventlet
+
+import base
+import cleanup
+import stress
+import utils
+
+FLAGS = base.FLAGS
+
+# Bytes in a megabyte
+MB = 1024 * 1024
+
+
+def make_image(size, data):
+    """Generate an image file of size megabytes.
+
+    With data "sparse", the file is a hole, which costs nothing to
+    create and reads as zeros; with "random", it is filled with random
+    data, which can be neither compressed nor deduplicated along the
+    way.  Returns a tuple of the size of the file in bytes and its
+    name; the caller must remove the file.
+    """
+
+    nbytes = int(size * MB)
+    fd, file_name = tempfile.mkstemp(prefix='backfire-', suffix='.img')
+    with os.fdopen(fd, 'wb') as f:
+        if data == 'sparse':
+            f.truncate(nbytes)
+        else:
+            for offset in xrange(0, nbytes, MB):
+                f.write(os.urandom(min(MB, nbytes - offset)))
+
+    return nbytes, file_name
+
+
+class ImageUploadTest(dtest.DTestCase):
+    """Test Glance image upload throughput."""
+
+    # The generated image files, as returned by make_image()
+    images = []
+
+    @classmethod
+    @dtest.attr(stress=True, images=True)
+    def setUpClass(cls):
+        """Set up the image upload test.
+
+        Generates an image file of each of the --image-sizes.
+        """
+
+        cls.images = [make_image(size, FLAGS.image_data)
+                      for size in FLAGS.image_sizes]
+
+    @classmethod
+    @dtest.attr(stress=True, images=True)
+    def tearDownClass(cls):
+        """Tear down the image upload test.
+
+        Removes the generated image files.
+        """
+
+        for nbytes, file_name in cls.images:
+            os.unlink(file_name)
+
+    def _upload(self, nbytes, file_name):
+        """Upload an image, wait for it, and delete it.
+
+        The time taken by the upload and its throughput are stored in
+        the image_upload_time and image_upload_rate statistics
+        trackers; the time from the start of the upload until Nova
+        lists the image as active, in image_available_time; and the
+        time taken by the delete, in image_delete_time.
+        """
+
+        c = base.BaseIntegrationTest.get_glance_connection()
+        meta = {
+            'name': base.BaseIntegrationTest.randName(prefix='stress_image'),
+            'type': 'machine',
+            'is_public': True
+            }
+
+        # Upload the image, always afresh; the cache would defeat the
+        # purpose
+        start = utils.monotonic()
+        image = cleanup.janitor.track('glance',
+                                      base.image_cache.upload(c, file_name,
+                                                              meta))
+        uploaded = utils.monotonic()
+
+        # Wait for Nova to see it, as it must before booting from it
+        states = utils.StatusTracker('queued', 'saving', 'active')
+        dtutil.assert_is(True,
+                         states.waitForPolledState('images', image['id']))
+        available = states.observed('active')[0]
+
+        # Now get rid of it
+        deleting = utils.monotonic()
+        c.delete_image(image['id'])
+        deleted = utils.monotonic()
+        cleanup.janitor.forget('glance', image)
+
+        stress.image_upload_time.append((uploaded - start) * 1000.0)
+        stress.image_upload_rate.append(float(nbytes) / MB /
+                                        max(uploaded - start, 1e-6))
+        stress.image_available_time.append((available - start) * 1000.0)
+        stress.image_delete_time.append((deleted - deleting) * 1000.0)
+
+    # Now, our tests; we have several identical tests, so start with a
+    # helper
+    def _do_sample(self):
+        """Upload image_uploads images, image_concurrency at a time.
+
+        The images take turns by size.  Every upload is seen through,
+        even if others fail; the first failure then fails the test.
+        """
+
+        errors = []
+
+        # Propagate the status stream to our threads
+        output = dtest.status.output
+        test = dtest.status.test
+
+        def upload(image):
+            dtest.status.setup(output, test)
+            try:
+                self._upload(*image)
+            except Exception:
+                errors.append(sys.exc_info())
+
+        uploads = list(itertools.islice(itertools.cycle(self.images),
+                                        FLAGS.image_uploads))
+
+        start = utils.monotonic()
+        pool = eventlet.GreenPool(FLAGS.image_concurrency)
+        for image in uploads:
+            pool.spawn_n(upload, image)
+        pool.waitall()
+        end = utils.monotonic()
+
+        print >>dtest.status, ('Uploaded %.2f MB/s across %d images, '
+                               '%d failed.' %
+                               (sum(nbytes for nbytes, file_name in uploads)
+                                / float(MB) / (end - start),
+                                len(uploads), len(errors)))
+
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+
+    # Now, let's have a few samples
+    @dtest.timed(FLAGS.timeout * 60)
+    @dtest.attr(stress=True, images=True)
+    def test_sample01(self):
+        """Sample the throughput of image_uploads image uploads."""
+
+        self._do_sample()
+
+    @dtest.depends(test_sample01)
+    @dtest.timed(FLAGS.timeout * 60)
+    @dtest.attr(stress=True, images=True)
+    def test_sample02(self):
+        """Sample the throughput of image_uploads image uploads."""
+
+        self._do_sample()
+
+    @dtest.depends(test_sample02)
+    @dtest.timed(FLAGS.timeout * 60)
+    @dtest.attr(stress=True, images=True)
+    def test_sample03(self):
+        """Sample the throughput of image_uploads image uploads."""
+
+        self._do_sample()
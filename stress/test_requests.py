@@ -16,10 +16,12 @@
 import dtest
 from dtest import util as dtutil
 import sys
-import time
 
 import base
+import cleanup
+import stats
 import stress
+from stress import loadgen
 from stress import test_creates
 
 FLAGS = base.FLAGS
@@ -50,16 +52,16 @@ class RequestTest(dtest.DTestCase):
         Cleans up the instance we allocated in setUpClass().
         """
 
-        cls.server.delete()
+        cleanup.janitor.reap('servers', [cls.server])
 
     def setUp(self):
         """Set up a test run.
 
-        Saves the start time.
+        Resets the request count and the time taken to issue them.
         """
 
-        self.total = 0
-        self.start = time.time()
+        self.total = stats.Counter()
+        self.elapsed = 0.0
 
     def tearDown(self):
         """Clean up after a test run.
@@ -68,16 +70,13 @@ class RequestTest(dtest.DTestCase):
         the requests_per_min statistics tracker.
         """
 
-        # Get the end time
-        end = time.time()
+        # The rate is measured over the time taken to issue the
+        # requests, as the load generator paces them; waiting for the
+        # last ones to complete would put it below the target however
+        # fast the server is
+        ival = self.elapsed / 60.0
 
-        # We do a number of requests during the time interval, so
-        # compute the number of minutes and store the number per
-        # minute that were done in our requests_per_min statistics
-        # tracker
-        ival = (end - self.start) / 60.0
-
-        sample = self.total / ival
+        sample = self.total.value / ival if ival else 0.0
 
         print >>dtest.status, 'Sampled %.2f requests per minute.' % sample
 
@@ -92,98 +91,89 @@ class RequestTest(dtest.DTestCase):
         try:
             # Get the status
             os = stress.OpenStackWrapped.getOpenStack()
-            os.servers.get(self.server)
-            self.total += 1
+            try:
+                os.servers.get(self.server)
+            finally:
+                os.release()
+            self.total.add()
         except Exception, e:
             # Print out the exception but otherwise ignore it
             print >>sys.stderr, "Exception %s" % e
 
+    def _do_sample(self):
+        """Issue req_per_min requests at the target rate."""
+
+        gen = loadgen.LoadGenerator(FLAGS.req_per_min,
+                                    FLAGS.max_in_flight)
+        gen.run(FLAGS.req_per_min, self._do_test)
+        self.elapsed += gen.elapsed()
+
     # Now, let's have a few samples
-    @dtest.parallel
-    @dtest.repeat(FLAGS.req_per_min)
     @dtest.attr(stress=True)
     def test_sample01(self):
         """Sample the time it takes to perform req_per_min requests."""
 
-        self._do_test()
+        self._do_sample()
 
-    @dtest.parallel
-    @dtest.repeat(FLAGS.req_per_min)
     @dtest.depends(test_sample01)
     @dtest.attr(stress=True)
     def test_sample02(self):
         """Sample the time it takes to perform req_per_min requests."""
 
-        self._do_test()
+        self._do_sample()
 
-    @dtest.parallel
-    @dtest.repeat(FLAGS.req_per_min)
     @dtest.depends(test_sample02)
     @dtest.attr(stress=True)
     def test_sample03(self):
         """Sample the time it takes to perform req_per_min requests."""
 
-        self._do_test()
+        self._do_sample()
 
-    @dtest.parallel
-    @dtest.repeat(FLAGS.req_per_min)
     @dtest.depends(test_sample03)
     @dtest.attr(stress=True)
     def test_sample04(self):
         """Sample the time it takes to perform req_per_min requests."""
 
-        self._do_test()
+        self._do_sample()
 
-    @dtest.parallel
-    @dtest.repeat(FLAGS.req_per_min)
     @dtest.depends(test_sample04)
     @dtest.attr(stress=True)
     def test_sample05(self):
         """Sample the time it takes to perform req_per_min requests."""
 
-        self._do_test()
+        self._do_sample()
 
-    @dtest.parallel
-    @dtest.repeat(FLAGS.req_per_min)
     @dtest.depends(test_sample05)
     @dtest.attr(stress=True)
     def test_sample06(self):
         """Sample the time it takes to perform req_per_min requests."""
 
-        self._do_test()
+        self._do_sample()
 
-    @dtest.parallel
-    @dtest.repeat(FLAGS.req_per_min)
     @dtest.depends(test_sample06)
     @dtest.attr(stress=True)
     def test_sample07(self):
         """Sample the time it takes to perform req_per_min requests."""
 
-        self._do_test()
+        self._do_sample()
 
-    @dtest.parallel
-    @dtest.repeat(FLAGS.req_per_min)
     @dtest.depends(test_sample07)
     @dtest.attr(stress=True)
     def test_sample08(self):
         """Sample the time it takes to perform req_per_min requests."""
 
-        self._do_test()
+        self._do_sample()
 
-    @dtest.parallel
-    @dtest.repeat(FLAGS.req_per_min)
     @dtest.depends(test_sample08)
     @dtest.attr(stress=True)
     def test_sample09(self):
         """Sample the time it takes to perform req_per_min requests."""
 
-        self._do_test()
+        self._do_sample()
 
-    @dtest.parallel
-    @dtest.repeat(FLAGS.req_per_min)
     @dtest.depends(test_sample09)
     @dtest.attr(stress=True)
     def test_sample10(self):
         """Sample the time it takes to perform req_per_min requests."""
 
-        self._do_test()
+        self._do_sample()
@@ -0,0 +1,62 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import dtest
+from dtest import util as dtutil
+
+import base
+from stress import scenario
+
+FLAGS = base.FLAGS
+
+# Allow for the scenario's own duration
+duration = scenario.workload.duration if scenario.workload else 0
+
+
+class ScenarioTest(dtest.DTestCase):
+    """Test Nova under a mixed workload.
+
+    Only run when --scenario is given.  Runs the workload file's
+    weighted mix of operations, then reports the time taken by each
+    operation, and the number of times it failed or was skipped.
+    """
+
+    @dtest.timed(duration * 60 + FLAGS.timeout * 60)
+    @dtest.attr(scenario=True)
+    def test_scenario(self):
+        """Run the mixed workload."""
+
+        workload = scenario.workload
+        workload.run(seed=FLAGS.scenario_seed)
+
+        print >>dtest.status, "%-16s %8s %8s %8s %10s %10s %10s" % (
+            'Operation', 'Count', 'Errors', 'Skipped', 'Average', 'p50',
+            'p99')
+        for name in sorted(workload.ops):
+            times = workload.times[name]
+            if len(times):
+                print >>dtest.status, (
+                    "%-16s %8d %8d %8d %10.2f %10.2f %10.2f" %
+                    (name, len(times), workload.errors[name],
+                     workload.skips[name], times.average,
+                     times.percentile(.5), times.percentile(.99)))
+            else:
+                print >>dtest.status, "%-16s %8d %8d %8d %10s %10s %10s" % (
+                    name, 0, workload.errors[name], workload.skips[name],
+                    '-', '-', '-')
+
+        errors = sum(workload.errors.values())
+        dtutil.assert_equal(errors, 0,
+                            '%d scenario operations failed' % errors)
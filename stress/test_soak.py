@@ -0,0 +1,172 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import dtest
+from dtest import util as dtutil
+import eventlet
+import sys
+
+import base
+import cleanup
+import stats
+import stress
+import utils
+from stress import loadgen
+
+FLAGS = base.FLAGS
+
+# Windows with fewer calls than this are too small to abort on
+min_abort_total = 10
+
+
+class SoakTest(dtest.DTestCase):
+    """Test Nova under sustained load.
+
+    Only run when --soak-duration is given.  For the duration, issues
+    instance retrievals and creates at the rates given by
+    --requests-per-minute and --creates-per-minute; each created
+    instance is deleted again, so the number of instances stays flat.
+    At the end of each --soak-window, reports the throughput,
+    percentiles, and error rate of the requests and creates in the
+    window, and aborts if the error rate exceeds
+    --soak-max-error-rate.
+    """
+
+    @classmethod
+    @dtest.timed(FLAGS.timeout * 60)
+    @dtest.attr(soak=True)
+    def setUpClass(cls):
+        """Set up the soak test.
+
+        Creates an instance for the requests to retrieve.
+        """
+
+        cls.server = stress.mk_instance(None)
+
+    @classmethod
+    @dtest.attr(soak=True)
+    def tearDownClass(cls):
+        """Tear down the soak test.
+
+        Cleans up the instance we allocated in setUpClass().
+        """
+
+        cleanup.janitor.reap('servers', [cls.server])
+
+    def _do_request(self):
+        """Retrieve the instance, counting the outcome in the window."""
+
+        start = stress.start_time(consume=False)
+        try:
+            os = stress.OpenStackWrapped.getOpenStack()
+            try:
+                os.servers.get(self.server)
+            finally:
+                os.release()
+        except Exception, e:
+            print >>sys.stderr, "Exception %s" % e
+            self.windows['requests'].add_error()
+        else:
+            self.windows['requests'].append(
+                (utils.monotonic() - start) * 1000.0)
+
+    def _do_create(self):
+        """Create and delete an instance, counting the outcome."""
+
+        start = stress.start_time(consume=False)
+        try:
+            server = stress.mk_instance(None)
+        except Exception, e:
+            print >>sys.stderr, "Exception %s" % e
+            self.windows['creates'].add_error()
+            return
+
+        self.windows['creates'].append(
+            (utils.monotonic() - start) * 1000.0)
+
+        # Don't let the instances pile up
+        try:
+            os = stress.OpenStackWrapped.getOpenStack()
+            try:
+                os.servers.delete(server)
+            finally:
+                os.release()
+            cleanup.janitor.forget('servers', server)
+        except Exception, e:
+            print >>sys.stderr, "Exception %s" % e
+
+    def _report(self, name, window):
+        """Report on a closed window; returns True to abort the run."""
+
+        print >>dtest.status, (
+            '%s: %.2f per minute, p50 %.2f, p95 %.2f, p99 %.2f, '
+            '%.2f%% errors' %
+            (name, window.throughput, window.stats.percentile(.5),
+             window.stats.percentile(.95), window.stats.percentile(.99),
+             window.error_rate * 100.0))
+
+        return (FLAGS.soak_max_error_rate is not None and
+                window.total >= min_abort_total and
+                window.error_rate > FLAGS.soak_max_error_rate)
+
+    @dtest.timed(FLAGS.soak_duration * 60 + FLAGS.timeout * 60)
+    @dtest.attr(soak=True)
+    def test_soak(self):
+        """Keep up the request and create rates for the soak duration."""
+
+        self.windows = dict(
+            requests=stats.RollingWindow(FLAGS.soak_window,
+                                         error=FLAGS.stats_error),
+            creates=stats.RollingWindow(FLAGS.soak_window,
+                                        error=FLAGS.stats_error))
+        calls = dict(requests=(FLAGS.req_per_min, self._do_request),
+                     creates=(FLAGS.creates_per_min, self._do_create))
+
+        # A rate of 0 leaves that part of the mix out
+        gens = dict((name, loadgen.LoadGenerator(rate, FLAGS.max_in_flight))
+                    for name, (rate, call) in calls.items() if rate > 0)
+
+        # Run the generators in their own threads
+        output = dtest.status.output
+        test = dtest.status.test
+
+        def run(name):
+            dtest.status.setup(output, test)
+            rate, call = calls[name]
+            gens[name].run(int(rate * FLAGS.soak_duration), call)
+
+        threads = [eventlet.spawn(run, name) for name in gens]
+
+        # Report on each window until the generators are done
+        aborted = None
+        while not all(thread.dead for thread in threads):
+            eventlet.sleep(1)
+
+            for name in sorted(gens):
+                window = self.windows[name].roll()
+                if window is not None and self._report(name, window):
+                    aborted = ('%s error rate %.2f%% exceeds %.2f%%' %
+                               (name, window.error_rate * 100.0,
+                                FLAGS.soak_max_error_rate * 100.0))
+
+            if aborted:
+                for gen in gens.values():
+                    gen.stop()
+                break
+
+        for thread in threads:
+            thread.wait()
+
+        dtutil.assert_is_none(aborted, 'Soak test aborted: %s' % aborted)
@@ -17,6 +17,7 @@ from dtest import util as dtutil
 import novaclient
 
 import base
+import catalog
 
 FLAGS = base.FLAGS
 
@@ -40,18 +41,14 @@ class FlavorTest(base.BaseIntegrationTest):
         # Do we have a list?
         dtutil.assert_not_equal(len(flavors), 0)
 
-        # Let's see if some of our base-line flavors are present
-        foundflav = 0
-        for flav in flavors:
-            if flav.name in self.recognized_flavors:
-                exemplar = self.recognized_flavors[flav.name]
-                dtutil.assert_equal(flav.id, exemplar['id'])
-                dtutil.assert_equal(flav.ram, exemplar['ram'])
-                dtutil.assert_equal(flav.disk, exemplar['disk'])
-                foundflav += 1
-
-        # Make sure we found our flavors
-        dtutil.assert_equal(len(self.recognized_flavors), foundflav)
+        # Let's see if our base-line flavors are present
+        flavors = catalog.index(flavors)
+        for exemplar_id, exemplar in self.recognized_flavors.items():
+            dtutil.assert_in(exemplar_id, flavors)
+            flav = flavors[exemplar_id]
+            dtutil.assert_equal(flav.name, exemplar['name'])
+            dtutil.assert_equal(flav.ram, exemplar['ram'])
+            dtutil.assert_equal(flav.disk, exemplar['disk'])
 
     def test_get(self):
         """Test that we can get the details of a given flavor."""
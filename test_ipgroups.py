@@ -17,6 +17,7 @@ from dtest import util as dtutil
 import novaclient
 
 import base
+import cleanup
 
 
 class IpGroupTest(base.BaseIntegrationTest):
@@ -29,9 +30,13 @@ class IpGroupTest(base.BaseIntegrationTest):
         name = self.randName()
 
         # Try to create the group--fails for now (operation not
-        # implemented in nova)
-        dtutil.assert_raises(novaclient.OpenStackException,
-                             self.os.ipgroups.create, name)
+        # implemented in nova); should it ever succeed, make sure the
+        # group gets cleaned up
+        def create(name):
+            return cleanup.janitor.track('ipgroups',
+                                         self.os.ipgroups.create(name))
+
+        dtutil.assert_raises(novaclient.OpenStackException, create, name)
 
     def test_delete(self):
         """Test that we can delete an IP group."""
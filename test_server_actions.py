@@ -13,12 +13,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import time
-
 import dtest
 from dtest import util as dtutil
 
 import base
+import catalog
+import fixtures
+import profiler
 import test_servers
 import utils
 
@@ -29,9 +30,9 @@ class ServerActionTest(base.BaseIntegrationTest):
     """Test that the server actions API works as expected.
 
     Note that setUp() is extended to set self.server to a created
-    instance.  A new instance is created for each test, so this is the
-    place for destructive tests.  The tearDown() method will ensure
-    that the instance is destroyed.
+    instance.  A new instance is created (or leased from the server
+    pool) for each test, so this is the place for destructive tests.
+    The tearDown() method will ensure that the instance is destroyed.
 
     """
 
@@ -41,15 +42,19 @@ class ServerActionTest(base.BaseIntegrationTest):
         # Call superclass setUp method--sets up self.os
         super(ServerActionTest, self).setUp()
 
+        # Lease the server from the pool if we can
+        self.lease = None
+        if fixtures.server_pool.enabled:
+            self.lease = fixtures.server_pool.lease()
+            self.server = self.os.servers.get(self.lease.server.id)
+            return
+
         # Set up the server
-        server_name = self.randName()
-        server = self.os.servers.create(name=server_name,
-                                        image=FLAGS.image,
-                                        flavor=FLAGS.flavor)
+        server = self.create_server()
 
         # Wait for server to transition to the appropriate state
         states = utils.StatusTracker('active', 'build', 'active')
-        states.waitForState(self.os.servers.get, 'status', server)
+        states.waitForPolledState('servers', server)
 
         # Save the server for later use
         self.server = server
@@ -57,8 +62,14 @@ class ServerActionTest(base.BaseIntegrationTest):
     def tearDown(self):
         """Clean up left-over instances."""
 
-        # Delete the server
-        self.server.delete()
+        # Delete the server; the pool replaces leased servers
+        if self.lease is not None:
+            fixtures.server_pool.release(self.lease)
+        else:
+            self.server.delete()
+
+        # Call superclass tearDown method--releases self.os
+        super(ServerActionTest, self).tearDown()
 
     @dtest.timed(FLAGS.timeout * 60)
     @dtest.depends(test_servers.ServerCreationTest.test_create_delete_server)
@@ -75,8 +86,7 @@ class ServerActionTest(base.BaseIntegrationTest):
         # Wait for server to transition to next state and make sure it
         # went to the correct one
         dtutil.assert_is(True,
-                         states.waitForState(self.os.servers.get,
-                                             'status', self.server))
+                         states.waitForPolledState('servers', self.server))
 
         # Confirm the resize
         self.server.confirm_resize()
@@ -96,7 +106,7 @@ class ServerActionTest(base.BaseIntegrationTest):
 
         # Let the resize-confirm register or self.os.serves.get will
         # raise an exception
-        time.sleep(2)
+        profiler.sleep(2)
 
         # Create list of states
         states = utils.StatusTracker('active', 'resize-confirm')
@@ -104,8 +114,7 @@ class ServerActionTest(base.BaseIntegrationTest):
         # Wait for server to transition to next state and make sure it
         # went to the correct one
         dtutil.assert_is(True,
-                         states.waitForState(self.os.servers.get,
-                                             'status', self.server))
+                         states.waitForPolledState('servers', self.server))
 
         # Revert the resize
         self.server.revert_resize()
@@ -125,8 +134,7 @@ class ServerActionTest(base.BaseIntegrationTest):
         states = utils.StatusTracker('active', 'reboot', 'active')
         self.server.reboot()
         dtutil.assert_is(True,
-                         states.waitForState(self.os.servers.get,
-                                             'status', self.server))
+                         states.waitForPolledState('servers', self.server))
 
     @dtest.timed(FLAGS.timeout * 60)
     @dtest.depends(test_servers.ServerCreationTest.test_create_delete_server)
@@ -139,8 +147,7 @@ class ServerActionTest(base.BaseIntegrationTest):
         states = utils.StatusTracker('active', 'hard_reboot', 'active')
         self.os.servers.reboot(self.server, type='HARD')
         dtutil.assert_is(True,
-                         states.waitForState(self.os.servers.get,
-                                             'status', self.server))
+                         states.waitForPolledState('servers', self.server))
 
     @dtest.timed(FLAGS.timeout * 60)
     @dtest.depends(test_servers.ServerCreationTest.test_create_delete_server)
@@ -152,7 +159,7 @@ class ServerActionTest(base.BaseIntegrationTest):
 
         # Must wait for the rebuild to start, or self.os.servers.get
         # throws an exception
-        time.sleep(4)
+        profiler.sleep(4)
 
         # Legal states...
         states = utils.StatusTracker('active', 'build', 'active')
@@ -160,11 +167,10 @@ class ServerActionTest(base.BaseIntegrationTest):
         # Wait for server to transition to next state and make sure it
         # went to the correct one
         dtutil.assert_is(True,
-                         states.waitForState(self.os.servers.get,
-                                             'status', self.server))
+                         states.waitForPolledState('servers', self.server))
 
         # Verify that rebuild acted correctly
         created_server = self.os.servers.get(self.server.id)
-        img = self.os.images.get(FLAGS.image)
+        img = catalog.images.get(FLAGS.image)
 
         dtutil.assert_equal(img.id, created_server.imageId)
@@ -18,6 +18,7 @@ from dtest import util as dtutil
 import novaclient
 
 import base
+import cleanup
 import test_servers
 import utils
 
@@ -36,13 +37,13 @@ class ServerImageTest(test_servers.BaseServerTest):
                                      'saving', 'active')
 
         # Make a backup image for the server
-        backup_image = self.os.images.create(server=self.server,
-                                             name="backup")
+        backup_name = self.randName(prefix="backup")
+        backup_image = cleanup.janitor.track('images', self.os.images.create(
+                server=self.server, name=backup_name))
         dtutil.assert_is(True,
-                         states.waitForState(self.os.images.get,
-                                             'status', backup_image))
+                         states.waitForPolledState('images', backup_image))
 
-        dtutil.assert_equal(backup_image.name, "backup")
+        dtutil.assert_equal(backup_image.name, backup_name)
 
         # Cleanup
         self.os.images.delete(backup_image)
@@ -57,22 +58,21 @@ class ServerImageTest(test_servers.BaseServerTest):
                                      'saving', 'active')
 
         # Make a backup image for the server
-        backup_image = self.os.images.create(server=self.server,
-                                             name="backup")
+        backup_name = self.randName(prefix="backup")
+        backup_image = cleanup.janitor.track('images', self.os.images.create(
+                server=self.server, name=backup_name))
         dtutil.assert_is(True,
-                         states.waitForState(self.os.images.get,
-                                             'status', backup_image))
+                         states.waitForPolledState('images', backup_image))
 
         # wrap it in a try so that we can clean up afterwards
         try:
-            dtutil.assert_equal(backup_image.name, "backup")
+            dtutil.assert_equal(backup_image.name, backup_name)
 
             # Finally, rebuild from the image
             states = utils.StatusTracker('active', 'build', 'active')
             self.os.servers.rebuild(self.server.id, backup_image.id)
             dtutil.assert_is(True,
-                             states.waitForState(self.os.servers.get,
-                                                 'status', self.server))
+                             states.waitForPolledState('servers', self.server))
             created_server = self.os.servers.get(self.server.id)
 
             # This has the original image_id out of convention.
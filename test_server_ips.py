@@ -23,6 +23,9 @@ import utils
 class ServerIpTest(test_servers.BaseServerTest):
     """Test that the server ips API works as expected."""
 
+    # The tests do not modify the instance
+    readonly = True
+
     def test_get(self):
         """Test that we can get public and private IP addresses."""
 
@@ -22,6 +22,9 @@ import utils
 class ServerMetaTest(test_servers.BaseServerTest):
     """Test that the server metadata API works as expected."""
 
+    # The tests do not modify the instance
+    readonly = True
+
     def test_list(self):
         """Test that we can retrieve metadata for a server."""
 
@@ -19,6 +19,8 @@ from glance import client as glanceclient
 import novaclient
 
 import base
+import catalog
+import fixtures
 import utils
 
 FLAGS = base.FLAGS
@@ -42,8 +44,7 @@ class ServerCreationTest(base.BaseIntegrationTest):
         # Wait for server to transition to next state and make sure it
         # went to the correct one
         dtutil.assert_is(True,
-                         states.waitForState(self.os.servers.get,
-                                             'status', new_server))
+                         states.waitForPolledState('servers', new_server))
 
         # Verify the server was created correctly
         created_server = self.os.servers.get(new_server.id)
@@ -53,6 +54,25 @@ class ServerCreationTest(base.BaseIntegrationTest):
         # test_delete
         new_server.delete()
 
+    @dtest.attr(longtest=True)
+    @dtest.timed(FLAGS.timeout * 60)
+    def test_create_servers(self):
+        """Verify that several servers can be created at once."""
+
+        # Collect the servers as they become active
+        servers = []
+        for server, error in self.create_servers(3, FLAGS.image,
+                                                 FLAGS.flavor):
+            dtutil.assert_is(None, error)
+            servers.append(server)
+
+        # They must all be distinct
+        dtutil.assert_equal(3, len(set(server.id for server in servers)))
+
+        # Clean up
+        for server in servers:
+            self.os.servers.delete(server)
+
     @dtest.attr(longtest=True)
     @dtest.timed(FLAGS.timeout * 60)
     def test_create_from_bad_image(self):
@@ -75,9 +95,7 @@ class ServerCreationTest(base.BaseIntegrationTest):
 
             # Verify state transition
             dtutil.assert_is(True,
-                             states.waitForState(self.os.servers.get,
-                                                 'status',
-                                                 new_server))
+                             states.waitForPolledState('servers', new_server))
         finally:
             # Cleanup
             self.glance_connection.delete_image(new_meta['id'])
@@ -101,7 +119,7 @@ class ServerCreationTest(base.BaseIntegrationTest):
 
         # Wait for server to transition to next state and make sure it
         # went to the correct one
-        states.waitForState(self.os.servers.get, 'status', new_server)
+        states.waitForPolledState('servers', new_server)
 
         # Delete the server and verify it is removed
         new_server.delete()
@@ -113,8 +131,7 @@ class ServerCreationTest(base.BaseIntegrationTest):
         # Verify that state goes to "deleted", or raises NotFound exception.
         try:
             dtutil.assert_is(True,
-                             states.waitForState(self.os.servers.get,
-                                                 'status', new_server))
+                             states.waitForPolledState('servers', new_server))
         except novaclient.exceptions.NotFound:
             pass
 
@@ -165,6 +182,11 @@ class BaseServerTest(base.BaseIntegrationTest):
         The randomly-generated data of the metadata associated with
         the instance.
 
+    When the server pool is enabled, the instance is leased from the
+    pool rather than created.  Subclasses whose tests do not modify
+    the instance should set the readonly class attribute to True, so
+    that they may share a single pooled instance.
+
     Note that setUpClass() is dependent on test_create_delete_server,
     so if that test fails for some reason, all tests in subclasses of
     this class will go to the DEPFAIL state.  This will also happen if
@@ -178,6 +200,8 @@ class BaseServerTest(base.BaseIntegrationTest):
     image = None
     meta_key = None
     meta_val = None
+    readonly = False
+    lease = None
 
     @classmethod
     @dtest.depends(ServerCreationTest.test_create_delete_server)
@@ -185,8 +209,21 @@ class BaseServerTest(base.BaseIntegrationTest):
     def setUpClass(cls):
         """Set up an instance for use by the enclosed tests."""
 
-        # Need an OpenStack instance so we can create the server
-        os = cls.getOpenStack()
+        # Need an OpenStack instance so we can create the server; it's
+        # kept until tearDownClass(), since the server is bound to it
+        os = cls.class_os = cls.getOpenStack()
+
+        # Lease the server from the pool if we can
+        cls.flavor = FLAGS.flavor
+        cls.image = FLAGS.image
+        if fixtures.server_pool.enabled:
+            cls.lease = fixtures.server_pool.lease(
+                destructive=not cls.readonly)
+            cls.meta_key = cls.lease.meta_key
+            cls.meta_data = cls.lease.meta_data
+            cls.server = os.servers.get(cls.lease.server.id)
+            cls.server_name = cls.server.name
+            return
 
         # Select a random key and value for metadata; used by the
         # metadata tests
@@ -194,8 +231,6 @@ class BaseServerTest(base.BaseIntegrationTest):
         cls.meta_data = cls.randName(length=50)
 
         # Set up the server
-        cls.flavor = FLAGS.flavor
-        cls.image = FLAGS.image
         cls.server_name = cls.randName()
         cls.server = os.servers.create(name=cls.server_name,
                                        image=cls.image, flavor=cls.flavor,
@@ -204,15 +239,20 @@ class BaseServerTest(base.BaseIntegrationTest):
         # Wait for the server to transition to the appropriate state
         states = utils.StatusTracker('active', 'build', 'active')
         dtutil.assert_is(True,
-                         states.waitForState(os.servers.get, 'status',
-                                             cls.server))
+                         states.waitForPolledState('servers', cls.server))
 
     @classmethod
     def tearDownClass(cls):
         """Clean up the instance created by setUpClass()."""
 
-        # Delete the server
-        cls.server.delete()
+        # Delete the server; the pool replaces leased servers
+        if cls.lease is not None:
+            fixtures.server_pool.release(cls.lease)
+        else:
+            cls.server.delete()
+
+        # Done with the OpenStack instance
+        cls.releaseOpenStack(cls.class_os)
 
 
 class ServerTest(BaseServerTest):
@@ -222,8 +262,8 @@ class ServerTest(BaseServerTest):
         """Test that the expected server details are returned."""
 
         # Verify the server fields are correct
-        flavor = self.os.flavors.get(self.flavor)
-        image = self.os.images.get(self.image)
+        flavor = catalog.flavors.get(self.flavor)
+        image = catalog.images.get(self.image)
         server = self.os.servers.get(self.server)
         dtutil.assert_equal(int(image.id), int(server.imageId))
         dtutil.assert_equal(int(flavor.id), int(server.flavorId))
@@ -238,12 +278,8 @@ class ServerTest(BaseServerTest):
         """Test that the expected servers are returned in a list."""
 
         # Verify the new server is in the account's list of servers
-        server_list = self.os.servers.list()
-        found = False
-        for s in server_list:
-            if s.name == self.server_name:
-                found = True
-        assert found
+        servers = catalog.index(self.os.servers.list(), 'name')
+        assert self.server_name in servers
 
     @dtest.timed(FLAGS.timeout * 60)
     @dtest.depends(test_get_server, test_list_servers)
@@ -27,7 +27,7 @@ class StressTests(dtest.DTestCase):
 
     @classmethod
     @dtest.depends(stress.tearDown)
-    @dtest.attr(stress=True)
+    @dtest.attr(stress=True, aggregate=True, checks=True)
     def setUpClass(cls):
         """Dependency attachment point.
 
@@ -54,18 +54,21 @@ class StressTests(dtest.DTestCase):
         # Now, output it
         print >>dtest.status, '\n    '.join(lines)
 
-    @dtest.attr(stress=True)
+    @dtest.attr(stress=True, aggregate=True, checks=True)
     def test_requests(self):
         """Test requests per minute."""
 
         # First, we'll output the statistics information
         self.output_statistics('Requests per minute', stress.requests_per_min)
 
-        # Now ensure it meets our desired limits
+        # Now ensure it meets our desired limits; the rate is measured
+        # over the time taken to issue the requests, which at best is
+        # exactly the target, so allow for --rate-tolerance
         dtutil.assert_greater_equal(stress.requests_per_min.average,
-                                    FLAGS.req_per_min)
+                                    FLAGS.req_per_min *
+                                    (1 - FLAGS.rate_tolerance / 100.0))
 
-    @dtest.attr(stress=True)
+    @dtest.attr(stress=True, aggregate=True, checks=True)
     def test_creates(self):
         """Test instance creations per minute."""
 
@@ -73,22 +76,94 @@ class StressTests(dtest.DTestCase):
         self.output_statistics('Instance creates per minute',
                                stress.creates_per_min)
 
-        # Now ensure it meets our desired limits
+        # Now ensure it meets our desired limits; as with requests,
+        # the rate is at best exactly the target
         dtutil.assert_greater_equal(stress.creates_per_min.average,
-                                    FLAGS.creates_per_min)
+                                    FLAGS.creates_per_min *
+                                    (1 - FLAGS.rate_tolerance / 100.0))
 
-    @dtest.attr(stress=True)
+    @dtest.attr(stress=True, aggregate=True, checks=True)
     def test_request_time(self):
-        """Test average request time."""
+        """Test average and tail request time."""
 
         # First, we'll output the statistics information
         self.output_statistics('Time per request', stress.request_time)
+        for status, stats in sorted(stress.request_failure_time.items()):
+            self.output_statistics('Time per failed request (%s)' % status,
+                                   stats)
+
+        # Failed and timed out requests count towards the tail too;
+        # leaving them out would flatter the percentiles
+        overall = stress.mk_statistics()
+        overall.merge(stress.request_time)
+        for stats in stress.request_failure_time.values():
+            overall.merge(stats)
+        if stress.request_failure_time:
+            self.output_statistics('Time per request, including failures',
+                                   overall)
 
         # Now ensure it meets our desired limits
         dtutil.assert_less_equal(stress.request_time.average,
                                  FLAGS.request_time)
+        if FLAGS.request_p99 is not None:
+            dtutil.assert_less_equal(overall.percentile(.99),
+                                     FLAGS.request_p99)
+
+    @dtest.attr(stress=True, aggregate=True, checks=True)
+    def test_endpoints(self):
+        """Test request time per endpoint."""
+
+        endpoints = stress.endpoints()
+
+        # Output a line for each endpoint and status
+        lines = ['Time per request by endpoint:',
+                 '%-28s %6s %8s %10s %10s %10s %10s' %
+                 ('Endpoint', 'Status', 'Samples', 'Average', 'Median',
+                  '90th', '99th')]
+        for (manager, method), statuses in sorted(endpoints.items()):
+            for status, stats in sorted(statuses.items()):
+                lines.append('%-28s %6s %8d %10.2f %10.2f %10.2f %10.2f' %
+                             ('%s.%s' % (manager, method), status,
+                              len(stats), stats.average, stats.median,
+                              stats.percentile(.9), stats.percentile(.99)))
+        print >>dtest.status, '\n    '.join(lines)
 
-    @dtest.attr(stress=True)
+        # With --trace-file, break the successful requests down into
+        # the phases of their HTTP exchanges
+        if stress.phase_time:
+            lines = ['Time per request by endpoint and phase:',
+                     '%-28s %7s %8s %10s %10s %10s %10s' %
+                     ('Endpoint', 'Phase', 'Samples', 'Average', 'Median',
+                      '90th', '99th')]
+            for (manager, method, phase), stats in sorted(
+                    stress.phase_time.items()):
+                lines.append('%-28s %7s %8d %10.2f %10.2f %10.2f %10.2f' %
+                             ('%s.%s' % (manager, method), phase,
+                              len(stats), stats.average, stats.median,
+                              stats.percentile(.9), stats.percentile(.99)))
+            print >>dtest.status, '\n    '.join(lines)
+
+        # Check the SLOs against all the requests to each endpoint
+        failed = []
+        for manager, method, percent, limit in FLAGS.endpoint_slos:
+            stats = stress.mk_statistics()
+            for tracker in endpoints.get((manager, method), {}).values():
+                stats.merge(tracker)
+
+            if percent is None:
+                name, value = 'average', stats.average
+            else:
+                name = 'p%g' % (percent * 100)
+                value = stats.percentile(percent)
+
+            if value > limit:
+                failed.append('%s.%s %s %.2f > %.2f' %
+                              (manager, method, name, value, limit))
+
+        dtutil.assert_false(failed, 'Endpoint SLOs not met: %s' %
+                            '; '.join(failed))
+
+    @dtest.attr(stress=True, aggregate=True, checks=True)
     def test_create_time(self):
         """Test average instance creation time."""
 
@@ -96,7 +171,49 @@ class StressTests(dtest.DTestCase):
         self.output_statistics('Time per instance creation',
                                stress.create_time)
 
+        # Then the phases, which tell API or scheduler slowness apart
+        # from hypervisor slowness
+        self.output_statistics('Time for the API to accept a create',
+                               stress.create_accept_time)
+        self.output_statistics('Time from accept to build, within '
+                               '%.2f on average' %
+                               stress.create_queue_error.average,
+                               stress.create_queue_time)
+        self.output_statistics('Time from build to active, within '
+                               '%.2f on average' %
+                               stress.create_build_error.average,
+                               stress.create_build_time)
+
         # Now ensure it meets our desired limits
         if FLAGS.create_time is not None:
             dtutil.assert_less_equal(stress.create_time.average,
                                      FLAGS.create_time)
+
+    @dtest.attr(stress=True, aggregate=True, checks=True)
+    def test_images(self):
+        """Test image upload throughput and latency."""
+
+        # Nothing to check unless images were uploaded
+        if not len(stress.image_upload_time):
+            return
+
+        # First, we'll output the statistics information
+        self.output_statistics('Image upload throughput (MB/s)',
+                               stress.image_upload_rate)
+        self.output_statistics('Time per image upload',
+                               stress.image_upload_time)
+        self.output_statistics('Time from image upload to available',
+                               stress.image_available_time)
+        self.output_statistics('Time per image delete',
+                               stress.image_delete_time)
+
+        # Now ensure it meets our desired limits
+        if FLAGS.image_upload_rate is not None:
+            dtutil.assert_greater_equal(stress.image_upload_rate.average,
+                                        FLAGS.image_upload_rate)
+        if FLAGS.image_available_time is not None:
+            dtutil.assert_less_equal(stress.image_available_time.average,
+                                     FLAGS.image_available_time)
+        if FLAGS.image_delete_time is not None:
+            dtutil.assert_less_equal(stress.image_delete_time.average,
+                                     FLAGS.image_delete_time)
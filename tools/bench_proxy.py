@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark the overhead of the stress test proxies.
+
+Calls a do-nothing manager method directly, through the bare
+timing of stress.wrap_endpoint_request(), and through a proxy from
+stress.OpenStackWrapped.wrap(), and reports the time per call of
+each, so the cost of the proxy itself can be told apart from the
+cost of the measurements.  No requests are sent.
+"""
+
+import optparse
+import os
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dtest
+
+import base
+
+
+class FakeClient(object):
+    """Stands in for the novaclient HTTP client."""
+
+    def request(self, *args, **kwargs):
+        return None, None
+
+
+class FakeManager(object):
+    """Stands in for a novaclient manager."""
+
+    def get(self, obj_id):
+        return obj_id
+
+
+class FakeOpenStack(object):
+    """Stands in for the novaclient OpenStack class."""
+
+    def __init__(self):
+        self.client = FakeClient()
+        self.servers = FakeManager()
+
+
+def timed(call, count):
+    """Return the time per call of call(), in microseconds."""
+
+    start = time.time()
+    for i in xrange(count):
+        call(i)
+
+    return (time.time() - start) / count * 1e6
+
+
+def main():
+    op = dtest.optparser(usage="%prog [options]")
+    base.add_opts(op)
+    op.add_option("--calls",
+                  action="store", type="int", dest="calls",
+                  default=200000,
+                  help="Number of calls to time [default %default].")
+    (options, args) = op.parse_args()
+    base.extract_opts(options)
+
+    # Only importable once the options are in place
+    import stress
+
+    os_ = FakeOpenStack()
+    wrapped = stress.OpenStackWrapped.wrap(os_)
+    endpoint = ('servers', 'get')
+
+    def bare(obj_id):
+        return stress.wrap_endpoint_request(endpoint, os_.servers.get,
+                                            obj_id)
+
+    results = [
+        ('direct', timed(os_.servers.get, options.calls)),
+        ('timing only', timed(bare, options.calls)),
+        ('proxy', timed(lambda i: wrapped.servers.get(i), options.calls)),
+        ('proxy, rewrap', timed(lambda i: stress.OpenStackWrapped.wrap(
+                    os_).servers.get(i), options.calls)),
+        ]
+
+    # The cost of the proxy is over and above the timing
+    print "%-16s %12s %12s" % ('Call', 'us/call', 'proxy cost')
+    for name, per_call in results:
+        if name.startswith('proxy'):
+            print "%-16s %12.3f %12.3f" % (name, per_call,
+                                           per_call - results[1][1])
+        else:
+            print "%-16s %12.3f %12s" % (name, per_call, '-')
+
+
+if __name__ == '__main__':
+    main()
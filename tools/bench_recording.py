@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark recording samples from many threads at once.
+
+For each thread count, starts that many operating system threads,
+each appending the same number of samples to a shared tracker, and
+reports the samples recorded per second and whether the tracker ended
+up with the right count and average.  Compares a stats.Statistics
+guarded by a lock, which every append must take, against a
+stats.ConcurrentStatistics, which takes no lock to append.  A reader
+thread queries the tracker's average throughout, as the live metrics
+do.
+"""
+
+import optparse
+import os
+import sys
+import threading
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+import stats
+
+
+class LockedStatistics(object):
+    """Statistics guarded by a single lock."""
+
+    def __init__(self):
+        self._tracker = stats.Statistics()
+        self._lock = threading.Lock()
+
+    def append(self, sample):
+        with self._lock:
+            self._tracker.append(sample)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tracker)
+
+    @property
+    def average(self):
+        with self._lock:
+            return self._tracker.average
+
+
+TRACKERS = (
+    ('locked', LockedStatistics),
+    ('concurrent', lambda: stats.ConcurrentStatistics(stats.Statistics())),
+    )
+
+
+def run(tracker, threads, samples):
+    """Record samples from threads; return the elapsed time in seconds."""
+
+    done = threading.Event()
+
+    def write():
+        for i in xrange(samples):
+            tracker.append(float(i % 100))
+
+    def read():
+        while not done.is_set():
+            tracker.average
+            time.sleep(0.001)
+
+    writers = [threading.Thread(target=write) for i in range(threads)]
+    reader = threading.Thread(target=read)
+    reader.start()
+
+    start = time.time()
+    for thread in writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    elapsed = time.time() - start
+
+    done.set()
+    reader.join()
+
+    return elapsed
+
+
+def main():
+    op = optparse.OptionParser(usage="%prog [options]")
+    op.add_option("-n", "--samples",
+                  action="store", type="int", dest="samples",
+                  default=200000,
+                  help="Number of samples each thread records "
+                  "[default %default].")
+    op.add_option("-t", "--threads",
+                  action="store", type="string", dest="threads",
+                  default="1,2,4,8,16",
+                  help="Comma-separated thread counts to try "
+                  "[default %default].")
+    (options, args) = op.parse_args()
+
+    expected_avg = sum(float(i % 100) for i in xrange(options.samples))
+    expected_avg /= options.samples
+
+    print "%-8s %-12s %10s %14s %8s" % ('Threads', 'Tracker', 'Time (s)',
+                                        'Samples/s', 'Correct')
+    for threads in [int(t) for t in options.threads.split(',')]:
+        for name, factory in TRACKERS:
+            tracker = factory()
+            elapsed = run(tracker, threads, options.samples)
+            total = threads * options.samples
+            correct = (len(tracker) == total and
+                       abs(tracker.average - expected_avg) < 1e-6)
+            print "%-8d %-12s %10.3f %14.0f %8s" % (
+                threads, name, elapsed, total / elapsed,
+                'yes' if correct else 'NO')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark the order in which the scheduler runs tests.
+
+Generates a toy suite: a slow test with a slower one depending on it,
+alongside a number of fast, independent tests.  Runs it one thread at
+a time under dtest's DTestQueue and, with a history recording how
+long each test takes, under the scheduler.CriticalPathQueue, and
+reports the order the tests started in and how long each run took.
+Exits with an error if the CriticalPathQueue did not run the
+dependent test as soon as the test it depends on was done, since it
+is on the critical path and the fast tests are not.
+"""
+
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+
+import eventlet
+eventlet.monkey_patch()
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dtest
+from dtest import constants
+
+import history
+import scheduler
+
+
+PACKAGE = 'schedtoy'
+
+TOY_TEST = '''
+import time
+
+import dtest
+
+
+def test_slow():
+    time.sleep(%(slow)r)
+
+
+@dtest.depends(test_slow)
+def test_after():
+    time.sleep(%(after)r)
+'''
+
+FAST_TEST = '''
+
+def test_fast%(i)02d():
+    time.sleep(%(fast)r)
+'''
+
+
+def make_suite(directory, slow, after, fast, count):
+    """Write the toy suite to a package in directory.
+
+    Returns a dictionary mapping the name of each test to its
+    duration.
+    """
+
+    path = os.path.join(directory, PACKAGE)
+    os.mkdir(path)
+    open(os.path.join(path, '__init__.py'), 'w').close()
+
+    durations = dict(slow=slow, after=after)
+    with open(os.path.join(path, 'test_toy.py'), 'w') as f:
+        f.write(TOY_TEST % durations)
+        for i in range(count):
+            f.write(FAST_TEST % dict(i=i, fast=fast))
+            durations['fast%02d' % i] = fast
+
+    return dict(('%s.test_toy.test_%s' % (PACKAGE, name), duration)
+                for name, duration in durations.items())
+
+
+def run(cls, path, **kwargs):
+    """Run the toy suite one test at a time under a queue of class cls.
+
+    Each queue needs tests of its own, so the suite is imported
+    afresh.  Returns the queue and the names of the tests in the
+    order they started.
+    """
+
+    for name in list(sys.modules):
+        if name == PACKAGE or name.startswith(PACKAGE + '.'):
+            del sys.modules[name]
+
+    started = []
+
+    class Output(dtest.DTestOutput):
+        def notify(self, test, state):
+            if state == constants.RUNNING:
+                started.append(str(test).rsplit('_', 1)[-1])
+
+    queue = cls(1, output=Output(output=open(os.devnull, 'w')), **kwargs)
+    dtest.explore(path, queue)
+    queue.run()
+
+    return queue, started
+
+
+def main():
+    op = optparse.OptionParser(usage="%prog [options]")
+    op.add_option("--fast-tests",
+                  action="store", type="int", dest="fast_tests",
+                  default=4,
+                  help="Number of fast, independent tests [default "
+                  "%default].")
+    op.add_option("--scale",
+                  action="store", type="float", dest="scale",
+                  default=0.1,
+                  help="Duration of the slow test, in seconds; the "
+                  "dependent test takes half again as long, and the "
+                  "fast tests a quarter as long [default %default].")
+    (options, args) = op.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='backfire-sched-')
+    try:
+        durations = make_suite(directory, options.scale,
+                               options.scale * 1.5, options.scale / 4.0,
+                               options.fast_tests)
+        path = os.path.join(directory, PACKAGE)
+
+        # What the CriticalPathQueue will have learned from earlier
+        # runs
+        hist = history.History(os.path.join(directory, 'history.json'))
+        hist.add_run(dict((name, dict(duration=duration, state='OK'))
+                          for name, duration in durations.items()))
+
+        plain, plain_order = run(dtest.DTestQueue, path)
+        critpath, critpath_order = run(scheduler.CriticalPathQueue, path,
+                                       history=hist)
+    finally:
+        shutil.rmtree(directory)
+
+    print "%-18s %s" % ('DTestQueue', ', '.join(plain_order))
+    print "%-18s %s" % ('CriticalPathQueue', ', '.join(critpath_order))
+    print "CriticalPathQueue took %.2fs" % critpath.makespan()
+
+    # The dependent test must take the thread the slow test frees
+    if critpath_order[:2] != ['slow', 'after']:
+        sys.exit("The critical path did not run first")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark the list-backed and streaming statistics trackers.
+
+Feeds the same log-normally distributed latency samples into a
+stats.Statistics and a stats.StreamingStatistics, interleaving
+percentile queries the way test_stress.StressTests.output_statistics
+does, and reports the time taken, the approximate memory held, and
+the worst relative percentile error of the streaming tracker.
+"""
+
+import math
+import optparse
+import os
+import random
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+import stats
+
+
+PERCENTILES = (.1, .5, .9, .99)
+
+
+def sizeof(obj, seen=None):
+    """Approximate the memory held by obj and everything it refers to."""
+
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(sizeof(k, seen) + sizeof(v, seen)
+                    for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(sizeof(i, seen) for i in obj)
+    elif hasattr(obj, '__dict__'):
+        size += sizeof(obj.__dict__, seen)
+
+    return size
+
+
+def run(tracker, samples, query_every):
+    """Feed samples to tracker; return the elapsed time in seconds."""
+
+    start = time.time()
+    for i, sample in enumerate(samples):
+        tracker.append(sample)
+        if query_every and i % query_every == 0:
+            for pct in PERCENTILES:
+                tracker.percentile(pct)
+
+    # The final report
+    tracker.average
+    tracker.stddev
+    for pct in PERCENTILES:
+        tracker.percentile(pct)
+
+    return time.time() - start
+
+
+def main():
+    op = optparse.OptionParser(usage="%prog [options]")
+    op.add_option("-n", "--samples",
+                  action="store", type="int", dest="samples",
+                  default=500000,
+                  help="Number of samples to record [default %default].")
+    op.add_option("-q", "--query-every",
+                  action="store", type="int", dest="query_every",
+                  default=50000,
+                  help="Query the percentiles after this many samples; 0 "
+                  "queries only at the end [default %default].")
+    op.add_option("-e", "--error",
+                  action="store", type="float", dest="error",
+                  default=0.01,
+                  help="Relative error bound for the streaming tracker "
+                  "[default %default].")
+    op.add_option("--seed",
+                  action="store", type="int", dest="seed", default=42,
+                  help="Random seed [default %default].")
+    (options, args) = op.parse_args()
+
+    rng = random.Random(options.seed)
+    samples = [rng.lognormvariate(math.log(200.0), 0.5)
+               for i in xrange(options.samples)]
+
+    listed = stats.Statistics()
+    streamed = stats.StreamingStatistics(options.error)
+
+    list_time = run(listed, samples, options.query_every)
+    stream_time = run(streamed, samples, options.query_every)
+
+    print "Samples: %d, error bound: %.2f%%" % (options.samples,
+                                                options.error * 100.0)
+    print "%-12s %12s %14s" % ('Tracker', 'Time (s)', 'Memory (KiB)')
+    print "%-12s %12.3f %14.1f" % ('list', list_time,
+                                   sizeof(listed) / 1024.0)
+    print "%-12s %12.3f %14.1f" % ('streaming', stream_time,
+                                   sizeof(streamed) / 1024.0)
+
+    print "%-12s %12s %12s %10s" % ('Percentile', 'list', 'streaming',
+                                    'rel. err')
+    for pct in PERCENTILES:
+        exact = listed.percentile(pct)
+        approx = streamed.percentile(pct)
+        print "%-12s %12.2f %12.2f %9.3f%%" % (
+            'p%g' % (pct * 100), exact, approx,
+            abs(approx - exact) / exact * 100.0)
+    print "%-12s %12.2f %12.2f" % ('average', listed.average,
+                                   streamed.average)
+    print "%-12s %12.2f %12.2f" % ('stddev', listed.stddev, streamed.stddev)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Query the stress run results recorded with run_tests.py --results-db.
+
+Commands:
+
+    list
+        List the recorded runs.
+
+    show <run>
+        Show the summary statistics of each metric of a run.
+
+    compare <base run> <new run>
+        Compare the percentiles of each metric between two runs,
+        flagging changes for the worse larger than --threshold
+        percent.  Exits with status 1 if there are any.
+
+Runs are given by ID, or as "latest" or "previous".
+"""
+
+import optparse
+import os
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+import results
+
+
+# The metrics, besides the rates per minute, of which larger samples
+# are an improvement
+HIGHER_IS_BETTER = ('image_upload_rate',)
+
+
+def higher_is_better(metric):
+    """Test whether larger samples of a metric are an improvement."""
+
+    return metric.endswith('_per_min') or metric in HIGHER_IS_BETTER
+
+
+def resolve(store, run):
+    """Resolve a run argument to a run ID."""
+
+    ids = [r['id'] for r in store.runs()]
+    if run == 'latest' and ids:
+        return ids[-1]
+    elif run == 'previous' and len(ids) > 1:
+        return ids[-2]
+    elif run.isdigit() and int(run) in ids:
+        return int(run)
+
+    sys.exit("No such run %r" % run)
+
+
+def describe(run):
+    """Describe a run on one line."""
+
+    started = time.strftime('%Y-%m-%d %H:%M:%S',
+                            time.localtime(run['started']))
+    return "%-5d %s  %-12s %s%s" % (
+        run['id'], started, (run['revision'] or 'unknown')[:12],
+        run['target'], '' if run['finished'] else '  (incomplete)')
+
+
+def do_list(store, options, args):
+    """List the recorded runs."""
+
+    for run in store.runs():
+        print describe(run)
+
+
+def do_show(store, options, args):
+    """Show the summary statistics of a run."""
+
+    if len(args) != 1:
+        sys.exit("Usage: show <run>")
+    run_id = resolve(store, args[0])
+
+    print "%-18s %8s %10s %10s" % ('Metric', 'Samples', 'Average',
+                                   'Std. Dev') + ''.join(
+        ' %10s' % ('p%g' % (pct * 100)) for pct in results.PERCENTILES)
+    for metric in store.metrics(run_id):
+        stats = store.statistics(run_id, metric)
+        print "%-18s %8d %10.2f %10.2f" % (metric, len(stats),
+                                          stats.average,
+                                          stats.stddev) + ''.join(
+            ' %10.2f' % stats.percentile(pct)
+            for pct in results.PERCENTILES)
+
+
+def do_compare(store, options, args):
+    """Compare the percentiles of two runs."""
+
+    if len(args) != 2:
+        sys.exit("Usage: compare <base run> <new run>")
+    base_id = resolve(store, args[0])
+    new_id = resolve(store, args[1])
+
+    regressions = 0
+    print "%-18s %-10s %10s %10s %9s" % ('Metric', 'Statistic', 'Base',
+                                         'New', 'Change')
+    for metric in store.metrics(base_id):
+        if metric not in store.metrics(new_id):
+            continue
+
+        base = store.statistics(base_id, metric)
+        new = store.statistics(new_id, metric)
+
+        rows = [('average', base.average, new.average)]
+        rows.extend(('p%g' % (pct * 100), base.percentile(pct),
+                     new.percentile(pct)) for pct in results.PERCENTILES)
+        for name, before, after in rows:
+            if before:
+                change = (after - before) / before * 100.0
+            else:
+                change = 0.0
+
+            worse = -change if higher_is_better(metric) else change
+            flag = ''
+            if worse > options.threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+
+            print "%-18s %-10s %10.2f %10.2f %8.1f%%%s" % (
+                metric, name, before, after, change, flag)
+
+    if regressions:
+        sys.exit(1)
+
+
+COMMANDS = {
+    'list': do_list,
+    'show': do_show,
+    'compare': do_compare,
+    }
+
+
+def main():
+    op = optparse.OptionParser(usage="%prog [options] <command> [<run>...]")
+    op.add_option("-d", "--db",
+                  action="store", type="string", dest="db",
+                  default="stress_results.db",
+                  help="The results database [default %default].")
+    op.add_option("-t", "--threshold",
+                  action="store", type="float", dest="threshold",
+                  default=5.0,
+                  help="Percentage by which a statistic must get worse to "
+                  "be reported as a regression [default %default].")
+    (options, args) = op.parse_args()
+
+    if not args or args[0] not in COMMANDS:
+        op.error("Command must be one of: %s" % ', '.join(sorted(COMMANDS)))
+    if not os.path.exists(options.db):
+        op.error("No such database %r" % options.db)
+
+    store = results.ResultsStore(options.db)
+    try:
+        COMMANDS[args[0]](store, options, args[1:])
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
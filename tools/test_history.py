@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Report on the test history recorded by run_tests.py --history.
+
+Commands:
+
+    slowest
+        Rank the tests and fixtures by their median duration over the
+        recorded runs, showing the trend of their latest duration
+        against the median of the earlier ones, and how their latest
+        run split its time between polling for state changes,
+        sleeping, and waiting on API calls.
+
+    show <test>
+        Show the duration and profile of a test in each recorded run.
+        The test may be given by any unique part of its name.
+
+    runs
+        List the recorded runs, with the total time of their tests.
+"""
+
+import optparse
+import os
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+import history
+
+
+def share(part, whole):
+    """Format part as a percentage of whole."""
+
+    if not whole:
+        return '%6s' % '-'
+
+    return '%5.1f%%' % (part * 100.0 / whole)
+
+
+def trend(durations):
+    """Format the change of the latest duration from the earlier ones.
+
+    The latest duration is compared to the median of the earlier ones.
+    """
+
+    earlier = sorted(durations[:-1])
+    if not earlier or not earlier[len(earlier) // 2]:
+        return '-'
+
+    median = earlier[len(earlier) // 2]
+    return '%+.0f%%' % ((durations[-1] - median) * 100.0 / median)
+
+
+def latest(hist, name):
+    """Retrieve the latest record of a test."""
+
+    for run in reversed(hist.runs):
+        if name in run['tests']:
+            return run['tests'][name]
+
+
+def do_slowest(hist, options, args):
+    """Rank the slowest tests."""
+
+    names = set()
+    for run in hist.runs:
+        names.update(run['tests'])
+
+    ranked = sorted(names, key=lambda name: -hist.estimate(name))
+
+    print "%-60s %5s %9s %9s %8s %6s %6s %6s %5s" % (
+        'Test', 'Runs', 'Median', 'Latest', 'Trend', 'Poll', 'Sleep',
+        'API', 'Calls')
+    for name in ranked[:options.count]:
+        durations = hist.durations(name)
+        record = latest(hist, name)
+        print "%-60s %5d %8.1fs %8.1fs %8s %s %s %s %5d" % (
+            name[-60:], len(durations), hist.estimate(name),
+            record['duration'], trend(durations),
+            share(record.get('poll', 0.0), record['duration']),
+            share(record.get('sleep', 0.0), record['duration']),
+            share(record.get('network', 0.0), record['duration']),
+            record.get('api_calls', 0))
+
+
+def do_show(hist, options, args):
+    """Show the history of one test."""
+
+    if len(args) != 1:
+        sys.exit("Usage: show <test>")
+
+    names = set()
+    for run in hist.runs:
+        names.update(name for name in run['tests'] if args[0] in name)
+    if len(names) != 1:
+        sys.exit("%s test matching %r" %
+                 ('No' if not names else 'More than one', args[0]))
+    name = names.pop()
+
+    print name
+    print "%-19s %-8s %9s %9s %9s %9s %5s  %s" % (
+        'Run', 'State', 'Duration', 'Poll', 'Sleep', 'API', 'Calls',
+        'Waits')
+    for run in hist.runs:
+        record = run['tests'].get(name)
+        if record is None:
+            continue
+        print "%-19s %-8s %8.1fs %8.1fs %8.1fs %8.1fs %5d  %s" % (
+            time.strftime('%Y-%m-%d %H:%M:%S',
+                          time.localtime(run['started'])),
+            record['state'], record['duration'], record.get('poll', 0.0),
+            record.get('sleep', 0.0), record.get('network', 0.0),
+            record.get('api_calls', 0),
+            ', '.join('%s %.1fs' % (wait['state'], wait['duration'])
+                      for wait in record.get('waits', [])))
+
+
+def do_runs(hist, options, args):
+    """List the recorded runs."""
+
+    for run in hist.runs:
+        print "%s  %4d tests  %9.1fs" % (
+            time.strftime('%Y-%m-%d %H:%M:%S',
+                          time.localtime(run['started'])),
+            len(run['tests']),
+            sum(record['duration'] for record in run['tests'].values()))
+
+
+COMMANDS = {
+    'slowest': do_slowest,
+    'show': do_show,
+    'runs': do_runs,
+    }
+
+
+def main():
+    op = optparse.OptionParser(usage="%prog [options] <command> [<test>]")
+    op.add_option("-f", "--history",
+                  action="store", type="string", dest="history",
+                  default=".backfire-history.json",
+                  help="The test history file [default %default].")
+    op.add_option("-n", "--count",
+                  action="store", type="int", dest="count", default=20,
+                  help="The number of tests to rank [default %default].")
+    (options, args) = op.parse_args()
+
+    if not args:
+        args = ['slowest']
+    if args[0] not in COMMANDS:
+        op.error("Command must be one of: %s" % ', '.join(sorted(COMMANDS)))
+    if not os.path.exists(options.history):
+        op.error("No such history file %r" % options.history)
+
+    COMMANDS[args[0]](history.History(options.history), options, args[1:])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Trace the HTTP requests of the Nova and Glance clients on the wire.
+
+With --trace-file, every API call is broken down into the phases of
+its HTTP exchange, as seen from httplib, on which both clients are
+built: connecting (only when no kept-alive connection was available),
+sending the request, waiting for the first byte of the response,
+reading the body, and, for Nova, decoding it.  The trace is written
+in the Chrome trace event format, for chrome://tracing or Perfetto;
+each test (or other thread) gets a row of its own, on which each API
+call is a slice containing the slices of its phases.  The stress
+tests also record the time each request spent in each phase, along
+with its request time; see begin() and phases().
+"""
+
+import functools
+import httplib
+import json
+import os
+import threading
+import urlparse
+import weakref
+
+import dtest
+from eventlet import corolocal
+from eventlet import greenthread
+try:
+    import httplib2
+except ImportError:
+    httplib2 = None
+
+import utils
+
+
+class Tracer(object):
+    """Collects trace events, and writes them out as a Chrome trace."""
+
+    def __init__(self):
+        """Initialize a Tracer."""
+
+        self.started = utils.monotonic()
+        self.events = []
+
+        self._lock = threading.Lock()
+        self._threads = weakref.WeakKeyDictionary()
+        self._names = {}
+
+    def _tid(self):
+        """Identify the current thread, naming it after its test."""
+
+        current = greenthread.getcurrent()
+        with self._lock:
+            tid = self._threads.get(current)
+            if tid is None:
+                tid = self._threads[current] = len(self._names) + 1
+                try:
+                    self._names[tid] = str(dtest.status.test)
+                except AttributeError:
+                    self._names[tid] = 'thread %d' % tid
+
+        return tid
+
+    def span(self, name, cat, start, end, **args):
+        """Record a slice of the current thread's time.
+
+        The start and end times are given by utils.monotonic(); any
+        keyword arguments are shown with the slice.
+        """
+
+        event = dict(name=name, cat=cat, ph='X', pid=os.getpid(),
+                     tid=self._tid(),
+                     ts=(start - self.started) * 1000000.0,
+                     dur=(end - start) * 1000000.0)
+        if args:
+            event['args'] = args
+
+        with self._lock:
+            self.events.append(event)
+
+    def dump(self, path):
+        """Write the trace to a file."""
+
+        with self._lock:
+            events = [dict(name='thread_name', ph='M', pid=os.getpid(),
+                           tid=tid, args=dict(name=name))
+                      for tid, name in sorted(self._names.items())]
+            events.extend(self.events)
+
+        with open(path, 'w') as f:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), f)
+
+
+# The tracer, if --trace-file was given
+tracer = None
+
+# Per-thread tracing state: the end of the last wire phase in this
+# thread ('last'), from which the client's decoding of the response is
+# timed; the phases in progress ('stack'), each a list of its name and
+# the time taken by the phases nested in it; and the time spent in
+# each phase by the current request, if one is being timed ('phases')
+_context = corolocal.local()
+
+# The original httplib methods
+_originals = {}
+
+
+def begin():
+    """Start timing the phases of a request made by this thread."""
+
+    if tracer is not None:
+        _context.phases = {}
+
+
+def phases():
+    """Stop timing the phases of the request made by this thread.
+
+    Returns a dictionary mapping the phases to the time, in seconds,
+    spent in each, not counting the phases nested in it (such as
+    connecting while sending); or None if tracing is off.
+    """
+
+    result = getattr(_context, 'phases', None)
+    _context.phases = None
+
+    return result
+
+
+def _phase(name, start, end, nested=0.0):
+    """Add a phase to the request being timed in this thread, if any."""
+
+    timed = getattr(_context, 'phases', None)
+    if timed is not None:
+        timed[name] = timed.get(name, 0.0) + (end - start) - nested
+
+
+def _wire(name, func):
+    """Wrap an httplib method to trace it as a phase.
+
+    Overrides which call the method they override, such as the HTTPS
+    connect() calling the plain one, are only traced once.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if tracer is None:
+            return func(self, *args, **kwargs)
+
+        stack = getattr(_context, 'stack', None)
+        if stack is None:
+            stack = _context.stack = []
+        if any(phase[0] == name for phase in stack):
+            return func(self, *args, **kwargs)
+
+        stack.append([name, 0.0])
+        start = utils.monotonic()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            end = utils.monotonic()
+            nested = stack.pop()[1]
+            if stack:
+                stack[-1][1] += end - start
+            _context.last = end
+            _phase(name, start, end, nested)
+            if name == 'connect':
+                tracer.span(name, 'http', start, end,
+                            host='%s:%s' % (self.host, self.port))
+            elif name == 'read':
+                tracer.span(name, 'http', start, end, size=args[0]
+                            if args and args[0] is not None else 'all')
+            else:
+                tracer.span(name, 'http', start, end)
+
+    return wrapper
+
+
+def install():
+    """Start tracing."""
+
+    global tracer
+
+    tracer = Tracer()
+
+    if not _originals:
+        methods = [(httplib.HTTPConnection, 'connect', 'connect'),
+                   (httplib.HTTPSConnection, 'connect', 'connect'),
+                   (httplib.HTTPConnection, 'request', 'send'),
+                   (httplib.HTTPConnection, 'getresponse', 'wait'),
+                   (httplib.HTTPResponse, 'read', 'read')]
+
+        # The connections of httplib2, which novaclient is built on,
+        # connect by themselves
+        if httplib2 is not None:
+            methods.extend((getattr(httplib2, cls), 'connect', 'connect')
+                           for cls in ('HTTPConnectionWithTimeout',
+                                       'HTTPSConnectionWithTimeout')
+                           if hasattr(httplib2, cls))
+
+        for cls, method, name in methods:
+            _originals[(cls, method)] = vars(cls)[method]
+            setattr(cls, method, _wire(name, vars(cls)[method]))
+
+    return tracer
+
+
+def finish(path):
+    """Stop tracing, and write the trace to path."""
+
+    global tracer
+
+    if tracer is None:
+        return
+
+    tracer.dump(path)
+    tracer = None
+
+
+def client_call(service, func):
+    """Wrap a client's request method to trace its calls.
+
+    The service is "nova", whose client's request method is called
+    with the URL and method, and decodes the response; or "glance",
+    whose client's is called with the method and path.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if tracer is None:
+            return func(*args, **kwargs)
+
+        if service == 'nova':
+            url, method = args[:2]
+            path = urlparse.urlparse(url).path
+        else:
+            method, path = args[:2]
+
+        _context.last = None
+        start = utils.monotonic()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            end = utils.monotonic()
+            if service == 'nova' and _context.last is not None:
+                tracer.span('parse', 'client', _context.last, end)
+                _phase('parse', _context.last, end)
+            tracer.span('%s %s %s' % (service, method, path), 'api',
+                        start, end)
+
+    return wrapper
@@ -13,15 +13,68 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import ctypes
+import ctypes.util
 import datetime
+import random
+import sys
+import threading
 import time
 
 import dtest
+import eventlet
+from eventlet import event
+import novaclient
+
+import base
+import profiler
 
 # Resolution is the time between successive status checks; status_ival
-# is the (approximate) interval between successive status messages
+# is the (approximate) interval between successive status messages.
+# The shared pollers back off from resolution to max_resolution while
+# nothing they are watching changes state, and retry a failed listing
+# poll_retries times before giving up on what they are watching.
 resolution = 1
+max_resolution = 10
 status_ival = 10
+poll_retries = 5
+
+
+def _monotonic_clock():
+    """Find a monotonic, high-resolution clock.
+
+    Uses clock_gettime(CLOCK_MONOTONIC) where the C library provides
+    it, and falls back to time.time() otherwise.
+    """
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or
+                            ctypes.util.find_library('c'), use_errno=True)
+        clock_gettime = librt.clock_gettime
+    except (OSError, AttributeError):
+        return time.time
+
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+    # CLOCK_MONOTONIC
+    if clock_gettime(1, ctypes.byref(timespec())) != 0:
+        return time.time
+
+    def monotonic():
+        ts = timespec()
+        clock_gettime(1, ctypes.byref(ts))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+    return monotonic
+
+
+# Time intervals with monotonic(), which is unaffected by changes to
+# the system clock; its values are only meaningful relative to each
+# other
+monotonic = _monotonic_clock()
 
 
 class StatusTracker(object):
@@ -62,6 +115,33 @@ class StatusTracker(object):
         # Initialize the state pointer.
         self.curr_state_idx = 0
 
+        # When each state was first seen; see observe()
+        self.observations = {}
+
+    def observe(self, state, seen, not_before):
+        """Record when a state was observed.
+
+        The seen argument is the time the state was observed, and
+        not_before the time of the previous observation, so the object
+        entered the state at some time between the two.  Only the
+        first observation of each state is kept, in the observations
+        attribute, which maps state names (case-folded, if the tracker
+        folds case) to (seen, not_before) tuples.
+        """
+
+        if self.foldcase:
+            state = state.lower()
+
+        self.observations.setdefault(state, (seen, not_before))
+
+    def observed(self, state):
+        """Retrieve the (seen, not_before) tuple for a state, or None."""
+
+        if self.foldcase:
+            state = state.lower()
+
+        return self.observations.get(state)
+
     def checkState(self, newstate):
         """Test new state.
 
@@ -101,31 +181,387 @@ class StatusTracker(object):
         reused.
         """
 
+        # When the last poll started
+        last_poll = [monotonic()]
+
         def getState():
             # Get the object...
+            started = monotonic()
             obj = call(*args, **kwargs)
 
             # Get the current state
-            return self.checkState(getattr(obj, attr))
+            self.observe(getattr(obj, attr), monotonic(), last_poll[0])
+            last_poll[0] = started
+            return obj, self.checkState(getattr(obj, attr))
 
         # Loop until we get to the final state (or hit an invalid
         # state)
-        state = getState()
-        counter = 0
-        start = datetime.datetime.now()
-        while state is None:
-            # Emit a status message every 5 times (~10 seconds)
-            if counter > 0 and counter % (status_ival / resolution) == 0:
-                print >>dtest.status, (
-                        'Waiting for state "%s", currently "%s" (%s)' %
-                         (self.final_state,
-                         getattr(call(*args, **kwargs), attr),
-                         datetime.datetime.now() - start))
-
-            counter += 1
-
-            time.sleep(resolution)
-            state = getState()
+        with profiler.waiting(self.final_state):
+            obj, state = getState()
+            counter = 0
+            start = datetime.datetime.now()
+            while state is None:
+                # Emit a status message every 5 times (~10 seconds)
+                if counter > 0 and counter % (status_ival / resolution) == 0:
+                    print >>dtest.status, (
+                            'Waiting for state "%s", currently "%s" (%s)' %
+                             (self.final_state, getattr(obj, attr),
+                             datetime.datetime.now() - start))
+
+                counter += 1
+
+                profiler.sleep(resolution)
+                obj, state = getState()
 
         # Return last state; will be True if it's legal, state name otherwise
         return state
+
+    def waitForPolledState(self, collection, obj, attr='status'):
+        """Wait for the final state, using a shared poller.
+
+        Like waitForState(), but rather than polling the object
+        itself, registers it with the StatusPoller for the given
+        collection ('servers' or 'images'), which retrieves the state
+        of all the objects being waited on with a single list call.
+        The argument 'obj' may be an object or its ID.  Return values
+        are the same as for waitForState(); if the object cannot be
+        retrieved (for instance, because it has been deleted), the
+        exception is raised here.
+        """
+
+        poller = get_poller(collection, attr)
+        watch = poller.watch(self, getattr(obj, 'id', obj))
+
+        try:
+            with profiler.waiting(self.final_state):
+                start = datetime.datetime.now()
+                while True:
+                    # Wait for the poller to tell us about the final
+                    # state
+                    with eventlet.Timeout(status_ival, False):
+                        return watch.event.wait()
+
+                    # Emit a status message
+                    print >>dtest.status, (
+                            'Waiting for state "%s", currently "%s" (%s)' %
+                             (self.final_state,
+                             getattr(watch.obj, attr, None),
+                             datetime.datetime.now() - start))
+        finally:
+            poller.unwatch(watch)
+
+
+class Backoff(object):
+    """Exponential backoff with jitter.
+
+    Each call to next() returns the next interval to sleep for; the
+    intervals grow by a constant factor from the initial interval up
+    to the maximum, and are randomized so that several loops backing
+    off together do not stay in lock-step.  Calling reset() starts
+    over from the initial interval.
+    """
+
+    def __init__(self, initial=None, maximum=None, factor=1.5):
+        """Initialize a Backoff.
+
+        The initial and maximum intervals default to resolution and
+        max_resolution, respectively.
+        """
+
+        self.initial = initial or resolution
+        self.maximum = maximum or max_resolution
+        self.factor = factor
+        self.interval = self.initial
+
+    def reset(self):
+        """Start over from the initial interval."""
+
+        self.interval = self.initial
+
+    def next(self):
+        """Return the next interval to sleep for."""
+
+        interval = self.interval
+        self.interval = min(self.interval * self.factor, self.maximum)
+
+        return random.uniform(interval / 2.0, interval)
+
+
+class Distribution(object):
+    """A random distribution of durations, in seconds.
+
+    Distributions are specified as strings of the form
+    "<kind>:<parameters>", where the parameters are separated by
+    commas.  The kinds are as follows:
+
+    - const:<value>
+        Always the same duration.  A bare number is also taken as a
+        constant.
+
+    - uniform:<low>,<high>
+        Uniformly distributed between low and high.
+
+    - normal:<mean>,<stddev>
+        Normally distributed; negative samples are taken as 0.
+
+    - exponential:<mean>
+        Exponentially distributed with the given mean.
+
+    """
+
+    kinds = {
+        'const': 1,
+        'uniform': 2,
+        'normal': 2,
+        'exponential': 1,
+        }
+
+    def __init__(self, spec, rand=random):
+        """Initialize a Distribution from its specification.
+
+        Samples are drawn from rand, which must provide the methods of
+        a random.Random object.  Raises ValueError if the
+        specification is invalid.
+        """
+
+        self.spec = spec
+        self.rand = rand
+
+        kind, sep, params = spec.partition(':')
+        if not sep:
+            kind, params = 'const', kind
+        if kind not in self.kinds:
+            raise ValueError("Unknown distribution %r" % kind)
+
+        self.kind = kind
+        self.params = [float(p) for p in params.split(',')]
+        if len(self.params) != self.kinds[kind]:
+            raise ValueError("Distribution %r takes %d parameters" %
+                             (kind, self.kinds[kind]))
+
+    def __str__(self):
+        """Return the specification of the distribution."""
+
+        return self.spec
+
+    def sample(self):
+        """Draw a duration from the distribution."""
+
+        if self.kind == 'const':
+            return self.params[0]
+        elif self.kind == 'uniform':
+            return self.rand.uniform(*self.params)
+        elif self.kind == 'normal':
+            return max(self.rand.normalvariate(*self.params), 0.0)
+        else:
+            return self.rand.expovariate(1.0 / self.params[0])
+
+
+class _Watch(object):
+    """An object being waited on through a StatusPoller."""
+
+    def __init__(self, tracker, obj_id, callback=None):
+        """Initialize a _Watch."""
+
+        self.tracker = tracker
+        self.obj_id = obj_id
+        self.obj = None
+        self.event = event.Event()
+        self.callback = callback
+
+        # The outcome, once there is one
+        self.result = None
+        self.exc_info = None
+
+        # When the last poll which could have seen the object started
+        self.last_poll = monotonic()
+
+        # Failed attempts in a row to retrieve the object
+        self.failures = 0
+
+    def send(self, result):
+        """Report the result for the StatusTracker."""
+
+        self.result = result
+        if self.callback:
+            eventlet.spawn_n(self.callback, self)
+        else:
+            self.event.send(result)
+
+    def send_exception(self, *exc_info):
+        """Report an exception raised while watching the object."""
+
+        self.exc_info = exc_info
+        if self.callback:
+            eventlet.spawn_n(self.callback, self)
+        else:
+            self.event.send_exception(*exc_info)
+
+
+class StatusPoller(object):
+    """Poll the states of many objects at once.
+
+    A StatusPoller has its own OpenStack client, and while any object
+    is being watched, it retrieves the detailed listing of one
+    collection ('servers' or 'images') on each tick, feeding the
+    state of each watched object to the StatusTracker waiting on it.
+    Objects missing from the listing are retrieved individually, and
+    their watchers are sent the exception if they are gone or after
+    poll_retries retries of the retrieval have failed too.  The
+    interval between ticks backs off while no watched object changes
+    state, or while the listing fails; the watchers are only sent the
+    exception once poll_retries retries of the listing have failed as
+    well.  Use get_poller() to obtain the shared instance for a
+    collection.
+    """
+
+    def __init__(self, collection, attr='status'):
+        """Initialize a StatusPoller."""
+
+        self.collection = collection
+        self.attr = attr
+
+        self._os = None
+        self._watches = {}
+        self._lock = threading.Lock()
+        self._running = False
+        self._backoff = Backoff()
+
+    def watch(self, tracker, obj_id, callback=None):
+        """Start watching an object on behalf of a StatusTracker.
+
+        Returns a watch object, whose 'event' attribute is sent the
+        result for the StatusTracker once the object enters a final or
+        invalid state; it must be passed to unwatch() when done.
+
+        Alternatively, if a callback is given, nothing need wait on
+        the event: once the object enters a final or invalid state,
+        or cannot be retrieved, the watch is unwatched and the
+        callback is called in a new thread, passing it the watch.  Its
+        'result' attribute holds the result for the StatusTracker, or
+        its 'exc_info' attribute the exception raised.
+        """
+
+        watch = _Watch(tracker, obj_id, callback)
+
+        with self._lock:
+            self._watches.setdefault(obj_id, []).append(watch)
+
+            # Something new to watch, so poll promptly
+            self._backoff.reset()
+
+            # Start polling if we aren't already
+            if not self._running:
+                self._running = True
+                eventlet.spawn_n(self._poll)
+
+        return watch
+
+    def unwatch(self, watch):
+        """Stop watching an object."""
+
+        with self._lock:
+            watches = self._watches.get(watch.obj_id, [])
+            if watch in watches:
+                watches.remove(watch)
+            if not watches:
+                self._watches.pop(watch.obj_id, None)
+
+    def _poll(self):
+        """Poll until there is nothing left to watch."""
+
+        failures = 0
+        while True:
+            with self._lock:
+                if not self._watches:
+                    self._running = False
+                    return
+                watched = dict((obj_id, list(watches)) for obj_id, watches
+                               in self._watches.items())
+
+            try:
+                if self._update(watched):
+                    self._backoff.reset()
+                failures = 0
+            except Exception:
+                # Can't retrieve the listing; a single overLimit or
+                # server error shouldn't fail every wait, so back off
+                # and try again, and only let the waiters know if it
+                # keeps failing
+                failures += 1
+                if failures > poll_retries:
+                    failures = 0
+                    for watches in watched.values():
+                        for watch in watches:
+                            watch.send_exception(*sys.exc_info())
+                            self.unwatch(watch)
+
+            eventlet.sleep(self._backoff.next())
+
+    def _update(self, watched):
+        """Feed the current states to the watchers.
+
+        Returns True if any watched object changed state.
+        """
+
+        if self._os is None:
+            self._os = base.BaseIntegrationTest.getOpenStack()
+        manager = getattr(self._os, self.collection)
+
+        # One call for everything we're watching
+        started = monotonic()
+        objs = dict((obj.id, obj) for obj in manager.list(detailed=True))
+
+        changed = False
+        for obj_id, watches in watched.items():
+            obj = objs.get(obj_id)
+            if obj is None:
+                # Not listed; try to get it directly, so that waiters
+                # see the exception if it's gone.  Other errors may be
+                # transient, so they only fail the wait if they keep
+                # happening
+                try:
+                    obj = manager.get(obj_id)
+                except Exception, e:
+                    gone = isinstance(e, novaclient.exceptions.NotFound)
+                    for watch in watches:
+                        watch.failures += 1
+                        if gone or watch.failures > poll_retries:
+                            watch.send_exception(*sys.exc_info())
+                            self.unwatch(watch)
+                    continue
+
+            state = getattr(obj, self.attr)
+            seen = monotonic()
+            for watch in watches:
+                watch.failures = 0
+                watch.tracker.observe(state, seen, watch.last_poll)
+                watch.last_poll = started
+
+                if (watch.obj is None or
+                    getattr(watch.obj, self.attr) != state):
+                    changed = True
+                watch.obj = obj
+
+                result = watch.tracker.checkState(state)
+                if result is not None:
+                    self.unwatch(watch)
+                    watch.send(result)
+
+        return changed
+
+
+# The shared pollers, by collection and attribute
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+
+def get_poller(collection, attr='status'):
+    """Retrieve the shared StatusPoller for a collection."""
+
+    with _pollers_lock:
+        key = (collection, attr)
+        if key not in _pollers:
+            _pollers[key] = StatusPoller(collection, attr)
+
+        return _pollers[key]